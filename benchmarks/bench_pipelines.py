@@ -0,0 +1,465 @@
+"""
+Per-stage benchmark of the translation pipelines, without Telegram, DeepL nor sign.mt: the
+bot's own pipeline functions run on fake updates, against a local DeepL stub and a local
+sign.mt stub serving .pose fixtures. Whisper and the renderer are the real ones.
+
+For every pipeline it reports latency percentiles of each stage and of the whole pipeline,
+and the throughput at the given concurrency. Results are saved as JSON, named after the git
+commit, to compare runs across commits:
+
+    python benchmarks/bench_pipelines.py -n 20 -c 4
+    python benchmarks/bench_pipelines.py --pipelines audio_to_text --fixtures ~/recordings
+    python benchmarks/bench_pipelines.py --compare benchmarks/results/<older run>.json
+
+A fixtures directory holds recordings used instead of the synthetic inputs: .pose files
+served by the sign.mt stub, .ogg voice notes and .mp4 video notes. Whisper hears nothing in
+the synthetic voice note, audio pipelines only go all the way with recorded ones. Likewise
+the synthetic video note has no signer in it: sign_to_text decodes it and extracts poses from
+it, but only recorded video notes get recognized, among templates made of the served poses.
+
+Caches are bypassed (looked up, never found, still written), use --warm-caches to let them hit.
+"""
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import functools
+import glob
+import inspect
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from sign_recognition import save_templates
+from webhook import serve_http
+from benchmarks.synthetic import synthetic_pose_bytes, synthetic_video_note, synthetic_voice_note
+
+TEXTS = [
+    "Hello, how are you?", "Good morning", "Where is the train station?", "Thank you very much", "Goodbye",
+    # Signed a sentence at a time
+    "Good morning. Where is the train station? I have to be in Rome by noon, thank you very much.",
+]
+PIPELINES = ["text_to_text", "text_to_sign", "pose_to_video", "audio_to_text", "audio_to_sign", "sign_to_text"]
+
+# Pipeline the running code belongs to, stage timings are filed under it
+_current_pipeline = contextvars.ContextVar("pipeline", default=None)
+
+
+class ServiceStubs:
+    """Local stand-ins for DeepL's /v2/translate and sign.mt, answering after a fixed latency."""
+
+    def __init__(self, poses: list, deepl_latency: float, signmt_latency: float):
+        self.poses = poses
+        self.deepl_latency = deepl_latency
+        self.signmt_latency = signmt_latency
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes):
+        url = urlsplit(path)
+        if url.path == "/v2/translate":
+            await asyncio.sleep(self.deepl_latency)
+            request = json.loads(body)
+            detected = (request.get("source_lang") or "EN").upper()
+            translations = [
+                {
+                    "detected_source_language": detected, "text": f"{text} [{request['target_lang']}]",
+                    "billed_characters": len(text),
+                }
+                for text in request["text"]
+            ]
+            return 200, json.dumps({"translations": translations}).encode()
+        if url.path == "/signmt":
+            await asyncio.sleep(self.signmt_latency)
+            text = parse_qs(url.query)["text"][0]
+            return 200, self.poses[zlib.crc32(text.encode()) % len(self.poses)]
+        return 404, b""
+
+
+class FakeFile:
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def download_to_memory(self, out):
+        out.write(self.data)
+
+
+class FakeMessage:
+    """The part of telegram.Message the pipelines use, replies are answered right away."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, chat_id: int, text: str = None, media: bytes = None, video=None):
+        self.message_id = self.id = next(self._ids)
+        self.chat_id = chat_id
+        self.text = text
+        self.media = media
+        self.video = video
+        self.replies = []
+
+    async def get_file(self):
+        return FakeFile(self.media)
+
+    async def reply_text(self, text: str, **kwargs):
+        self.replies.append(text)
+        return FakeMessage(self.chat_id, text=text)
+
+    async def edit_text(self, text: str, **kwargs):
+        self.text = text
+        return self
+
+    async def reply_video(self, video, **kwargs):
+        # PTB reads uploads whole before posting them
+        if hasattr(video, "read"):
+            video.read()
+        self.replies.append("<video>")
+        return FakeMessage(self.chat_id, video=SimpleNamespace(file_id=f"bench-video-{next(self._ids)}"))
+
+
+def fake_update(chat_id: int, text: str = None, media: bytes = None):
+    user = SimpleNamespace(id=chat_id)
+    return SimpleNamespace(
+        message=FakeMessage(chat_id, text=text, media=media), effective_user=user, effective_chat=user
+    )
+
+
+class _ColdCache:
+    """Stands in for a cache: stores as usual, but lookups never find anything."""
+
+    def __init__(self, cache, lookups: dict):
+        self._cache = cache
+        self._lookups = lookups  # name -> whether the method is a coroutine
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self._lookups:
+            return getattr(self._cache, name)
+        if self._lookups[name]:
+            async def miss(*args, **kwargs):
+                return None
+        else:
+            def miss(*args, **kwargs):
+                return None
+        return miss
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.samples = {}  # (pipeline, stage) -> seconds
+
+    def record(self, stage: str, seconds: float):
+        pipeline = _current_pipeline.get()
+        if pipeline is not None:
+            self.samples.setdefault((pipeline, stage), []).append(seconds)
+
+    def wrap(self, owner, name: str, stage: str):
+        """Replaces owner.name with a version recording its duration as `stage`."""
+        original = getattr(owner, name)
+        if inspect.isasyncgenfunction(original):
+            @functools.wraps(original)
+            async def timed(*args, **kwargs):
+                # Only the time spent producing items counts, not the caller's work between them
+                seconds = 0.0
+                items = original(*args, **kwargs)
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = await anext(items)
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            seconds += time.perf_counter() - start
+                        yield item
+                finally:
+                    await items.aclose()
+                    self.record(stage, seconds)
+        elif asyncio.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        else:
+            @functools.wraps(original)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        setattr(owner, name, timed)
+
+
+def _import_bot(stubs_url: str, work_dir: str):
+    """Imports main configured for the stubs, with its caches and databases in work_dir."""
+    os.environ.update({
+        "BOT_TOKEN": "123:bench", "DEEPL_TOKEN": "bench", "DEEPL_SERVER_URL": stubs_url,
+        "SIGNMT_BASE_URL": f"{stubs_url}/signmt", "PRELOAD": "",
+    })
+    os.chdir(work_dir)
+    import main
+    # One line per stub request otherwise
+    logging.getLogger("deepl").setLevel(logging.WARNING)
+    return main
+
+
+def _load_fixtures(directory: str, pattern: str) -> list:
+    if not directory:
+        return []
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, pattern))):
+        with open(path, "rb") as f:
+            fixtures.append(f.read())
+    return fixtures
+
+
+def _pipelines(bot, poses: list, voice_notes: list, video_notes: list) -> dict:
+    spoken_src, spoken_dst = bot.KEYBOARD_LANG_LIST[1]["text"], bot.KEYBOARD_LANG_LIST[0]["text"]
+    signed = bot.KEYBOARD_LANG_LIST[6]["text"]
+
+    async def text_to_text(i: int):
+        update = fake_update(i, text=TEXTS[i % len(TEXTS)])
+        return await bot.text_to_text(update, update.message.text, spoken_src, spoken_dst) is not None
+
+    async def text_to_sign(i: int):
+        update = fake_update(i, text=TEXTS[i % len(TEXTS)])
+        video = await bot.text_to_sign(update, update.message.text, spoken_src, signed)
+        if video is None:
+            return False
+        await bot.reply_sign_video(update, video)
+        return True
+
+    async def pose_to_video(i: int):
+        (await bot.pose_to_video(poses[i % len(poses)])).close()
+        return True
+
+    async def decode_voice_note(update):
+        with await bot.download(await update.message.get_file()) as voice:
+            return await bot.decode_audio(voice)
+
+    async def audio_to_text(i: int):
+        update = fake_update(i, media=voice_notes[i % len(voice_notes)])
+        audio = await decode_voice_note(update)
+        return await bot.audio_to_text(update, audio, spoken_src, spoken_dst) is not None
+
+    async def audio_to_sign(i: int):
+        update = fake_update(i, media=voice_notes[i % len(voice_notes)])
+        audio = await decode_voice_note(update)
+        video = await bot.audio_to_sign(update, audio, spoken_src, signed)
+        if video is None:
+            return False
+        await bot.reply_sign_video(update, video)
+        return True
+
+    async def sign_to_text(i: int):
+        update = fake_update(i, media=video_notes[i % len(video_notes)])
+        with await bot.download(await update.message.get_file()) as video:
+            return await bot.sign_to_text(update, video, signed, spoken_src) is not None
+
+    return {
+        "text_to_text": text_to_text, "text_to_sign": text_to_sign, "pose_to_video": pose_to_video,
+        "audio_to_text": audio_to_text, "audio_to_sign": audio_to_sign, "sign_to_text": sign_to_text,
+    }
+
+
+def _instrument(bot, timer: StageTimer, warm_caches: bool):
+    if not warm_caches:
+        bot.pose_cache = _ColdCache(bot.pose_cache, {"get": True})
+        bot.render_cache = _ColdCache(bot.render_cache, {"get_file_id": False, "get_path": True})
+        bot.translator.cache = _ColdCache(bot.translator.cache, {"get": True})
+
+    timer.wrap(bot, "_detect_lang_locally", "detect language")
+    timer.wrap(bot.translator, "translate_text", "translate")
+    timer.wrap(bot.signmt_client, "fetch_pose", "sign.mt")
+    timer.wrap(bot, "pose_to_video", "render")
+    timer.wrap(bot.render_cache, "put_video", "cache video")
+    timer.wrap(bot, "reply_sign_video", "upload")
+    timer.wrap(bot, "download", "download")
+    timer.wrap(bot, "decode_audio", "decode audio")
+    # transcribe goes through transcribe_segments too, one sample per voice note either way
+    timer.wrap(bot.transcription_pool, "transcribe_segments", "transcribe")
+    timer.wrap(bot.recognition_pool, "recognize", "recognize")
+    timer.wrap(bot, "sign_to_text", "sign to text")
+
+
+async def _run_pipeline(name: str, pipeline, iterations: int, concurrency: int, warmup: int, timer: StageTimer):
+    for i in range(warmup):
+        await pipeline(i)
+
+    _current_pipeline.set(name)
+    indexes = iter(range(warmup, warmup + iterations))
+    failed = 0
+
+    async def worker():
+        nonlocal failed
+        for i in indexes:
+            start = time.perf_counter()
+            if not await pipeline(i):
+                failed += 1
+            timer.record("total", time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    _current_pipeline.set(None)
+    return {
+        "iterations": iterations, "failed": failed, "seconds": round(seconds, 3),
+        "throughput_per_s": round(iterations / seconds, 2),
+    }
+
+
+def _distribution(samples: list) -> dict:
+    samples = sorted(samples)
+
+    def percentile(p):
+        return round(samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000, 2)
+
+    return {
+        "count": len(samples), "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+        "p50_ms": percentile(50), "p95_ms": percentile(95), "p99_ms": percentile(99),
+        "max_ms": round(samples[-1] * 1000, 2),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def print_results(results: dict):
+    for name, pipeline in results["pipelines"].items():
+        print(f"\n{name}: {pipeline['iterations']} runs, {pipeline['failed']} failed, "
+              f"{pipeline['throughput_per_s']} per second")
+        for stage, distribution in pipeline["stages"].items():
+            print(f"  {stage:<16} x{distribution['count']:<4} p50 {distribution['p50_ms']:9.1f} ms  "
+                  f"p95 {distribution['p95_ms']:9.1f} ms  p99 {distribution['p99_ms']:9.1f} ms")
+
+
+def print_comparison(baseline: dict, results: dict):
+    print(f"\nCompared with {baseline['commit']} (p50, ratio above 1 is slower now):")
+    for name, pipeline in results["pipelines"].items():
+        old_pipeline = baseline["pipelines"].get(name)
+        if old_pipeline is None:
+            continue
+        print(f"  {name}: throughput {old_pipeline['throughput_per_s']} -> {pipeline['throughput_per_s']} per second")
+        for stage, distribution in pipeline["stages"].items():
+            old = old_pipeline["stages"].get(stage)
+            if old is None or not old["p50_ms"]:
+                continue
+            print(f"    {stage:<16} {old['p50_ms']:9.1f} -> {distribution['p50_ms']:9.1f} ms  "
+                  f"x{distribution['p50_ms'] / old['p50_ms']:.2f}")
+
+
+async def run(args) -> dict:
+    poses = _load_fixtures(args.fixtures, "*.pose") or [synthetic_pose_bytes(num_frames=100, seed=i) for i in range(3)]
+    voice_notes = _load_fixtures(args.fixtures, "*.ogg") or [synthetic_voice_note()]
+    video_notes = _load_fixtures(args.fixtures, "*.mp4") or [synthetic_video_note()]
+
+    stubs = ServiceStubs(poses, args.deepl_latency, args.signmt_latency)
+    server = await serve_http(stubs.handle, "127.0.0.1", args.port)
+    work_dir = tempfile.TemporaryDirectory(prefix="bench-pipelines-")
+    bot = _import_bot(f"http://127.0.0.1:{args.port}", work_dir.name)
+    # What the signed video notes get recognized as: the texts whose poses the sign.mt stub serves
+    signed = bot.LANGUAGE_DICT[bot.KEYBOARD_LANG_LIST[6]["text"]]
+    save_templates(bot.SIGN_TEMPLATES_DIR, [
+        (f"{i}.pose", pose_bytes, TEXTS[i % len(TEXTS)], "en", signed) for i, pose_bytes in enumerate(poses)
+    ])
+    timer = StageTimer()
+    _instrument(bot, timer, args.warm_caches)
+    pipelines = _pipelines(bot, poses, voice_notes, video_notes)
+
+    results = {
+        "commit": _git_commit(), "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "machine": f"{platform.machine()} x{os.cpu_count()}",
+        "settings": vars(args), "pipelines": {},
+    }
+    try:
+        if any(name.startswith("audio") for name in args.pipelines):
+            await bot.transcription_pool.warm_up()
+        if "sign_to_text" in args.pipelines:
+            await bot.recognition_pool.warm_up()
+        if any(name.endswith("sign") or name == "pose_to_video" for name in args.pipelines):
+            await bot.render_farm.warm_up()
+        for name in args.pipelines:
+            # The bot prints a lot, keep it out of the report
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                pipeline = await _run_pipeline(name, pipelines[name], args.iterations, args.concurrency,
+                                               args.warmup, timer)
+            pipeline["stages"] = {
+                stage: _distribution(samples) for (pipeline_name, stage), samples in timer.samples.items()
+                if pipeline_name == name
+            }
+            results["pipelines"][name] = pipeline
+    finally:
+        bot.transcription_pool.shutdown()
+        bot.recognition_pool.shutdown()
+        bot.render_farm.shutdown()
+        await bot.signmt_client.aclose()
+        bot.translation_cache.close()
+        bot.render_cache.close()
+        bot.user_prefs.close()
+        server.close()
+        os.chdir(ROOT)
+        work_dir.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipelines", default=",".join(PIPELINES), help=f"comma separated, among {', '.join(PIPELINES)}")
+    parser.add_argument("-n", "--iterations", type=int, default=10, help="measured runs of each pipeline")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="runs of a pipeline in flight at once")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured runs of each pipeline first")
+    parser.add_argument("--fixtures", help="directory of recorded .pose, .ogg and .mp4 fixtures")
+    parser.add_argument("--deepl-latency", type=float, default=0.1, help="seconds the DeepL stub takes to answer")
+    parser.add_argument("--signmt-latency", type=float, default=0.5, help="seconds the sign.mt stub takes to answer")
+    parser.add_argument("--warm-caches", action="store_true", help="let the pose, render and translation caches hit")
+    parser.add_argument("--port", type=int, default=8091, help="port of the DeepL and sign.mt stubs")
+    parser.add_argument("-o", "--output", help="results JSON, benchmarks/results/<commit>-<time>.json by default")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare with")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show what the bot prints")
+    args = parser.parse_args()
+    args.pipelines = [name.strip() for name in args.pipelines.split(",") if name.strip()]
+    unknown = set(args.pipelines) - set(PIPELINES)
+    if unknown:
+        parser.error(f"unknown pipelines: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"{results['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
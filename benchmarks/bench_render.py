@@ -0,0 +1,121 @@
+"""
+Compares the vectorized streaming renderer with pose_format's PoseVisualizer, then the
+render profiles of consts.RENDER_PROFILES with each other.
+
+    python benchmarks/bench_render.py                  # synthetic 4 seconds pose
+    python benchmarks/bench_render.py hello.pose -r 5  # a pose fetched from sign.mt
+"""
+import argparse
+import io
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pose_format import Pose
+from pose_format.pose_visualizer import PoseVisualizer
+
+from consts import RENDER_PROFILES
+from renderer import PoseRenderer, encode_frames, render_video
+from benchmarks.synthetic import synthetic_pose_bytes
+
+
+def render_with_visualizer(pose_bytes: bytes, path: str):
+    pose = Pose.read(pose_bytes)
+    v = PoseVisualizer(pose)
+    v.save_video(path, v.draw((0, 0, 0)))
+
+
+def render_with_renderer(pose_bytes: bytes, path: str):
+    PoseRenderer(Pose.read(pose_bytes), background_color=(0, 0, 0)).save_video(path)
+
+
+def render_with_visualizer_same_encoder(pose_bytes: bytes, path: str, preset: str = "veryfast"):
+    pose = Pose.read(pose_bytes)
+    v = PoseVisualizer(pose)
+    width, height = pose.header.dimensions.width, pose.header.dimensions.height
+    encode_frames(v.draw((0, 0, 0)), path, float(pose.body.fps), width, height, pixel_format="bgr24", preset=preset)
+
+
+def render_with_visualizer_as_before(pose_bytes: bytes, path: str):
+    # What PoseVisualizer.save_video asks ffmpeg for, without needing the ffmpeg executable
+    render_with_visualizer_same_encoder(pose_bytes, path, preset="fast")
+
+
+def draw_only_visualizer(pose_bytes: bytes, _):
+    v = PoseVisualizer(Pose.read(pose_bytes))
+    for _ in v.draw((0, 0, 0)):
+        pass
+
+
+def draw_only_renderer(pose_bytes: bytes, _):
+    for _ in PoseRenderer(Pose.read(pose_bytes)).frames():
+        pass
+
+
+def bench(name, fn, pose_bytes, repeat, num_frames):
+    timings = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i in range(repeat):
+            start = time.perf_counter()
+            fn(pose_bytes, os.path.join(tmp_dir, f"{i}.mp4"))
+            timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(f"{name:<28} best {best * 1000:8.1f} ms  mean {sum(timings) / len(timings) * 1000:8.1f} ms  "
+          f"{num_frames / best:7.1f} frames/s")
+    return best
+
+
+def bench_profiles(pose_bytes: bytes, repeat: int):
+    print()
+    for name, settings in RENDER_PROFILES.items():
+        timings = []
+        for _ in range(repeat):
+            output = io.BytesIO()
+            start = time.process_time()
+            render_video(Pose.read(pose_bytes), output, **settings)
+            timings.append(time.process_time() - start)
+        print(f"profile {name:<20} best {min(timings) * 1000:8.1f} ms CPU  {len(output.getvalue()) / 1024:8.1f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pose", nargs="?", help=".pose file, a synthetic one is generated when missing")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-f", "--frames", type=int, default=100, help="frames of the synthetic pose")
+    args = parser.parse_args()
+
+    if args.pose:
+        with open(args.pose, "rb") as f:
+            pose_bytes = f.read()
+    else:
+        pose_bytes = synthetic_pose_bytes(num_frames=args.frames)
+    pose = Pose.read(pose_bytes)
+    num_frames = len(pose.body.data)
+    print(f"{num_frames} frames, {pose.header.dimensions.width}x{pose.header.dimensions.height}, "
+          f"{pose.header.total_points()} points\n")
+
+    draw_before = bench("draw  PoseVisualizer", draw_only_visualizer, pose_bytes, args.repeat, num_frames)
+    draw_after = bench("draw  PoseRenderer", draw_only_renderer, pose_bytes, args.repeat, num_frames)
+    if shutil.which("ffmpeg") is None:
+        print("\nNo ffmpeg executable: PoseVisualizer.save_video falls back to OpenCV's mp4v writer, "
+              "its timings below are not those of production, '+ fast' encodes as its ffmpeg would")
+    bench("video PoseVisualizer", render_with_visualizer, pose_bytes, args.repeat, num_frames)
+    total_before = bench("video PoseVisualizer + fast", render_with_visualizer_as_before, pose_bytes, args.repeat,
+                         num_frames)
+    same_encoder = bench("video PoseVisualizer + PyAV", render_with_visualizer_same_encoder, pose_bytes,
+                         args.repeat, num_frames)
+    total_after = bench("video PoseRenderer", render_with_renderer, pose_bytes, args.repeat, num_frames)
+
+    print(f"\ndraw speedup x{draw_before / draw_after:.2f}, end to end speedup x{total_before / total_after:.2f} "
+          f"against libx264 'fast' as before (x{same_encoder / total_after:.2f} with the same encoder)")
+    bench_profiles(pose_bytes, args.repeat)
+    print(f"\npeak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
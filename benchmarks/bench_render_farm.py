@@ -0,0 +1,102 @@
+"""
+Render throughput of the render farm for several worker counts, against rendering in a
+thread of the bot's process as before, and how late the event loop gets meanwhile.
+
+    python benchmarks/bench_render_farm.py                        # 1, 2, 4... up to one worker per core
+    python benchmarks/bench_render_farm.py -w 1 4 -c 8 -p high    # given worker counts and concurrency
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pose_format import Pose
+
+from consts import RENDER_PROFILES, RENDER_SEGMENT_FRAMES
+from render_farm import RenderFarm
+from renderer import render_video
+from benchmarks.synthetic import synthetic_pose_bytes
+
+# Period of the heartbeat measuring the event loop's lag, seconds
+HEARTBEAT = 0.01
+
+
+async def _max_loop_lag(stop: asyncio.Event) -> float:
+    lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT)
+        lag = max(lag, time.perf_counter() - start - HEARTBEAT)
+    return lag
+
+
+async def _run(render, poses: list, renders: int, concurrency: int) -> dict:
+    indexes = iter(range(renders))
+    sizes = []
+
+    async def worker():
+        for i in indexes:
+            output = io.BytesIO()
+            await render(poses[i % len(poses)], output)
+            sizes.append(output.tell())
+
+    stop = asyncio.Event()
+    heartbeat = asyncio.create_task(_max_loop_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    stop.set()
+    return {"seconds": seconds, "videos_per_s": renders / seconds, "max_lag": await heartbeat,
+            "kb": sum(sizes) / len(sizes) / 1024}
+
+
+def _print(name: str, result: dict, baseline: dict = None):
+    speedup = f"  x{result['videos_per_s'] / baseline['videos_per_s']:.2f}" if baseline else ""
+    print(f"{name:<22} {result['seconds']:7.2f} s  {result['videos_per_s']:6.2f} videos/s  "
+          f"max loop lag {result['max_lag'] * 1000:7.1f} ms  {result['kb']:7.1f} KB{speedup}")
+
+
+async def bench(args):
+    poses = [synthetic_pose_bytes(num_frames=frames) for frames in args.frames]
+    settings = RENDER_PROFILES[args.profile]
+    print(f"{args.renders} renders of {args.frames} frames poses, {args.profile} profile, "
+          f"{args.concurrency} at once, {os.cpu_count()} cores\n")
+
+    async def in_thread(pose_bytes: bytes, output):
+        await asyncio.to_thread(lambda: render_video(Pose.read(pose_bytes), output, **settings))
+
+    baseline = await _run(in_thread, poses, args.renders, args.concurrency)
+    _print("thread (before)", baseline)
+
+    for workers in args.workers:
+        farm = RenderFarm(workers, args.segment_frames)
+        try:
+            await farm.warm_up()
+            await _run(lambda pose_bytes, output: farm.render(pose_bytes, output, settings), poses, workers, workers)
+            result = await _run(lambda pose_bytes, output: farm.render(pose_bytes, output, settings), poses,
+                                args.renders, args.concurrency)
+        finally:
+            farm.shutdown()
+        _print(f"farm {workers} worker(s)", result, baseline)
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-w", "--workers", type=int, nargs="+",
+                        default=sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)}))
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="renders requested at once")
+    parser.add_argument("-n", "--renders", type=int, default=16)
+    parser.add_argument("-f", "--frames", type=int, nargs="+", default=[100, 400],
+                        help="frames of the synthetic poses, taken in turn")
+    parser.add_argument("-p", "--profile", default="standard", choices=list(RENDER_PROFILES))
+    parser.add_argument("-s", "--segment-frames", type=int, default=RENDER_SEGMENT_FRAMES)
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
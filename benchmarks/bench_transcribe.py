@@ -0,0 +1,97 @@
+"""
+Throughput and latency of the transcription pool with micro-batching off (batch size 1) and
+on, for the same voice notes requested at a fixed concurrency.
+
+    python benchmarks/bench_transcribe.py                             # synthetic 5 s notes, batch sizes 1, 4, 8
+    python benchmarks/bench_transcribe.py -b 1 8 -c 16 --fixtures dir # recorded .ogg voice notes
+
+Synthetic notes are mostly heard as silence, use recorded ones to time whole transcriptions.
+"""
+import argparse
+import asyncio
+import glob
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from consts import WHISPER_BATCH_WAIT, WHISPER_MODEL_NAME
+from media import decode_audio
+from transcriber import TranscriptionPool
+from benchmarks.synthetic import synthetic_voice_note
+
+
+async def _load_notes(args) -> list:
+    if args.fixtures:
+        paths = sorted(glob.glob(os.path.join(args.fixtures, "*.ogg")))
+        if not paths:
+            raise SystemExit(f"No .ogg voice notes in {args.fixtures}")
+        notes = []
+        for path in paths:
+            with open(path, "rb") as f:
+                notes.append(f.read())
+    else:
+        notes = [synthetic_voice_note(seconds=args.seconds, seed=seed) for seed in range(8)]
+    return [await decode_audio(io.BytesIO(note)) for note in notes]
+
+
+async def _run(pool: TranscriptionPool, notes: list, count: int, concurrency: int) -> dict:
+    indexes = iter(range(count))
+    latencies = []
+
+    async def worker():
+        for i in indexes:
+            started = time.perf_counter()
+            await pool.transcribe(notes[i % len(notes)])
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "seconds": seconds, "notes_per_s": count / seconds, "p50": statistics.median(latencies),
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+async def bench(args):
+    notes = await _load_notes(args)
+    audio_seconds = sum(len(note) for note in notes) / len(notes) / 16000
+    print(f"{args.notes} transcriptions of {len(notes)} notes of {audio_seconds:.1f} s on average, Whisper "
+          f"'{args.model}', {args.workers} worker(s), {args.concurrency} at once\n")
+
+    baseline = None
+    for batch_size in args.batch_sizes:
+        pool = TranscriptionPool(args.model, args.workers, max_queue=args.notes, batch_size=batch_size,
+                                 max_wait=args.max_wait)
+        try:
+            await pool.warm_up()
+            await _run(pool, notes, args.workers * batch_size, args.workers * batch_size)
+            result = await _run(pool, notes, args.notes, args.concurrency)
+        finally:
+            pool.shutdown()
+        baseline = baseline or result
+        print(f"batch size {batch_size:<3} {result['seconds']:7.2f} s  {result['notes_per_s']:6.2f} notes/s  "
+              f"p50 {result['p50']:6.2f} s  p95 {result['p95']:6.2f} s  "
+              f"x{result['notes_per_s'] / baseline['notes_per_s']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-b", "--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="transcriptions requested at once")
+    parser.add_argument("-n", "--notes", type=int, default=32, help="transcriptions of each run")
+    parser.add_argument("-w", "--workers", type=int, default=1)
+    parser.add_argument("-m", "--model", default=WHISPER_MODEL_NAME)
+    parser.add_argument("--max-wait", type=float, default=WHISPER_BATCH_WAIT, help="seconds a batch waits to fill up")
+    parser.add_argument("--seconds", type=float, default=5, help="length of the synthetic voice notes")
+    parser.add_argument("--fixtures", help="directory of recorded .ogg voice notes")
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Stand-in for the Telegram Bot API, to run the bot locally under load without Telegram.
+
+It answers the Bot API calls the bot makes (getMe, sendMessage, sendVideo, ...), and plays
+`--chats` users sending `--messages` text messages in total, posted to the bot's webhook or
+served through getUpdates. Once every message got a reply, or after `--timeout` seconds,
+it prints reply latencies as JSON.
+
+    python benchmarks/fake_bot_api.py --port 8081 --webhook http://127.0.0.1:8443/webhook
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123:fake BOT_MODE=webhook \\
+        WEBHOOK_URL=http://127.0.0.1:8443/webhook python main.py
+"""
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qs
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from webhook import SECRET_TOKEN_HEADER, serve_http
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "PolySignAI", "username": "fake_polysignai_bot"}
+TEXTS = ["Hello, how are you?", "Good morning", "Where is the train station?", "Thank you very much", "Goodbye"]
+
+
+def _parse_params(headers: dict, body: bytes) -> dict:
+    """Bot API call parameters, PTB sends them form encoded, or as multipart with uploads."""
+    content_type = headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"content-type: {content_type}\r\n\r\n".encode() + body
+        )
+        return {
+            part.get_param("name", header="content-disposition"): part.get_content()
+            for part in message.iter_parts() if part.get_filename() is None
+        }
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    return {name: values[0] for name, values in parse_qs(body.decode()).items()}
+
+
+def _json_param(params: dict, name: str):
+    value = params.get(name)
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+class FakeBotAPI:
+
+    def __init__(self, webhook_url: str = None, secret_token: str = None):
+        self.webhook_url = webhook_url
+        self.secret_token = secret_token
+        self.calls = {}
+        self.failed_posts = 0
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._pending_updates = []
+        self._updates_available = asyncio.Event()
+        # (chat_id, message_id) of every user message -> [sent at, first reply at, last reply at, replies]
+        self.messages = {}
+
+    def _message(self, chat_id: int, **content) -> dict:
+        return {
+            "message_id": next(self._message_ids), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}, **content
+        }
+
+    def _record_reply(self, chat_id: int, params: dict):
+        reply_parameters = _json_param(params, "reply_parameters") or {}
+        message_id = reply_parameters.get("message_id") or _json_param(params, "reply_to_message_id")
+        record = self.messages.get((chat_id, message_id))
+        if record is not None:
+            now = time.perf_counter()
+            record[1] = record[1] or now
+            record[2] = now
+            record[3] += 1
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes):
+        if path.startswith("/file/"):
+            return 404, b""
+        api_method = path.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = _parse_params(headers, body)
+
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method == "getUpdates":
+            result = await self._get_updates(int(params.get("offset", 0)), float(params.get("timeout", 0)))
+        elif api_method in ("setWebhook", "deleteWebhook"):
+            self.webhook_url = params.get("url") or None
+            result = True
+        elif api_method == "sendChatAction":
+            result = True
+        elif api_method.startswith("send") or api_method.startswith("edit"):
+            chat_id = int(params.get("chat_id", 0))
+            self._record_reply(chat_id, params)
+            content = {"text": params["text"]} if "text" in params else {}
+            if api_method == "sendVideo":
+                content["video"] = {
+                    "file_id": f"video{next(self._message_ids)}", "file_unique_id": "video",
+                    "width": 640, "height": 480, "duration": 4
+                }
+            result = self._message(chat_id, **content)
+            result["from"] = BOT_USER
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    async def _get_updates(self, offset: int, timeout: float) -> list:
+        self._pending_updates = [update for update in self._pending_updates if update["update_id"] >= offset]
+        if not self._pending_updates and timeout > 0:
+            self._updates_available.clear()
+            try:
+                await asyncio.wait_for(self._updates_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._pending_updates[:100]
+
+    def text_update(self, chat_id: int, text: str) -> dict:
+        message = self._message(chat_id, text=text)
+        message["from"] = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    async def post_update(self, client: httpx.AsyncClient, update: dict, track: bool = True):
+        message = update["message"]
+        if track:
+            self.messages[(message["chat"]["id"], message["message_id"])] = [time.perf_counter(), None, None, 0]
+        if self.webhook_url is None:
+            self._pending_updates.append(update)
+            self._updates_available.set()
+            return
+        headers = {SECRET_TOKEN_HEADER: self.secret_token} if self.secret_token else {}
+        try:
+            response = await client.post(self.webhook_url, json=update, headers=headers)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            # Telegram would retry later, count it as a failure of the bot
+            self.failed_posts += 1
+            print(f"Posting update {update['update_id']} failed: {e!r}")
+
+    def summary(self) -> dict:
+        def percentiles(values: list) -> dict:
+            values = sorted(values)
+            if not values:
+                return {}
+            return {
+                f"p{p}": round(values[min(len(values) - 1, len(values) * p // 100)] * 1000, 1) for p in (50, 95, 99)
+            }
+
+        answered = [record for record in self.messages.values() if record[1] is not None]
+        return {
+            "messages": len(self.messages),
+            "answered": len(answered),
+            "replies": sum(record[3] for record in answered),
+            "failed_posts": self.failed_posts,
+            "first_reply_ms": percentiles([record[1] - record[0] for record in answered]),
+            "last_reply_ms": percentiles([record[2] - record[0] for record in answered]),
+            "api_calls": self.calls,
+        }
+
+
+async def run(args):
+    api = FakeBotAPI(args.webhook, args.secret)
+    server = await serve_http(api.handle, "127.0.0.1", args.port)
+    print(f"Fake Bot API listening on http://127.0.0.1:{args.port}, waiting {args.startup_wait}s for the bot")
+    await asyncio.sleep(args.startup_wait)
+
+    chat_ids = [1000 + i for i in range(args.chats)]
+    async with httpx.AsyncClient(timeout=30) as client:
+        # Users start the bot first, it sets up their language settings
+        await asyncio.gather(*(api.post_update(client, api.text_update(chat_id, "/start"), track=False)
+                               for chat_id in chat_ids))
+        await asyncio.sleep(1)
+
+        started = time.perf_counter()
+        posts = []
+        for i in range(args.messages):
+            update = api.text_update(chat_ids[i % len(chat_ids)], TEXTS[i % len(TEXTS)])
+            posts.append(asyncio.create_task(api.post_update(client, update)))
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+        await asyncio.gather(*posts)
+
+        while time.perf_counter() - started < args.timeout:
+            if all(record[1] is not None for record in api.messages.values()):
+                break
+            await asyncio.sleep(0.1)
+
+    server.close()
+    summary = api.summary()
+    summary["seconds"] = round(time.perf_counter() - started, 2)
+    print(json.dumps(summary, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--webhook", help="bot webhook URL, the bot polls getUpdates when omitted")
+    parser.add_argument("--secret", help="webhook secret token, as in WEBHOOK_SECRET")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=0, help="messages per second, 0 sends them all at once")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--startup-wait", type=float, default=10, help="seconds to wait for the bot to start")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Synthetic inputs for the benchmarks, shaped like what the bot gets in production."""
+import numpy as np
+import numpy.ma as ma
+from pose_format import Pose
+from pose_format.numpy import NumPyPoseBody
+from pose_format.pose_header import PoseHeader, PoseHeaderComponent, PoseHeaderDimensions
+
+HAND_LIMBS = [
+    (0, 1), (1, 2), (2, 3), (3, 4), (0, 5), (5, 6), (6, 7), (7, 8), (5, 9), (9, 10), (10, 11), (11, 12),
+    (9, 13), (13, 14), (14, 15), (15, 16), (13, 17), (0, 17), (17, 18), (18, 19), (19, 20),
+]
+BODY_LIMBS = [
+    (11, 12), (11, 13), (13, 15), (12, 14), (14, 16), (11, 23), (12, 24), (23, 24),
+    (0, 1), (1, 2), (2, 3), (3, 7), (0, 4), (4, 5), (5, 6), (6, 8), (9, 10),
+    (15, 17), (15, 19), (15, 21), (17, 19), (16, 18), (16, 20), (16, 22), (18, 20),
+    (23, 25), (25, 27), (24, 26), (26, 28), (27, 29), (28, 30), (29, 31), (30, 32), (27, 31), (28, 32),
+]
+FACE_POINTS = 128
+
+
+def _component(name: str, num_points: int, limbs: list, colors: list) -> PoseHeaderComponent:
+    return PoseHeaderComponent(
+        name=name, points=[f"{name}_{i}" for i in range(num_points)], limbs=limbs, colors=colors, point_format="XYZC"
+    )
+
+
+def holistic_like_header(width: int = 1000, height: int = 1000) -> PoseHeader:
+    """A MediaPipe Holistic-like skeleton (body, reduced face, two hands) like sign.mt poses."""
+    face_limbs = [(i, (i + 1) % FACE_POINTS) for i in range(FACE_POINTS)]
+    components = [
+        _component("POSE_LANDMARKS", 33, BODY_LIMBS, [(255, 0, 0)]),
+        _component("FACE_LANDMARKS", FACE_POINTS, face_limbs, [(224, 224, 224)]),
+        _component("LEFT_HAND_LANDMARKS", 21, HAND_LIMBS, [(0, 255, 0)] * 21),
+        _component("RIGHT_HAND_LANDMARKS", 21, HAND_LIMBS, [(0, 0, 255)] * 21),
+    ]
+    return PoseHeader(version=0.1, dimensions=PoseHeaderDimensions(width, height, 1000), components=components)
+
+
+def synthetic_pose(num_frames: int = 100, fps: float = 25.0, width: int = 1000, height: int = 1000,
+                   seed: int = 0) -> Pose:
+    """A smoothly moving random skeleton that stays within the canvas."""
+    rng = np.random.default_rng(seed)
+    header = holistic_like_header(width, height)
+    num_points = header.total_points()
+
+    # Body spread over the canvas, face and hands as tight clusters like real skeletons
+    body = rng.uniform(0.25, 0.75, size=(33, 2))
+    face = (0.5, 0.25) + 0.06 * np.stack([np.cos(np.linspace(0, 2 * np.pi, FACE_POINTS)),
+                                          np.sin(np.linspace(0, 2 * np.pi, FACE_POINTS))], axis=1)
+    left_hand = (0.3, 0.6) + rng.normal(0, 0.03, size=(21, 2))
+    right_hand = (0.7, 0.6) + rng.normal(0, 0.03, size=(21, 2))
+    rest = np.concatenate([body, face, left_hand, right_hand]) * (width, height)
+    rest = np.concatenate([rest, rng.uniform(0, 1, size=(num_points, 1))], axis=1)
+    t = np.arange(num_frames)[:, None, None] / fps
+    phase = rng.uniform(0, 2 * np.pi, size=(1, num_points, 3))
+    motion = np.sin(2 * np.pi * 0.5 * t + phase) * (0.05 * width, 0.05 * height, 0.1)
+    data = (rest[None] + motion)[:, None].astype(np.float32)
+
+    confidence = np.ones((num_frames, 1, num_points), dtype=np.float32)
+    # Hands go missing now and then, as they do in real poses
+    confidence[rng.random(num_frames) < 0.1, :, -42:] = 0
+
+    body = NumPyPoseBody(fps=fps, data=ma.masked_array(data), confidence=confidence)
+    return Pose(header, body)
+
+
+def synthetic_pose_bytes(**kwargs) -> bytes:
+    from io import BytesIO
+
+    buffer = BytesIO()
+    synthetic_pose(**kwargs).write(buffer)
+    return buffer.getvalue()
+
+
+def synthetic_voice_note(seconds: float = 5.0, sample_rate: int = 48000, seed: int = 0) -> bytes:
+    """
+    An OGG/Opus voice note like Telegram's: a buzzy voice-like tone broken into syllables.
+    Whisper usually hears nothing in it, use recorded voice notes to time whole transcriptions.
+    """
+    import av
+    from io import BytesIO
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 120 + 20 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t + rng.uniform(0, 2 * np.pi)), 0, 1)
+    samples = (0.3 * voice * syllables / np.abs(voice).max()).astype(np.float32)
+
+    buffer = BytesIO()
+    with av.open(buffer, mode="w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=sample_rate)
+        stream.layout = "mono"
+        frame_samples = 960
+        for start in range(0, len(samples), frame_samples):
+            frame = av.AudioFrame.from_ndarray(samples[None, start:start + frame_samples], format="flt", layout="mono")
+            frame.sample_rate = sample_rate
+            frame.pts = start
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+def synthetic_video_note(num_frames: int = 100, fps: float = 25.0, size: int = 384, seed: int = 0) -> bytes:
+    """A square MP4 of a moving skeleton, shaped like a Telegram video note."""
+    from io import BytesIO
+    from renderer import PoseRenderer
+
+    buffer = BytesIO()
+    pose = synthetic_pose(num_frames=num_frames, fps=fps, width=size, height=size, seed=seed)
+    PoseRenderer(pose, background_color=(40, 40, 40)).save_video(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,557 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import BinaryIO
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str, casefold: bool = True, keep_lines: bool = False) -> str:
+    # Same phrase typed with different casing or spacing should hit the same entry
+    text = unicodedata.normalize("NFC", text)
+    if casefold:
+        text = text.casefold()
+    if keep_lines:
+        # Only spacing within lines: line breaks are part of what gets translated
+        return "\n".join(" ".join(line.split()) for line in text.strip().split("\n"))
+    return " ".join(text.split())
+
+
+def content_key(*parts) -> str:
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class LRUCache:
+    """
+    In-memory LRU cache bounded by the total size of its values, as measured by `sizeof`.
+    Entries older than `ttl` seconds are treated as missing (None disables expiry).
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = None, sizeof=len):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.stats = CacheStats()
+        self._entries = OrderedDict()  # key -> (value, size, stored_at)
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+
+        value, _, stored_at = entry
+        if self.ttl is not None and time.time() - stored_at > self.ttl:
+            self._remove(key)
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def put(self, key, value, stored_at: float = None):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, size, time.time() if stored_at is None else stored_at)
+        self._bytes += size
+
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats.evictions += 1
+
+    def items(self):
+        return [(key, value) for key, (value, _, _) in self._entries.items()]
+
+    def pop(self, key):
+        if key in self._entries:
+            return self._remove(key)
+
+    def _remove(self, key):
+        value, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        return value
+
+
+class DiskCache:
+    """
+    Directory of content-addressed files bounded by total size, oldest files go first.
+    Entries older than `ttl` seconds are treated as missing (None disables expiry).
+    Methods do blocking file I/O, call them from a worker thread inside the event loop.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float = None, suffix: str = ""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.suffix = suffix
+        self.stats = CacheStats()
+        self._index = OrderedDict()  # key -> size, oldest first
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._load_index()
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def _load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(self.suffix) or name.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                files.append((stat.st_mtime, name[:len(name) - len(self.suffix)], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._index[key] = size
+            self._bytes += size
+        logger.info(f"{self.directory}: {len(self._index)} cached file(s), {self._bytes} bytes")
+
+    def stored_at(self, key: str):
+        try:
+            return os.path.getmtime(self.path(key))
+        except OSError:
+            return None
+
+    def _lookup(self, key: str) -> bool:
+        if key not in self._index:
+            self.stats.misses += 1
+            return False
+
+        stored_at = self.stored_at(key)
+        if stored_at is None or (self.ttl is not None and time.time() - stored_at > self.ttl):
+            if stored_at is not None:
+                self.stats.expirations += 1
+            # Expired, or removed behind our back
+            self.remove(key)
+            self.stats.misses += 1
+            return False
+
+        self._index.move_to_end(key)
+        self.stats.hits += 1
+        return True
+
+    def get(self, key: str):
+        with self._lock:
+            if not self._lookup(key):
+                return None
+            try:
+                with open(self.path(key), "rb") as f:
+                    return f.read()
+            except OSError:
+                self.remove(key)
+                return None
+
+    def get_path(self, key: str) -> bool:
+        """Like get, for entries too large to load: tells whether path(key) can be used."""
+        with self._lock:
+            return self._lookup(key)
+
+    def put(self, key: str, data: bytes):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, readers never see a half written file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        self._store(key, tmp_path)
+
+    def put_stream(self, key: str, stream: BinaryIO):
+        """Like put, copying stream from its current position without loading it whole."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(stream, f)
+        self._store(key, tmp_path)
+
+    def _store(self, key: str, file_path: str):
+        size = os.path.getsize(file_path)
+        with self._lock:
+            os.replace(file_path, self.path(key))
+            self._bytes -= self._index.pop(key, 0)
+            self._index[key] = size
+            self._bytes += size
+
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                self.remove(next(iter(self._index)))
+                self.stats.evictions += 1
+
+    def remove(self, key: str):
+        with self._lock:
+            self._bytes -= self._index.pop(key, 0)
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+
+class PoseCache:
+    """
+    Two-tier cache of sign.mt poses keyed by the normalized (text, spoken, signed) request:
+    hot poses are kept in memory, everything else is persisted to disk and survives restarts.
+    """
+
+    def __init__(self, directory: str, memory_bytes: int, disk_bytes: int, ttl: float):
+        self.memory = LRUCache(memory_bytes, ttl=ttl)
+        self.disk = DiskCache(directory, disk_bytes, ttl=ttl, suffix=".pose")
+
+    @staticmethod
+    def key(text: str, spoken: str, signed: str) -> str:
+        return content_key(normalize_text(text), spoken.lower(), signed.lower())
+
+    async def get(self, text: str, spoken: str, signed: str):
+        key = self.key(text, spoken, signed)
+        pose_bytes = self.memory.get(key)
+        if pose_bytes is not None:
+            return pose_bytes
+
+        pose_bytes = await asyncio.to_thread(self.disk.get, key)
+        if pose_bytes is not None:
+            # Keep the original age, promoting to memory must not extend the TTL
+            self.memory.put(key, pose_bytes, stored_at=self.disk.stored_at(key))
+        return pose_bytes
+
+    async def put(self, text: str, spoken: str, signed: str, pose_bytes: bytes):
+        key = self.key(text, spoken, signed)
+        self.memory.put(key, pose_bytes)
+        try:
+            await asyncio.to_thread(self.disk.put, key, pose_bytes)
+        except OSError as e:
+            logger.warning(f"Can't persist pose {key}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "memory": {**self.memory.stats.as_dict(), "entries": len(self.memory), "bytes": self.memory.size_bytes},
+            "disk": {**self.disk.stats.as_dict(), "entries": len(self.disk), "bytes": self.disk.size_bytes},
+        }
+
+
+class RenderCache:
+    """
+    Cache of rendered sign language videos keyed by the hash of the pose bytes and of the
+    render settings. Rendered files live in a size-bounded directory, and once a video has
+    been uploaded the Telegram file_id is remembered as well, so identical translations can be
+    answered by file_id without rendering nor uploading anything. Both survive restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_file_ids: int, render_settings: str):
+        self.render_settings = render_settings
+        self.max_file_ids = max_file_ids
+        self.files = DiskCache(directory, max_bytes, suffix=".mp4")
+        # file_ids are tiny and stay valid after the local file is evicted: bound them by count
+        self.file_ids = LRUCache(max_file_ids, sizeof=lambda _: 1)
+        self._lock = threading.Lock()
+        self._writes = 0
+        # A row per file_id, a new upload costs one small write rather than rewriting the whole index
+        self._db = sqlite3.connect(os.path.join(directory, "file_ids.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids (key TEXT PRIMARY KEY, file_id TEXT NOT NULL, stored_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS file_ids_stored_at ON file_ids (stored_at)")
+        self._db.commit()
+        self._load_file_ids()
+
+    def key(self, pose_bytes: bytes, variant: str = "") -> str:
+        """Key of the video of pose_bytes, variant telling apart the videos rendered differently."""
+        return content_key(hashlib.sha256(pose_bytes).hexdigest(), self.render_settings, variant)
+
+    def _load_file_ids(self):
+        rows = self._db.execute(
+            "SELECT key, file_id FROM file_ids ORDER BY stored_at DESC LIMIT ?", (self.max_file_ids,)
+        ).fetchall()
+        # Most recent last, the first ones to be evicted are the oldest
+        for key, file_id in reversed(rows):
+            self.file_ids.put(key, file_id)
+        logger.info(f"{len(rows)} Telegram file_id(s) of rendered videos")
+
+    def _write(self, sql: str, params: tuple):
+        with self._lock:
+            self._db.execute(sql, params)
+            self._writes += 1
+            # Trimming is a full index scan, do it every now and then rather than on each write
+            if self._writes % 1000 == 0:
+                self._db.execute(
+                    "DELETE FROM file_ids WHERE key IN ("
+                    "SELECT key FROM file_ids ORDER BY stored_at DESC LIMIT -1 OFFSET ?)", (self.max_file_ids,)
+                )
+            self._db.commit()
+
+    async def _persist(self, sql: str, params: tuple):
+        # The file_id is already in memory, failing to persist it only costs an upload after a restart
+        try:
+            await asyncio.to_thread(self._write, sql, params)
+        except Exception as e:
+            logger.warning(f"Can't persist Telegram file_id: {e!r}")
+
+    def get_file_id(self, key: str):
+        return self.file_ids.get(key)
+
+    async def set_file_id(self, key: str, file_id: str):
+        if self.file_ids.get(key) == file_id:
+            return
+        self.file_ids.put(key, file_id)
+        await self._persist(
+            "INSERT OR REPLACE INTO file_ids (key, file_id, stored_at) VALUES (?, ?, ?)", (key, file_id, time.time())
+        )
+
+    async def forget_file_id(self, key: str):
+        if self.file_ids.pop(key) is not None:
+            await self._persist("DELETE FROM file_ids WHERE key = ?", (key,))
+
+    async def get_path(self, key: str):
+        return self.files.path(key) if await asyncio.to_thread(self.files.get_path, key) else None
+
+    async def put_video(self, key: str, video: BinaryIO):
+        """Stores a freshly rendered video, leaving video positioned at its start."""
+        video.seek(0)
+        try:
+            await asyncio.to_thread(self.files.put_stream, key, video)
+        finally:
+            video.seek(0)
+
+    def stats(self) -> dict:
+        return {
+            "files": {**self.files.stats.as_dict(), "entries": len(self.files), "bytes": self.files.size_bytes},
+            "file_ids": {**self.file_ids.stats.as_dict(), "entries": len(self.file_ids)},
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class TranslationResult:
+    """The subset of deepl.TextResult the bot relies on, as served from the cache."""
+
+    def __init__(self, text: str, detected_source_lang: str):
+        self.text = text
+        self.detected_source_lang = detected_source_lang
+
+    def __str__(self):
+        return self.text
+
+
+class TranslationCache:
+    """
+    DeepL translations keyed by (normalized text, source_lang, target_lang): an in-memory
+    LRU in front of an SQLite table, both expiring entries after `ttl` seconds.
+    The table keeps at most `max_rows` translations, the oldest ones are dropped first.
+
+    The table is only a cache: lookups and writes run in a worker thread and a failing one,
+    e.g. on a database locked by another bot process, is a miss or a lost write rather than an
+    error. New translations are written in one transaction every `flush_interval` seconds, or
+    as soon as `batch_size` of them are pending, and at close.
+    """
+
+    def __init__(self, db_path: str, memory_bytes: int, max_rows: int, ttl: float, flush_interval: float = 1,
+                 batch_size: int = 100):
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.memory = LRUCache(memory_bytes, ttl=ttl, sizeof=lambda result: len(result.text) + 64)
+        self.counters = CacheStats()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._pending = {}  # key -> (result, stored_at) not written yet
+        self._flush_handle = None
+        self._flush_task = None
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, detected_source_lang TEXT, stored_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS translations_stored_at ON translations (stored_at)")
+        self._db.commit()
+
+    @staticmethod
+    def key(text: str, source_lang, target_lang: str, **options) -> str:
+        # Casing, punctuation and line breaks are meaningful to a translation, only spacing is normalized
+        return content_key(
+            normalize_text(text, casefold=False, keep_lines=True), (source_lang or "auto").lower(), target_lang.lower(),
+            *(f"{name}={options[name]}" for name in sorted(options))
+        )
+
+    def _select(self, key: str):
+        with self._lock:
+            return self._db.execute(
+                "SELECT text, detected_source_lang, stored_at FROM translations WHERE key = ?", (key,)
+            ).fetchone()
+
+    async def get(self, key: str):
+        result = self.memory.get(key)
+        if result is not None:
+            self.counters.hits += 1
+            return result
+
+        try:
+            row = await asyncio.to_thread(self._select, key)
+        except sqlite3.Error as e:
+            logger.warning(f"Can't look up translation {key}: {e!r}")
+            row = None
+        if row is None:
+            self.counters.misses += 1
+            return None
+        if self.ttl is not None and time.time() - row[2] > self.ttl:
+            self.counters.expirations += 1
+            self.counters.misses += 1
+            return None
+
+        result = TranslationResult(row[0], row[1])
+        self.memory.put(key, result, stored_at=row[2])
+        self.counters.hits += 1
+        return result
+
+    def put(self, key: str, result: TranslationResult):
+        stored_at = time.time()
+        self.memory.put(key, result, stored_at=stored_at)
+        self._pending[key] = (result, stored_at)
+        if len(self._pending) >= self.batch_size:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+            self._start_flush()
+        elif self._flush_handle is None and (self._flush_task is None or self._flush_task.done()):
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        # A running flush schedules the next one once done
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if not self._pending:
+            return
+        rows = self._take_pending()
+        try:
+            await asyncio.to_thread(self._insert, rows)
+        except sqlite3.Error as e:
+            # Still in memory, only lost for the other processes and after a restart
+            logger.warning(f"Can't persist {len(rows)} translation(s): {e!r}")
+        if self._pending and self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+    def _take_pending(self) -> list:
+        rows = [(key, result.text, result.detected_source_lang, stored_at)
+                for key, (result, stored_at) in self._pending.items()]
+        self._pending = {}
+        return rows
+
+    def _insert(self, rows: list):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO translations (key, text, detected_source_lang, stored_at) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            # Trimming is a full index scan, do it every now and then rather than on each write
+            if (self._writes + len(rows)) // 1000 != self._writes // 1000:
+                self._trim()
+            self._writes += len(rows)
+            self._db.commit()
+
+    def _trim(self):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM translations WHERE stored_at < ?", (time.time() - self.ttl,))
+        deleted = self._db.execute(
+            "DELETE FROM translations WHERE key IN ("
+            "SELECT key FROM translations ORDER BY stored_at DESC LIMIT -1 OFFSET ?)", (self.max_rows,)
+        ).rowcount
+        self.counters.evictions += max(deleted, 0)
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        rows = self._take_pending()
+        try:
+            if rows:
+                self._insert(rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Can't persist {len(rows)} translation(s): {e!r}")
+        with self._lock:
+            self._db.close()
+
+    def stats(self) -> dict:
+        return {**self.counters.as_dict(), "memory": {**self.memory.stats.as_dict(), "entries": len(self.memory)}}
+
+
+class CachedTranslator:
+    """
+    Async counterpart of deepl.Translator.translate_text that answers repeated translations
+    from a TranslationCache, so they cost neither latency nor DeepL quota. The DeepL client is
+    blocking, it runs in a worker thread so it never stalls the event loop.
+    """
+
+    def __init__(self, translator, cache: TranslationCache):
+        self.translator = translator
+        self.cache = cache
+
+    async def translate_text(self, text: str, *, source_lang=None, target_lang: str, **options):
+        key = self.cache.key(text, source_lang, target_lang, **options)
+        result = await self.cache.get(key)
+        if result is not None:
+            return result
+
+        with metrics.stage("deepl"):
+            # Looked up in the thread: a Lazy client not loaded yet imports and builds it there
+            translation = await asyncio.to_thread(
+                lambda: self.translator.translate_text(text, source_lang=source_lang, target_lang=target_lang, **options)
+            )
+        result = TranslationResult(translation.text, translation.detected_source_lang)
+        self.cache.put(key, result)
+        return result
@@ -1,11 +1,7 @@
-import iso639
-
 # TODO update it with our command!
 
 DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
 
-REQUIRED_DIRS = ["poses", "voice", "video"]
-
 OK_EMOJI = "\u2705"
 GENIE_EMOJI = "\U0001f9de\u200D\u2642\uFE0F"
 
@@ -21,12 +17,25 @@ MSG_SHOULD_BE_TEXT_WARN = WARN_EMOJI + " Selected {0} source language requires t
 OPS_EMOJI = "\U0001f92d"
 NOT_AVAILABLE_EMOJI = "\U0001f636\u200D\U0001f32b\uFE0F"
 PLEASE_HANDS_EMOJI = "\U0001f64f\U0001f3fc"
+HOURGLASS_EMOJI = "\u23F3"
 
 MSG_WHISPER_UNABLE_TO_TRANSCRIBE = f"{OPS_EMOJI} We can't hear your audio very well... could you try to speak louder, please?"
 MSG_WHISPER_FAIL = f"{NOT_AVAILABLE_EMOJI} Audio transcribing service seems to be offline, please try again later {PLEASE_HANDS_EMOJI}\n\nIn the meantime, here's a nice GIF for you..."
 MSG_DEEPL_FAIL = f"{NOT_AVAILABLE_EMOJI} Text translation service seems to be offline, please try again later {PLEASE_HANDS_EMOJI}\n\nIn the meantime, here's a nice GIF for you..."
 MSG_SIGNMT_FAIL = f"{NOT_AVAILABLE_EMOJI} Sign translation service seems to be offline, please try again later {PLEASE_HANDS_EMOJI}\n\nIn the meantime, here's a nice GIF for you..."
 MSG_POSE_FAIL = f"{OPS_EMOJI} We can't compose the translation into sign language... could you try again, please?"
+MSG_ADMIN_ONLY = f"{ERROR_EMOJI} This command is reserved to the bot administrators"
+MSG_WARMUP_STARTED = f"{HOURGLASS_EMOJI} Warming up the sign language poses cache with {{0}} phrases..."
+MSG_WARMUP_DONE = OK_EMOJI + " Poses cache warmed up: {0} fetched, {1} already cached, {2} failed\n\n{3}"
+MSG_WHISPER_QUEUE_FULL = f"{HOURGLASS_EMOJI} We are transcribing a lot of audio right now... please send your message again in a minute {PLEASE_HANDS_EMOJI}"
+MSG_CHAT_QUEUE_FULL = f"{HOURGLASS_EMOJI} We are still working on your previous messages... please wait for their translations before sending new ones {PLEASE_HANDS_EMOJI}"
+MSG_BOT_BUSY = f"{HOURGLASS_EMOJI} We are translating a lot of messages right now... please send your message again in a minute {PLEASE_HANDS_EMOJI}"
+MSG_SIGN_UNRECOGNIZED = f"{OPS_EMOJI} We can't recognize the signs in your video... could you try again, facing the camera with your hands in view, please?"
+MSG_SIGN_RECOGNITION_FAIL = f"{NOT_AVAILABLE_EMOJI} Sign language recognition seems to be offline, please try again later {PLEASE_HANDS_EMOJI}"
+MSG_RECOGNITION_QUEUE_FULL = f"{HOURGLASS_EMOJI} We are watching a lot of videos right now... please send your video again in a minute {PLEASE_HANDS_EMOJI}"
+MSG_STATS = "Bot statistics\n\n{0}"
+MSG_QUALITY = "Sign language videos quality: {0}\n\nChange it with /quality followed by one of: {1}\n(auto picks a lighter quality when the bot is busy)"
+MSG_QUALITY_SET = OK_EMOJI + " From now on, sign language videos will be rendered in {0} quality"
 
 # If you want to add some task, you gotta add form the last position
 TASKS = ["SELECT_LANGUAGE_DST", "SELECT_LANGUAGE_SRC"]
@@ -43,8 +52,6 @@ US_FLAG_EMOJI      = "\U0001f1fa\U0001f1f8"
 OPEN_HANDS_EMOJI = "\U0001f450"
 SPEAK_EMOJI = "\U0001f5e3\uFE0F"
 
-HOURGLASS_EMOJI = "\u23F3"
-
 TRANSCRIBING_EMOJI = "\u270D\U0001f3fb"
 
 SL_TRANSLATION_EMOJI = "\U0001f90c\U0001f3fc"
@@ -57,16 +64,179 @@ DST_TASK_TO_START = "destination language selection"
 SRC_LANG_SELECTION_TASK = "Source language selection"
 DST_LANG_SELECTION_TASK = "Destination language selection"
 
-SRC_LANG = "src_lang"
 SRC = "source"
 
-DST_LANG = "dst_lang"
 DST = "destination"
 
 # Error list
 
 
 TEXT_TO_SIGNED_BASE_URL = "https://us-central1-sign-mt.cloudfunctions.net/spoken_text_to_signed_pose"
+SIGNMT_TIMEOUT = 20 # seconds, for every single attempt
+SIGNMT_DEADLINE = 45 # seconds, for the whole request including retries
+SIGNMT_MAX_RETRIES = 2
+SIGNMT_BACKOFF = 0.5 # seconds, doubled at every retry
+SIGNMT_MAX_CONNECTIONS = 20
+# Messages are signed a sentence at a time, fetched concurrently and joined back into one pose
+# with a short transition between sentences. Longer sentences are cut at commas, then words
+SIGNMT_MAX_PHRASE_CHARS = 200
+POSE_TRANSITION_SECONDS = 0.2
+
+# sign.mt poses cache, hot ones in memory and all of them on disk
+POSE_CACHE_DIR = "cache/poses"
+POSE_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+POSE_CACHE_DISK_BYTES = 1024 * 1024 * 1024
+POSE_CACHE_TTL = 30 * 24 * 60 * 60 # seconds
+
+# Rendered sign language videos and the Telegram file_ids they got once uploaded
+RENDER_CACHE_DIR = "cache/renders"
+RENDER_CACHE_DISK_BYTES = 2 * 1024 * 1024 * 1024
+RENDER_CACHE_MAX_FILE_IDS = 200_000
+RENDER_BACKGROUND_COLOR = (0, 0, 0)
+# Render quality profiles: canvas longest side and frame rate caps (None keeps the pose's own),
+# line thickness in pixels (None scales it with the canvas) and H.264 settings. faststart puts
+# the MP4 index first, so that Telegram clients can start playing before the download is done
+RENDER_PROFILES = {
+    "preview": {"max_side": 384, "max_fps": 12, "thickness": 2, "crf": 32, "preset": "veryfast", "faststart": True},
+    "standard": {"max_side": 512, "max_fps": 15, "thickness": None, "crf": 28, "preset": "veryfast", "faststart": True},
+    "high": {"max_side": None, "max_fps": None, "thickness": None, "crf": 23, "preset": "veryfast", "faststart": True},
+}
+# A profile's position is its id in the users' stored settings: add new ones at the end, never
+# reorder or remove them. "auto" picks RENDER_DEFAULT_PROFILE, or RENDER_BUSY_PROFILE once the
+# translations running and waiting reach RENDER_BUSY_LOAD times SCHEDULER_MAX_RUNNING
+RENDER_PROFILE_IDS = ["auto", "preview", "standard", "high"]
+DEFAULT_RENDER_PROFILE_ID = 0 # auto
+RENDER_DEFAULT_PROFILE = "standard"
+RENDER_BUSY_PROFILE = "preview"
+RENDER_BUSY_LOAD = 1.0
+# Render worker processes, 0 for one per core
+RENDER_WORKERS = 0
+# Videos are split into frame ranges of at least this many frames rendered in parallel by the workers
+RENDER_SEGMENT_FRAMES = 60
+
+# DeepL translations, hot ones in memory and all of them in SQLite
+TRANSLATION_CACHE_DB = "cache/translations.sqlite3"
+TRANSLATION_CACHE_MEMORY_BYTES = 16 * 1024 * 1024
+TRANSLATION_CACHE_MAX_ROWS = 1_000_000
+TRANSLATION_CACHE_TTL = 30 * 24 * 60 * 60 # seconds
+
+# Phrases fetched ahead of time by /warmup, for each spoken language paired with its signed one
+WARMUP_PHRASES = {
+    "it": ["Ciao", "Grazie", "Buongiorno", "Buonasera", "Come stai?", "Piacere di conoscerti", "Arrivederci"],
+    "en": ["Hello", "Thank you", "Good morning", "Good evening", "How are you?", "Nice to meet you", "Goodbye"],
+    "fr": ["Bonjour", "Merci", "Bonsoir", "Comment ça va?", "Enchanté", "Au revoir"],
+    "de": ["Hallo", "Danke", "Guten Morgen", "Guten Abend", "Wie geht es dir?", "Freut mich", "Auf Wiedersehen"],
+    "es": ["Hola", "Gracias", "Buenos días", "Buenas noches", "¿Cómo estás?", "Mucho gusto", "Adiós"],
+}
+
+# Below these, local language detection is not trusted and DeepL detects the language instead
+LANG_DETECT_MIN_CONFIDENCE = 0.9
+LANG_DETECT_MIN_CHARS = 12
+
+# Whisper transcription workers, each one holds its own copy of the model
+WHISPER_MODEL_NAME = "base"
+WHISPER_WORKERS = 2
+# Voice notes allowed to wait for a free worker before new ones are turned away
+WHISPER_MAX_QUEUE = 16
+# Short voice notes arriving close together are transcribed with a single batched model pass
+WHISPER_BATCH_SIZE = 8
+WHISPER_BATCH_WAIT = 0.1 # seconds
+
+# Sign language recognition workers, each one holds its own pose extractor and recognizer
+SIGN_RECOGNITION_WORKERS = 2
+# Videos allowed to wait for a free worker before new ones are turned away
+SIGN_RECOGNITION_MAX_QUEUE = 16
+# By name, see sign_recognition.POSE_EXTRACTORS and SIGN_RECOGNIZERS, or as "module:Class"
+SIGN_POSE_EXTRACTOR = "holistic"
+SIGN_RECOGNIZER = "templates"
+# Labelled poses the reference "templates" recognizer matches videos against, /warmup adds its phrases
+SIGN_TEMPLATES_DIR = "data/sign_templates"
+# Farther than this from every template, in shoulder widths per point and frame, is not recognized
+SIGN_TEMPLATE_MAX_DISTANCE = 0.5
+# Frames of a video are sampled at SIGN_MAX_FPS while the signer moves and down to SIGN_MIN_FPS
+# while they hold still, i.e. while 32x32 grayscale thumbnails differ by less than
+# SIGN_MOTION_THRESHOLD (mean absolute difference, 0 to 255)
+SIGN_MIN_FPS = 2
+SIGN_MAX_FPS = 10
+SIGN_MOTION_THRESHOLD = 2.0
+# Poses kept per video, sampling slows down on longer videos to stay within it
+SIGN_MAX_FRAMES = 256
+# Frames are scaled down to this longest side before extracting poses
+SIGN_FRAME_MAX_SIDE = 512
+
+# Downloaded voice notes and videos and rendered sign videos are handled in memory, those
+# larger than this are spilled to an anonymous temporary file (0 never spills)
+MEDIA_SPILL_BYTES = 8 * 1024 * 1024
+# Where spilled media goes, None is the system temporary directory
+MEDIA_SPILL_DIR = None
+SIGN_VIDEO_FILENAME = "translation.mp4"
+# Longer translations are split over several messages
+TELEGRAM_MESSAGE_MAX_CHARS = 4096
+# Budgets of the Bot API calls to chats, within Telegram's flood limits: about 30 messages per
+# second overall, 1 per second in a private chat with short bursts tolerated, 20 per minute in a group.
+# Calls hitting the flood control anyway are retried up to OUTBOX_MAX_RETRIES times
+OUTBOX_GLOBAL_RATE = 30
+OUTBOX_CHAT_RATE = 1
+OUTBOX_CHAT_BURST = 3
+OUTBOX_GROUP_RATE = 20 / 60
+OUTBOX_GROUP_BURST = 3
+OUTBOX_MAX_RETRIES = 2
+# A translation's status message is only sent once it takes longer than STATUS_DELAY seconds,
+# then edited at most every STATUS_INTERVAL seconds as its stages go by
+STATUS_DELAY = 0.5
+STATUS_INTERVAL = 1.5
+
+# Admission control for translations: jobs running at once, overall and per user, and jobs
+# allowed to wait for their turn, overall and per user, before new ones are turned away
+SCHEDULER_MAX_RUNNING = 8
+SCHEDULER_MAX_RUNNING_PER_USER = 1
+SCHEDULER_MAX_QUEUED = 64
+SCHEDULER_MAX_QUEUED_PER_USER = 3
+# Waiting translations catch up on shorter ones by this many seconds of cost per second waited
+SCHEDULER_AGING = 1.0
+# Rough cost of a translation, in seconds of processing, estimated before running it so that
+# the scheduler can let the short ones go first
+JOB_COST_BASE = 1.0
+JOB_COST_PER_AUDIO_SECOND = 0.3
+JOB_COST_PER_VIDEO_SECOND = 1.0
+# Fetching and rendering a sign language video grows with the length of the text
+JOB_COST_PER_SIGNED_CHAR = 0.05
+SPEECH_CHARS_PER_SECOND = 15
+# Updates python-telegram-bot handles at once, leave room for the waiting jobs and for commands
+CONCURRENT_UPDATES = 128
+
+# How updates reach the bot: "polling" (a single process), "webhook" (a router receiving Telegram's
+# updates and WEBHOOK_WORKERS local worker processes), or the two roles of the webhook mode on their
+# own, "webhook-router" and "webhook-worker", to spread workers across machines
+BOT_MODE = "polling"
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_WORKERS = 2
+# Worker i listens on WEBHOOK_WORKER_HOST:WEBHOOK_WORKER_BASE_PORT + i
+WEBHOOK_WORKER_HOST = "127.0.0.1"
+WEBHOOK_WORKER_BASE_PORT = 8600
+WEBHOOK_FORWARD_TIMEOUT = 10 # seconds
+
+# Users' language settings, shared by every bot process of the machine
+USER_PREFS_DB = "data/user_prefs.sqlite3"
+USER_PREFS_CACHE_SIZE = 100_000 # users kept in memory
+USER_PREFS_FLUSH_INTERVAL = 5 # seconds
+USER_PREFS_BATCH_SIZE = 500 # changed settings written at once
+
+# Local Prometheus metrics endpoint, http://METRICS_LISTEN:METRICS_PORT/metrics, 0 disables it.
+# Webhook worker i serves its own on METRICS_PORT + i
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9464
+
+# Event loop watchdog: a heartbeat every LOOP_WATCHDOG_INTERVAL seconds, and the stack of the
+# event loop thread is logged when it is blocked for LOOP_WATCHDOG_THRESHOLD seconds, 0 disables it
+LOOP_WATCHDOG_INTERVAL = 0.1 # seconds
+LOOP_WATCHDOG_THRESHOLD = 0.25 # seconds
+
+# Heavy components loaded in the background right after startup rather than on first use,
+# among "translator", "langdetect", "renderer", "audio", "whisper" and "recognizer"
+PRELOAD = ["translator", "langdetect", "renderer", "audio", "whisper", "recognizer"]
 
 KEYBOARD_LANG_LIST = [
     {"text": f"Italian {ITALIAN_FLAG_EMOJI}{SPEAK_EMOJI}", "is_spoken": True},
@@ -81,6 +251,12 @@ KEYBOARD_LANG_LIST = [
     {"text": f"Spanish Sign Lang{SPANISH_FLAG_EMOJI}{OPEN_HANDS_EMOJI}", "is_spoken": False},
 ]
 
+# A language's position in KEYBOARD_LANG_LIST is its id in the users' stored settings:
+# add new languages at the end, never reorder or remove them
+LANG_IDS = {lang_obj["text"]: lang_id for lang_id, lang_obj in enumerate(KEYBOARD_LANG_LIST)}
+DEFAULT_SRC_LANG_ID = 1 # English
+DEFAULT_DST_LANG_ID = 5 # Italian Sign Language
+
 LANGUAGE_DICT = {
     f"Italian {ITALIAN_FLAG_EMOJI}{SPEAK_EMOJI}": "it",
     f"English {ENGLISH_FLAG_EMOJI}{SPEAK_EMOJI}": "en",
@@ -129,29 +305,6 @@ SUPPORTED_LANGUAGES_DEEPL_ISO_CODES = [
 ]
 
 
-SENTENCES = [
-    "The quick brown fox jumps over the lazy dog.",
-    "A journey of a thousand miles begins with a single step.",
-    "Actions speak louder than words.",
-    "Where there's smoke, there's fire.",
-    "Every cloud has a silver lining.",
-    "Don't count your chickens before they hatch.",
-    "All that glitters is not gold.",
-    "The early bird catches the worm.",
-    "When in Rome, do as the Romans do.",
-    "Two wrongs don't make a right.",
-    "Better late than never.",
-    "A picture is worth a thousand words.",
-    "You can't judge a book by its cover.",
-    "When the going gets tough, the tough get going.",
-    "Honesty is the best policy.",
-    "The pen is mightier than the sword.",
-    "Actions speak louder than words.",
-    "Where there is a will, there is a way.",
-    "Fortune favors the bold.",
-    "Rome wasn't built in a day."
-]
-
 HI_HAND = "\U0001f596\U0001f3fc"
 HEART_EMOJI = "\U0001f9e1"
 HUGGING_FACE_EMOJI = "\U0001f917"
@@ -175,6 +328,7 @@ HELP_MESSAGE = f"""
 - /help - Gets help using the bot 
 - /lang - Sets source and destination languages 
 - /swap - Swaps the source and destination languages 
+- /quality - Sets the quality of sign language videos 
 
 *Usage:*
 
@@ -1,56 +1,64 @@
-import emoji
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-from consts import KEYBOARD_LANG_LIST
+from consts import KEYBOARD_LANG_LIST, OK_EMOJI
 
-def build_keyboard(src: str, dst: str) -> InlineKeyboardMarkup:
-    temp_lang_list = [lang_obj["text"] for lang_obj in KEYBOARD_LANG_LIST]
+# callback_data of the keyboard buttons, "<action>:<src id>:<dst id>" with language ids as in
+# consts.LANG_IDS. The ids are the selection the button leads to (select) or the one shown
+# on the keyboard (swap, done), so handlers never need to look at the keyboard itself.
+SELECT_ACTION = "select"
+SWAP_ACTION = "swap"
+DONE_ACTION = "done"
+# Already selected languages: tapping them changes nothing
+NOOP_CALLBACK_DATA = "noop"
 
+
+def encode_callback_data(action: str, src: int, dst: int) -> str:
+    return f"{action}:{src}:{dst}"
+
+
+def decode_callback_data(data: str):
+    """(action, src id, dst id) of a keyboard button's callback_data, None if it is not one."""
+    try:
+        action, src, dst = data.split(":")
+        src, dst = int(src), int(dst)
+    except ValueError:
+        return None
+    if not (0 <= src < len(KEYBOARD_LANG_LIST) and 0 <= dst < len(KEYBOARD_LANG_LIST)):
+        return None
+    return action, src, dst
+
+
+def _selection_after(side: str, lang: int, src: int, dst: int) -> (int, int):
+    # Picking on one side the language selected on the other swaps them
+    if side == "src":
+        return (dst, src) if lang == dst else (lang, dst)
+    return (dst, src) if lang == src else (src, lang)
+
+
+def _button(side: str, lang: int, src: int, dst: int) -> InlineKeyboardButton:
+    text = KEYBOARD_LANG_LIST[lang]["text"]
+    if lang == (src if side == "src" else dst):
+        return InlineKeyboardButton(f"{OK_EMOJI} {text}", callback_data=NOOP_CALLBACK_DATA)
+    return InlineKeyboardButton(
+        text, callback_data=encode_callback_data(SELECT_ACTION, *_selection_after(side, lang, src, dst))
+    )
+
+
+def _build_keyboard(src: int, dst: int) -> InlineKeyboardMarkup:
     language_keyboard = [
-            [
-                InlineKeyboardButton(
-                lang, 
-                callback_data=lang + "_src",
-                ),
-                InlineKeyboardButton(
-                    lang, 
-                    callback_data=lang + "_dst",
-                )
-            ] for lang in temp_lang_list
-        ]
-    
-    for row in language_keyboard:
-        if src == row[0].text:
-            text_selected = emoji.emojize(":check_mark_button: " + row[0].text)
-            row[0] = InlineKeyboardButton(
-                    text_selected, 
-                    callback_data=text_selected,
-            )
-        if dst == row[1].text:
-            text_selected = emoji.emojize(":check_mark_button: " + row[1].text)
-            row[1] = InlineKeyboardButton(
-                    text_selected, 
-                    callback_data=text_selected,
-            )
-    
-    language_keyboard.append([InlineKeyboardButton("Swap", callback_data="Swap")])
-    language_keyboard.append([InlineKeyboardButton("Done", callback_data="Done")])
-    
+        [_button("src", lang, src, dst), _button("dst", lang, src, dst)] for lang in range(len(KEYBOARD_LANG_LIST))
+    ]
+    language_keyboard.append([InlineKeyboardButton("Swap", callback_data=encode_callback_data(SWAP_ACTION, src, dst))])
+    language_keyboard.append([InlineKeyboardButton("Done", callback_data=encode_callback_data(DONE_ACTION, src, dst))])
     return InlineKeyboardMarkup(language_keyboard)
 
-def get_selected_from_keyboard(keyboard: InlineKeyboardMarkup) -> (str, str):
-    keyboard = keyboard.to_dict()
-    keyboard = keyboard["inline_keyboard"]
-    keyboard.pop()
-    keyboard.pop()
-    for row in keyboard:
-        if row[0]["text"][:1] == emoji.emojize(":check_mark_button:"):
-            src = row[0]["text"][2:]
-        if row[1]["text"][:1] == emoji.emojize(":check_mark_button:"):
-            dst = row[1]["text"][2:]
-    return src, dst
-
-def swap_languages(keyboard: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
-    src, dst = get_selected_from_keyboard(keyboard)
-    return build_keyboard(src=dst, dst=src)
 
+# Every (src id, dst id) selection, a hundred small immutable markups built once
+KEYBOARDS = {
+    (src, dst): _build_keyboard(src, dst)
+    for src in range(len(KEYBOARD_LANG_LIST)) for dst in range(len(KEYBOARD_LANG_LIST))
+}
+
+
+def get_keyboard(src: int, dst: int) -> InlineKeyboardMarkup:
+    return KEYBOARDS[src, dst]
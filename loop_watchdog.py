@@ -0,0 +1,125 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = metrics.REGISTRY.histogram(
+    "polysignai_event_loop_lag_seconds", "How late the event loop runs a callback scheduled on time",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+LOOP_STALLS = metrics.REGISTRY.counter(
+    "polysignai_event_loop_stalls_total", "Times the event loop was blocked for longer than the threshold"
+)
+
+# Innermost frames kept in a logged stack
+_STACK_LIMIT = 25
+
+
+class LoopWatchdog:
+    """
+    Measures the event loop lag with a heartbeat scheduled every `interval` seconds, and a
+    thread watching the heartbeat. While the loop has been stuck for more than `threshold`
+    seconds, the thread samples the stack of the event loop thread every `threshold` / 4
+    seconds, and the most frequent stack is logged once the loop is back, with the handler
+    and update it belongs to when known (see metrics.trace).
+
+    The heartbeat costs one wake up per interval, stacks are only sampled during stalls.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = None
+        self._heartbeat_task = None
+        self._monitor = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        # Stacks sampled during the current stall, and where they were taken
+        self._samples = collections.Counter()
+        self._blocked_in = None
+
+    def start(self):
+        """Starts watching the running event loop, call it from a coroutine."""
+        if self._heartbeat_task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._monitor = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._monitor.start()
+
+    async def stop(self):
+        if self._heartbeat_task is None:
+            return
+        self._stopped.set()
+        self._heartbeat_task.cancel()
+        try:
+            await self._heartbeat_task
+        except asyncio.CancelledError:
+            pass
+        self._heartbeat_task = None
+        self._monitor.join()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._last_beat = now
+            LOOP_LAG_SECONDS.observe(lag)
+            if lag >= self.threshold:
+                LOOP_STALLS.inc()
+                self._report(lag)
+
+    def _report(self, lag: float):
+        with self._lock:
+            samples, self._samples = self._samples, collections.Counter()
+            blocked_in, self._blocked_in = self._blocked_in, None
+        if not samples:
+            logger.warning(f"Event loop blocked for {lag:.3f}s, too short to sample its stack")
+            return
+        stack, count = samples.most_common(1)[0]
+        logger.warning(
+            f"Event loop blocked for {lag:.3f}s in {blocked_in}, {count} of {sum(samples.values())} "
+            f"stack samples were:\n{''.join(traceback.format_list(list(stack)))}"
+        )
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 4):
+            stalled_for = time.monotonic() - self._last_beat - self.interval
+            if stalled_for >= self.threshold:
+                self._sample()
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = tuple(traceback.extract_stack(frame, limit=_STACK_LIMIT))
+        # (file, line, function, code) only, so that identical stacks are counted together
+        stack = tuple((entry.filename, entry.lineno, entry.name, entry.line) for entry in stack)
+        with self._lock:
+            self._samples[stack] += 1
+            if self._blocked_in is None:
+                self._blocked_in = self._describe_running_task()
+
+    def _describe_running_task(self) -> str:
+        # Read from this thread while the loop thread is stuck inside the task
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            return "a callback outside any task"
+        current = metrics.trace_of(task)
+        if current is not None:
+            return f"{current.handler} (update {current.update_id})"
+        return f"task {task.get_name()}"
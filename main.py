@@ -1,30 +1,50 @@
-from io import BufferedReader
-from consts import *
+from startup import Lazy, StartupReport
+
+# Created first so that every import below is accounted for
+startup_report = StartupReport()
+
+with startup_report.measure("import consts"):
+    from consts import *
+import asyncio
+import contextvars
+import functools
+import json
 import logging
+import multiprocessing
 import os
-import numpy as np
-import emoji
-import telegram
-import whisper
-import deepl
-from langdetect import detect as lang_detector
-import requests
-from pose_format import Pose
-from pose_format.pose_visualizer import PoseVisualizer
+import signal
+import time
 from datetime import datetime
-import random
-
 
-from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton, BotCommand
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
+# Whisper, DeepL, pose_format, the renderer and PyAV are imported on first use or by the
+# background preload, the bot starts polling without waiting for any of them
+with startup_report.measure("import telegram"):
+    import telegram
+    from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton, BotCommand
+    from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
 from dotenv import load_dotenv
-
-import lang_keyboard
+with startup_report.measure("import langdetect"):
+    from langdetect import DetectorFactory, LangDetectException, detect_langs as lang_detector
+    from langdetect.detector_factory import init_factory
+
+with startup_report.measure("import bot modules"):
+    import lang_keyboard
+    from transcriber import TranscriptionPool, TranscriptionQueueFull
+    from sign_recognition import RecognitionQueueFull, SignRecognitionPool, save_templates
+    from render_farm import RenderFarm
+    from outbox import Outbox, StatusMessage
+    from signmt import SignMTClient, SignMTError, split_phrases
+    from pose_concat import concatenate_poses
+    from media import AudioDecodeError, decode_audio, download, media_buffer
+    from cache import PoseCache, RenderCache, TranslationCache, CachedTranslator
+    from scheduler import FairScheduler, SchedulerFull
+    from persistence import UserPrefsStore
+    from webhook import UpdateReceiver, UpdateRouter, serve_http
+    import metrics
+    from loop_watchdog import LoopWatchdog
 
 from rich import print
 
-import iso639
-
 def _get_current_timestamp():
     return datetime.now().strftime(DATE_FORMAT)
 
@@ -32,10 +52,150 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DEEPL_TOKEN = os.getenv("DEEPL_TOKEN")
-
-
-whisper_model = whisper.load_model('base')
-translator = deepl.Translator(DEEPL_TOKEN)
+# Lets the bot talk to a local stand-in of the DeepL API, None for DeepL's own
+DEEPL_SERVER_URL = os.getenv("DEEPL_SERVER_URL")
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", WHISPER_WORKERS))
+WHISPER_MAX_QUEUE = int(os.getenv("WHISPER_MAX_QUEUE", WHISPER_MAX_QUEUE))
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", WHISPER_BATCH_SIZE))
+WHISPER_BATCH_WAIT = float(os.getenv("WHISPER_BATCH_WAIT", WHISPER_BATCH_WAIT))
+SIGN_RECOGNITION_WORKERS = int(os.getenv("SIGN_RECOGNITION_WORKERS", SIGN_RECOGNITION_WORKERS))
+SIGN_RECOGNITION_MAX_QUEUE = int(os.getenv("SIGN_RECOGNITION_MAX_QUEUE", SIGN_RECOGNITION_MAX_QUEUE))
+SIGN_POSE_EXTRACTOR = os.getenv("SIGN_POSE_EXTRACTOR", SIGN_POSE_EXTRACTOR)
+SIGN_RECOGNIZER = os.getenv("SIGN_RECOGNIZER", SIGN_RECOGNIZER)
+SIGN_TEMPLATES_DIR = os.getenv("SIGN_TEMPLATES_DIR", SIGN_TEMPLATES_DIR)
+# Lets the bot talk to a local stand-in of the sign.mt API
+SIGNMT_BASE_URL = os.getenv("SIGNMT_BASE_URL", TEXT_TO_SIGNED_BASE_URL)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", RENDER_WORKERS)) or os.cpu_count() or 1
+RENDER_SEGMENT_FRAMES = int(os.getenv("RENDER_SEGMENT_FRAMES", RENDER_SEGMENT_FRAMES))
+MEDIA_SPILL_BYTES = int(os.getenv("MEDIA_SPILL_BYTES", MEDIA_SPILL_BYTES))
+MEDIA_SPILL_DIR = os.getenv("MEDIA_SPILL_DIR", MEDIA_SPILL_DIR)
+SCHEDULER_MAX_RUNNING = int(os.getenv("SCHEDULER_MAX_RUNNING", SCHEDULER_MAX_RUNNING))
+SCHEDULER_MAX_RUNNING_PER_USER = int(os.getenv("SCHEDULER_MAX_RUNNING_PER_USER", SCHEDULER_MAX_RUNNING_PER_USER))
+SCHEDULER_MAX_QUEUED = int(os.getenv("SCHEDULER_MAX_QUEUED", SCHEDULER_MAX_QUEUED))
+SCHEDULER_MAX_QUEUED_PER_USER = int(os.getenv("SCHEDULER_MAX_QUEUED_PER_USER", SCHEDULER_MAX_QUEUED_PER_USER))
+SCHEDULER_AGING = float(os.getenv("SCHEDULER_AGING", SCHEDULER_AGING))
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", CONCURRENT_UPDATES))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", OUTBOX_GLOBAL_RATE))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", OUTBOX_CHAT_RATE))
+OUTBOX_GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", OUTBOX_GROUP_RATE))
+STATUS_DELAY = float(os.getenv("STATUS_DELAY", STATUS_DELAY))
+STATUS_INTERVAL = float(os.getenv("STATUS_INTERVAL", STATUS_INTERVAL))
+# Comma separated Telegram user ids allowed to run maintenance commands such as /warmup
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+BOT_MODE = os.getenv("BOT_MODE", BOT_MODE)
+# Public HTTPS URL Telegram posts updates to, routed to WEBHOOK_LISTEN:WEBHOOK_PORT by the reverse proxy
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+# Checked on every update posted to the router and forwarded to the workers
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", WEBHOOK_LISTEN)
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", WEBHOOK_PORT))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", WEBHOOK_WORKERS))
+WEBHOOK_WORKER_HOST = os.getenv("WEBHOOK_WORKER_HOST", WEBHOOK_WORKER_HOST)
+WEBHOOK_WORKER_BASE_PORT = int(os.getenv("WEBHOOK_WORKER_BASE_PORT", WEBHOOK_WORKER_BASE_PORT))
+# Comma separated worker URLs for a "webhook-router" whose workers run on other machines
+WEBHOOK_WORKER_URLS = [url.strip() for url in os.getenv("WEBHOOK_WORKER_URLS", "").split(",") if url.strip()]
+# Lets the bot talk to a local stand-in of the Telegram Bot API, e.g. benchmarks/fake_bot_api.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+USER_PREFS_DB = os.getenv("USER_PREFS_DB", USER_PREFS_DB)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", METRICS_LISTEN)
+METRICS_PORT = int(os.getenv("METRICS_PORT", METRICS_PORT))
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv("LOOP_WATCHDOG_THRESHOLD", LOOP_WATCHDOG_THRESHOLD))
+USER_PREFS_CACHE_SIZE = int(os.getenv("USER_PREFS_CACHE_SIZE", USER_PREFS_CACHE_SIZE))
+# Comma separated, empty to load everything on first use only
+PRELOAD = [component.strip() for component in os.getenv("PRELOAD", ",".join(PRELOAD)).split(",") if component.strip()]
+
+
+# Background task loading the PRELOAD components, see post_init
+preload_task = None
+# Port of this process' metrics endpoint, see run_webhook_worker
+metrics_port = METRICS_PORT
+metrics_server = None
+
+
+def _create_deepl_translator():
+    import deepl
+    return deepl.Translator(DEEPL_TOKEN, server_url=DEEPL_SERVER_URL)
+
+
+loop_watchdog = LoopWatchdog(LOOP_WATCHDOG_INTERVAL, LOOP_WATCHDOG_THRESHOLD)
+scheduler = FairScheduler(
+    SCHEDULER_MAX_RUNNING, SCHEDULER_MAX_RUNNING_PER_USER, SCHEDULER_MAX_QUEUED, SCHEDULER_MAX_QUEUED_PER_USER,
+    aging=SCHEDULER_AGING
+)
+transcription_pool = TranscriptionPool(
+    WHISPER_MODEL_NAME, WHISPER_WORKERS, WHISPER_MAX_QUEUE,
+    batch_size=WHISPER_BATCH_SIZE, max_wait=WHISPER_BATCH_WAIT
+)
+recognition_pool = SignRecognitionPool(
+    SIGN_RECOGNITION_WORKERS, SIGN_RECOGNITION_MAX_QUEUE, SIGN_POSE_EXTRACTOR, SIGN_RECOGNIZER,
+    # Other recognizers get no options, they have consts of their own if they need any
+    recognizer_options=(
+        {"templates_dir": SIGN_TEMPLATES_DIR, "max_distance": SIGN_TEMPLATE_MAX_DISTANCE}
+        if SIGN_RECOGNIZER == "templates" else {}
+    ),
+    sampling={
+        "min_fps": SIGN_MIN_FPS, "max_fps": SIGN_MAX_FPS, "motion_threshold": SIGN_MOTION_THRESHOLD,
+        "max_frames": SIGN_MAX_FRAMES, "max_side": SIGN_FRAME_MAX_SIDE,
+    },
+)
+render_farm = RenderFarm(RENDER_WORKERS, RENDER_SEGMENT_FRAMES)
+outbox = Outbox(
+    OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GROUP_RATE, OUTBOX_GROUP_BURST,
+    max_retries=OUTBOX_MAX_RETRIES
+)
+with startup_report.measure("open translation cache"):
+    translation_cache = TranslationCache(
+        TRANSLATION_CACHE_DB, TRANSLATION_CACHE_MEMORY_BYTES, TRANSLATION_CACHE_MAX_ROWS, TRANSLATION_CACHE_TTL
+    )
+user_prefs = UserPrefsStore(
+    USER_PREFS_DB, (DEFAULT_SRC_LANG_ID, DEFAULT_DST_LANG_ID, DEFAULT_RENDER_PROFILE_ID), cache_size=USER_PREFS_CACHE_SIZE,
+    flush_interval=USER_PREFS_FLUSH_INTERVAL, batch_size=USER_PREFS_BATCH_SIZE
+)
+deepl_translator = Lazy("DeepL client", _create_deepl_translator, startup_report)
+# Loaded once under Lazy's lock: langdetect fills its global factory in place, unguarded
+lang_profiles = Lazy("langdetect profiles", init_factory, startup_report)
+translator = CachedTranslator(deepl_translator, translation_cache)
+signmt_client = SignMTClient(
+    SIGNMT_BASE_URL, timeout=SIGNMT_TIMEOUT, deadline=SIGNMT_DEADLINE, max_retries=SIGNMT_MAX_RETRIES,
+    backoff=SIGNMT_BACKOFF, max_connections=SIGNMT_MAX_CONNECTIONS
+)
+with startup_report.measure("index pose cache"):
+    pose_cache = PoseCache(POSE_CACHE_DIR, POSE_CACHE_MEMORY_BYTES, POSE_CACHE_DISK_BYTES, POSE_CACHE_TTL)
+with startup_report.measure("index render cache"):
+    render_cache = RenderCache(
+        RENDER_CACHE_DIR, RENDER_CACHE_DISK_BYTES, RENDER_CACHE_MAX_FILE_IDS,
+        # Anything changing how a pose is drawn must be part of the settings, or stale videos get reused
+        render_settings=f"PoseRenderer:{RENDER_BACKGROUND_COLOR}"
+    )
+
+def _service_metrics():
+    scheduler_stats = scheduler.stats()
+    outbox_stats = outbox.stats()
+    return [
+        ("polysignai_scheduler_running", "gauge", "Translations running", [({}, scheduler_stats["running"])]),
+        ("polysignai_scheduler_queued", "gauge", "Translations waiting for their turn", [({}, scheduler_stats["queued"])]),
+        ("polysignai_scheduler_admitted_total", "counter", "Translations admitted", [({}, scheduler_stats["admitted"])]),
+        ("polysignai_scheduler_rejected_total", "counter", "Translations rejected as the queues were full",
+         [({}, scheduler_stats["rejected"])]),
+        ("polysignai_transcriptions_pending", "gauge", "Voice notes being transcribed or waiting for Whisper",
+         [({}, transcription_pool.pending)]),
+        ("polysignai_sign_recognitions_pending", "gauge", "Videos being recognized or waiting for a worker",
+         [({}, recognition_pool.pending)]),
+        ("polysignai_renders_pending", "gauge", "Videos being rendered by the render workers",
+         [({}, render_farm.pending)]),
+        ("polysignai_outbound_calls_total", "counter", "Bot API calls to chats by what the outbox did with them",
+         [({"result": result}, outbox_stats[result]) for result in ("sent", "delayed", "merged", "retried")]),
+    ]
+
+metrics.REGISTRY.add_collector(_service_metrics)
+RENDERS = metrics.REGISTRY.counter("polysignai_renders_total", "Sign language videos rendered", ["profile"])
+RENDERED_BYTES = metrics.REGISTRY.counter(
+    "polysignai_rendered_bytes_total", "Size of the sign language videos rendered", ["profile"]
+)
+metrics.REGISTRY.add_collector(metrics.cache_collector({
+    "pose": pose_cache.stats, "render": render_cache.stats, "translation": translation_cache.stats,
+    "user_prefs": user_prefs.stats,
+}))
 
 # Enable logging
 logging.basicConfig(
@@ -46,54 +206,177 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+# langdetect is randomized, make the same text always detect the same way
+DetectorFactory.seed = 0
+
 def _get_lang_name(part1_iso_code: str) -> str:
+    # Only needed for the rare unsupported language replies, and slow to import
+    import iso639
     return iso639.Language.from_part1(part1_iso_code).name
 
-# Requests utility function
-def build_url(base_url, params):
-    # Construct the full URL with parameters
-    return f"{base_url}?{'&'.join([f'{key}={value}' for key, value in params.items()])}"
-
-async def perform_get_request(update: Update, url):
+_job_status = contextvars.ContextVar("job_status", default=None)
+
+def show_status(update: Update, text: str) -> None:
+    """Shows the stage a translation is at in the single status message of the job, see StatusMessage."""
+    status = _job_status.get()
+    if status is None or status.message is not update.message:
+        status = StatusMessage(update.message, STATUS_DELAY, STATUS_INTERVAL)
+        _job_status.set(status)
+    status.set(text)
+
+async def close_status() -> None:
+    status = _job_status.get()
+    if status is not None:
+        _job_status.set(None)
+        await status.close()
+
+async def fetch_poses(update: Update, phrases: list, spoken: str, signed: str):
+    """
+    Poses of every phrase, from the pose cache or else from sign.mt, all of them at once.
+    None if sign.mt can't provide one of them.
+    """
+    requests = [{"text": phrase, "spoken": spoken, "signed": signed} for phrase in phrases]
+    poses = list(await asyncio.gather(*(pose_cache.get(**params) for params in requests)))
+    missing = [i for i, pose_bytes in enumerate(poses) if pose_bytes is None]
+    if not missing:
+        print(f"\[fetch_poses @ {_get_current_timestamp()}] pose cache hit")
+        return poses
+
+    show_status(update, f"Translating sign language... {SL_TRANSLATION_EMOJI}")
+    fetched = await asyncio.gather(
+        *(signmt_client.fetch_pose(**requests[i]) for i in missing), return_exceptions=True
+    )
+    for i, pose_bytes in zip(missing, fetched):
+        if isinstance(pose_bytes, SignMTError):
+            print(f"[fetch_poses @ {_get_current_timestamp()}] Error during GET request: {pose_bytes}")
+            return None
+        if isinstance(pose_bytes, BaseException):
+            raise pose_bytes
+        print(f"[fetch_poses @ {_get_current_timestamp()}] GET request response: {len(pose_bytes)} bytes")
+        poses[i] = pose_bytes
+    await asyncio.gather(*(pose_cache.put(**requests[i], pose_bytes=poses[i]) for i in missing))
+    return poses
+
+async def pose_to_video(pose_bytes: bytes, profile: str = RENDER_DEFAULT_PROFILE):
+    """Renders the pose as an MP4 in a media buffer, which the caller must close."""
+    video = media_buffer(MEDIA_SPILL_BYTES, MEDIA_SPILL_DIR)
     try:
-        await update.message.reply_text(
-            f"Translating sign language... {SL_TRANSLATION_EMOJI}", reply_to_message_id=update.message.message_id
-        )
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-        print(f"[perform_get_request @ {_get_current_timestamp()}] GET request response: response")
-        return response.content
-    except requests.exceptions.RequestException as e:
-        print(f"[perform_get_request @ {_get_current_timestamp()}] Error during GET request: {e}")
-        return None
+        with metrics.stage("render"):
+            await render_farm.render(
+                pose_bytes, video, {"background_color": RENDER_BACKGROUND_COLOR, **RENDER_PROFILES[profile]}
+            )
+    except BaseException:
+        video.close()
+        raise
+    RENDERED_BYTES.inc(video.tell(), profile=profile)
+    RENDERS.inc(profile=profile)
+    video.seek(0)
+    return video
 
-def pose_to_video(pose_bytes: bytes):
-    pose = Pose.read(pose_bytes)
-    v = PoseVisualizer(pose)
-    file_name = datetime.now().strftime("%Y_%m_%d_%H_%M_%S.mp4")
-    file_path = f"poses/{file_name}"
-    v.save_video(file_path, v.draw((0,0,0)))
-    return file_path
+async def choose_render_profile(update: Update) -> str:
+    """The render profile the user asked for, or else one light enough for the current load."""
+    profile = RENDER_PROFILE_IDS[(await user_prefs.get(update.effective_user.id))[2]]
+    if profile != "auto":
+        return profile
+    scheduler_stats = scheduler.stats()
+    load = (scheduler_stats["running"] + scheduler_stats["queued"]) / SCHEDULER_MAX_RUNNING
+    return RENDER_BUSY_PROFILE if load >= RENDER_BUSY_LOAD else RENDER_DEFAULT_PROFILE
 
 
-def __init_user_data(context: ContextTypes.DEFAULT_TYPE):
-    context.user_data[SRC_LANG] = KEYBOARD_LANG_LIST[1]["text"]
-    context.user_data[DST_LANG] = KEYBOARD_LANG_LIST[5]["text"]
+async def __init_user_data(update: Update):
+    await user_prefs.set(update.effective_user.id, DEFAULT_SRC_LANG_ID, DEFAULT_DST_LANG_ID)
+
+async def get_user_langs(update: Update) -> (str, str):
+    """Source and destination language button texts of the user, the defaults until they pick some."""
+    src_id, dst_id, _ = await user_prefs.get(update.effective_user.id)
+    return KEYBOARD_LANG_LIST[src_id]["text"], KEYBOARD_LANG_LIST[dst_id]["text"]
+
+async def set_user_langs(update: Update, src: str, dst: str):
+    await user_prefs.set(update.effective_user.id, LANG_IDS[src], LANG_IDS[dst])
 
 async def post_init(application: Application):
     await application.bot.set_my_commands(commands=[
         BotCommand("start", "Start the bot"),
         BotCommand("help", "Get a quick overview of the bot's functionalities"),
         BotCommand("swap", "Swap the source and destination languages"),
-        BotCommand("lang", "Show the current source and destination languages")
+        BotCommand("lang", "Show the current source and destination languages"),
+        BotCommand("quality", "Set the quality of sign language videos")
     ])
+    transcription_pool.start()
+    recognition_pool.start()
+    render_farm.start()
+    if LOOP_WATCHDOG_THRESHOLD:
+        loop_watchdog.start()
+    if metrics_port:
+        global metrics_server
+        metrics_server = await metrics.serve_metrics(METRICS_LISTEN, metrics_port)
+        logger.info(f"Metrics on http://{METRICS_LISTEN}:{metrics_port}/metrics")
+    logger.info(startup_report.format("Ready"))
+    if PRELOAD:
+        global preload_task
+        preload_task = asyncio.create_task(preload(PRELOAD))
+
+def _import_renderer():
+    import pose_format
+    import renderer
+
+def _import_audio_decoder():
+    import av
+
+async def preload(components: list):
+    """Loads heavy components in the background, so that the first users don't wait for them."""
+    blocking_steps = {
+        "audio": ("import audio decoder", _import_audio_decoder),
+    }
+    for component in components:
+        try:
+            if component == "translator":
+                # Timed by Lazy itself, as it is when the first translation loads it
+                await asyncio.to_thread(deepl_translator.get)
+            elif component == "langdetect":
+                await asyncio.to_thread(lang_profiles.get)
+            elif component == "whisper":
+                with startup_report.measure(f"Whisper '{WHISPER_MODEL_NAME}' workers"):
+                    await transcription_pool.warm_up()
+            elif component == "recognizer":
+                with startup_report.measure(f"sign recognition workers ({SIGN_POSE_EXTRACTOR}, {SIGN_RECOGNIZER})"):
+                    await recognition_pool.warm_up()
+            elif component == "renderer":
+                # Here for counting frames and joining segments, the workers import it on their own
+                with startup_report.measure("import pose renderer"):
+                    await asyncio.to_thread(_import_renderer)
+                with startup_report.measure(f"{RENDER_WORKERS} render workers"):
+                    await render_farm.warm_up()
+            elif component in blocking_steps:
+                name, load = blocking_steps[component]
+                with startup_report.measure(name):
+                    await asyncio.to_thread(load)
+            else:
+                logger.warning(f"Unknown component to preload: {component}")
+        except Exception as e:
+            logger.warning(f"Can't preload {component}: {e!r}")
+    logger.info(startup_report.format("Preload done"))
+
+async def post_shutdown(application: Application):
+    if preload_task is not None:
+        preload_task.cancel()
+    if metrics_server is not None:
+        metrics_server.close()
+    await loop_watchdog.stop()
+    transcription_pool.shutdown()
+    recognition_pool.shutdown()
+    render_farm.shutdown()
+    await signmt_client.aclose()
+    translation_cache.close()
+    render_cache.close()
+    user_prefs.close()
 
 
 # Define a few command handlers. These usually take the two arguments update and
 # context.
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
-    __init_user_data(context)
+    await __init_user_data(update)
     
     """Send a message when the command /start is issued."""
     await update.message.reply_text(WELCOME_MESSAGE, parse_mode=telegram.constants.ParseMode.MARKDOWN)
@@ -106,41 +389,32 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 ### --- lang --- ###
 
 async def lang_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    keyboard = lang_keyboard.build_keyboard(context.user_data[SRC_LANG], context.user_data[DST_LANG])
+    src_id, dst_id, _ = await user_prefs.get(update.effective_user.id)
+    keyboard = lang_keyboard.get_keyboard(src_id, dst_id)
     await update.message.reply_text(MSG_SET_LANG, reply_markup=keyboard)
 
 async def swap_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
+    _, src, dst = lang_keyboard.decode_callback_data(query.data)
 
-    keyboard = lang_keyboard.swap_languages(query.message.reply_markup)
-    await query.edit_message_reply_markup(keyboard)
+    await query.edit_message_reply_markup(lang_keyboard.get_keyboard(dst, src))
     return await query.answer()
 
 async def lang_selection_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    src, dst = lang_keyboard.get_selected_from_keyboard(query.message.reply_markup)
+    # The button already carries the selection it leads to
+    _, src, dst = lang_keyboard.decode_callback_data(query.data)
 
-    lang, direction = query.data.split("_")
-    if direction == "src":
-        if dst == lang:
-            keyboard = lang_keyboard.swap_languages(query.message.reply_markup)
-        else:
-            keyboard = lang_keyboard.build_keyboard(lang, dst)
-    if direction == "dst":
-        if src == lang:
-            keyboard = lang_keyboard.swap_languages(query.message.reply_markup)
-        else:
-            keyboard = lang_keyboard.build_keyboard(src, lang)
-    
-    await query.edit_message_reply_markup(keyboard)
+    await query.edit_message_reply_markup(lang_keyboard.get_keyboard(src, dst))
     return await query.answer()
 
 async def done_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    src, dst = lang_keyboard.get_selected_from_keyboard(update.callback_query.message.reply_markup)
-    context.user_data[SRC_LANG] = src
-    context.user_data[DST_LANG] = dst
-    await query.edit_message_text(MSG_LANG_SET.format(src, dst), reply_markup=None)
+    _, src, dst = lang_keyboard.decode_callback_data(query.data)
+    await user_prefs.set(update.effective_user.id, src, dst)
+    await query.edit_message_text(
+        MSG_LANG_SET.format(KEYBOARD_LANG_LIST[src]["text"], KEYBOARD_LANG_LIST[dst]["text"]), reply_markup=None
+    )
     return await query.answer()
 
 ### --- lang --- ###
@@ -148,45 +422,30 @@ async def done_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 ### --- swap --- ###
 
 async def swap_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    src_lang, dst_lang = await get_user_langs(update)
+    await set_user_langs(update, dst_lang, src_lang)
 
-    if DST_LANG in context.user_data:
-        # TODO add possibility of selecting missing language if it has NOT been selected before
-    
-        dst_lang = context.user_data[DST_LANG]
-
-    else:
-
-        await update.message.reply_text(
-            f"Can't swap languages because no destination language selected yet.\n"
-            f"Use /dst command to set the destination language"
+    await update.message.reply_text(
+            f"Source and destination language swapped!\n"
+            f"Source language: {dst_lang}\n"
+            f"Destination language: {src_lang}\n"
         )
 
-        return
-
-    if SRC_LANG in context.user_data:
-        # TODO add possibility of selecting missing language if it has NOT been selected before
-    
-        src_lang = context.user_data[SRC_LANG]
-
-    else:
+### --- swap --- ###
 
-        await update.message.reply_text(
-            f"Can't swap languages because no source language selected yet.\n"
-            f"Use /src command to set the source language"
-        )
+### --- quality --- ###
 
+async def quality_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not context.args or context.args[0].lower() not in RENDER_PROFILE_IDS:
+        profile = RENDER_PROFILE_IDS[(await user_prefs.get(update.effective_user.id))[2]]
+        await update.message.reply_text(MSG_QUALITY.format(profile, ", ".join(RENDER_PROFILE_IDS)))
         return
 
-    context.user_data[DST_LANG] = src_lang
-    context.user_data[SRC_LANG] = dst_lang
-
-    await update.message.reply_text(
-            f"Source and destination language swapped!\n"
-            f"Source language: {context.user_data[SRC_LANG]}\n"
-            f"Destination language: {context.user_data[DST_LANG]}\n"
-        )
+    profile = context.args[0].lower()
+    await user_prefs.set(update.effective_user.id, render_profile=RENDER_PROFILE_IDS.index(profile))
+    await update.message.reply_text(MSG_QUALITY_SET.format(profile))
 
-### --- swap --- ###
+### --- quality --- ###
 
 ### --- translation --- ###
 def is_signed(button_text: str):
@@ -194,14 +453,14 @@ def is_signed(button_text: str):
         if button_text in obj.values():
             return not obj["is_spoken"]
 
-async def text_to_sign(update: Update, text: str, src_lang, target_lang) -> BufferedReader:
+async def text_to_sign(update: Update, text: str, src_lang, target_lang) -> dict:
     target_lang = LANGUAGE_DICT[target_lang]
     src_lang = LANGUAGE_DICT[src_lang]
 
     try:
         # passing src_lang as translation target language because in text_to_sign we have a signed target language
         # which obviously is NOT supported by DeepL
-        text_info = translator.translate_text(text, target_lang="en-us" if src_lang == "en" else src_lang)
+        text_info = await translator.translate_text(text, target_lang="en-us" if src_lang == "en" else src_lang)
     except Exception as e:
         print(f"[text_to_sign @ {_get_current_timestamp()}] DeepL fail: {e}")
         await update.message.reply_text(text=MSG_DEEPL_FAIL, reply_to_message_id=update.message.id)
@@ -219,40 +478,109 @@ async def text_to_sign(update: Update, text: str, src_lang, target_lang) -> Buff
         )
         return
 
-    params = {
-        "text": text,
-        "spoken": detected_src,
-        "signed": target_lang
-    }
-
-    pose_bytes = await perform_get_request(update, build_url(TEXT_TO_SIGNED_BASE_URL, params))
-    if pose_bytes == None:
+    # Sentences are fetched concurrently, a long message takes about as long as its longest sentence
+    phrases = split_phrases(text, SIGNMT_MAX_PHRASE_CHARS) or [text]
+    poses = await fetch_poses(update, phrases, detected_src, target_lang)
+    if poses == None:
         await update.message.reply_text(text=MSG_SIGNMT_FAIL, reply_to_message_id=update.message.id)
         return
-    
+
+    if len(poses) == 1:
+        pose_bytes = poses[0]
+    else:
+        try:
+            pose_bytes = await asyncio.to_thread(concatenate_poses, poses, POSE_TRANSITION_SECONDS)
+        except Exception as e:
+            print(f"[text_to_sign @ {_get_current_timestamp()}] Can't join the poses of {len(poses)} sentences: {e}")
+            await update.message.reply_text(text=MSG_POSE_FAIL, reply_to_message_id=update.message.id)
+            return
+
+    profile = await choose_render_profile(update)
+    # Every profile renders its own video of a pose
+    render_key = render_cache.key(pose_bytes, variant=json.dumps(RENDER_PROFILES[profile], sort_keys=True))
+    file_id = render_cache.get_file_id(render_key)
+    if file_id is not None:
+        print(f"\[text_to_sign @ {_get_current_timestamp()}] render cache hit, reusing Telegram file_id")
+        return {"render_key": render_key, "file_id": file_id, "video_path": None, "video": None}
+
+    video_path = await render_cache.get_path(render_key)
+    if video_path is not None:
+        return {"render_key": render_key, "file_id": None, "video_path": video_path, "video": None}
+
     try:
-        await update.message.reply_text(
-            f"Creating sign language video... {HOURGLASS_EMOJI}", reply_to_message_id=update.message.message_id
-        )
-        pose_path = pose_to_video(pose_bytes)
+        show_status(update, f"Creating sign language video... {HOURGLASS_EMOJI}")
+        # Rendering takes seconds, in worker processes: everybody else's updates keep being handled meanwhile
+        video = await pose_to_video(pose_bytes, profile)
     except Exception as e:
         print(f"[text_to_sign @ {_get_current_timestamp()}] Pose fail: {e}")
         await update.message.reply_text(text=MSG_POSE_FAIL, reply_to_message_id=update.message.id)
         return
 
+    try:
+        await render_cache.put_video(render_key, video)
+    except OSError as e:
+        # Not being able to cache the video must not prevent sending it
+        print(f"[text_to_sign @ {_get_current_timestamp()}] Can't cache the rendered video: {e}")
+
+    return {"render_key": render_key, "file_id": None, "video_path": None, "video": video}
+
+async def reply_sign_video(update: Update, sign_video: dict) -> None:
+    """
+    Replies with a text_to_sign result, remembering the file_id of new uploads.
+    Closes the in-memory video of the result, if any.
+    """
+    render_key = sign_video["render_key"]
+    video_path = sign_video["video_path"]
+    video = sign_video["video"]
 
-    video = open(pose_path, "rb")
-    return video
-
-async def audio_to_sign(update: Update, audio, src_lang, target_lang) -> BufferedReader:
+    try:
+        if sign_video["file_id"] is not None:
+            try:
+                with metrics.stage("upload"):
+                    await update.message.reply_video(
+                        video=sign_video["file_id"], supports_streaming=True,
+                        reply_to_message_id=update.message.message_id
+                    )
+                return
+            except telegram.error.BadRequest as e:
+                # file_id no longer valid for this bot, fall back to uploading the video again
+                print(f"[reply_sign_video @ {_get_current_timestamp()}] Stale file_id: {e}")
+                await render_cache.forget_file_id(render_key)
+                video_path = await render_cache.get_path(render_key)
+                if video_path is None:
+                    await update.message.reply_text(text=MSG_POSE_FAIL, reply_to_message_id=update.message.id)
+                    return
+
+        with metrics.stage("upload"):
+            if video is not None:
+                message = await update.message.reply_video(
+                    video=video, filename=SIGN_VIDEO_FILENAME, supports_streaming=True,
+                    reply_to_message_id=update.message.message_id
+                )
+            else:
+                with open(video_path, "rb") as cached_video:
+                    message = await update.message.reply_video(
+                        video=cached_video, filename=SIGN_VIDEO_FILENAME, supports_streaming=True,
+                        reply_to_message_id=update.message.message_id
+                    )
+    finally:
+        if video is not None:
+            video.close()
+
+    if message.video is not None:
+        await render_cache.set_file_id(render_key, message.video.file_id)
+
+async def audio_to_sign(update: Update, audio, src_lang, target_lang) -> dict:
     try:
         print(f"\[audio_to_sign @ {_get_current_timestamp()}] Starting transcribing")
-        await update.message.reply_text(
-            f"Transcribing audio... {TRANSCRIBING_EMOJI}", reply_to_message_id=update.message.message_id
-        )
-        transcribe_info = whisper_model.transcribe(audio)
+        show_status(update, f"Transcribing audio... {TRANSCRIBING_EMOJI}")
+        transcribe_info = await transcription_pool.transcribe(audio)
         print(f"\[audio_to_sign @ {_get_current_timestamp()}] Done transcribing")
         
+    except TranscriptionQueueFull:
+        print(f"\[audio_to_sign @ {_get_current_timestamp()}] Transcription queue full")
+        await update.message.reply_text(text=MSG_WHISPER_QUEUE_FULL, reply_to_message_id=update.message.id)
+        return
     except Exception as e:
         print(f"\[audio_to_sign @ {_get_current_timestamp()}] Whisper fail: {e}")
         await update.message.reply_text(text=MSG_WHISPER_FAIL, reply_to_message_id=update.message.id)
@@ -279,29 +607,54 @@ async def audio_to_sign(update: Update, audio, src_lang, target_lang) -> Buffere
 
     return await text_to_sign(update, transcribe_info["text"], LANGUAGE_DICT_REVERSED[detected_src], target_lang)
 
+def _detect_lang_locally(text: str):
+    """ISO 639-1 code of the language of text, or None when langdetect is not confident enough."""
+    if len(text.strip()) < LANG_DETECT_MIN_CHARS:
+        return None
+    lang_profiles.get()
+    try:
+        best_guess = lang_detector(text)[0]
+    except LangDetectException:
+        return None
+    if best_guess.prob < LANG_DETECT_MIN_CONFIDENCE:
+        return None
+    # langdetect uses region subtags for some languages, e.g. zh-cn
+    return best_guess.lang.split("-")[0]
+
 async def text_to_text(update: Update, text: str, src_lang, target_lang) -> dict:
     target_lang = LANGUAGE_DICT[target_lang]
     src_lang = LANGUAGE_DICT[src_lang]
 
-    try:
-        text_info = translator.translate_text(text, target_lang="en-us" if target_lang == "en" else target_lang)
-    except Exception as e:
-        print(f"[text_to_text @ {_get_current_timestamp()}] DeepL fail: {e}")
-        await update.message.reply_text(text=MSG_DEEPL_FAIL, reply_to_message_id=update.message.id)
-        return
-    
-    detected_src = text_info.detected_source_lang.lower()
+    # Whether to swap languages depends on the input language: detect it locally when possible,
+    # asking DeepL to detect it costs a whole extra translation
+    text_info = None
+    # Off the event loop: detection takes milliseconds, loading the profiles if not preloaded yet seconds
+    detected_src = await asyncio.to_thread(_detect_lang_locally, text)
+    print(f"[text_to_text @ {_get_current_timestamp()}] locally detected src: {detected_src}")
+
+    if detected_src is None:
+        try:
+            text_info = await translator.translate_text(text, target_lang="en-us" if target_lang == "en" else target_lang)
+        except Exception as e:
+            print(f"[text_to_text @ {_get_current_timestamp()}] DeepL fail: {e}")
+            await update.message.reply_text(text=MSG_DEEPL_FAIL, reply_to_message_id=update.message.id)
+            return
+        detected_src = text_info.detected_source_lang.lower()
 
     should_swap_langs = detected_src == target_lang
     if should_swap_langs:
         target_lang = src_lang
 
-    try:
-        translation = translator.translate_text(text, target_lang="en-us" if target_lang == "en" else target_lang)
-    except Exception as e:
-        print(f"[text_to_text @ {_get_current_timestamp()}] DeepL fail: {e}")
-        await update.message.reply_text(text=MSG_DEEPL_FAIL, reply_to_message_id=update.message.id)
-        return
+    if text_info is not None and not should_swap_langs:
+        # The detection round-trip already translated to the right language
+        translation = text_info
+    else:
+        try:
+            translation = await translator.translate_text(text, target_lang="en-us" if target_lang == "en" else target_lang)
+        except Exception as e:
+            print(f"[text_to_text @ {_get_current_timestamp()}] DeepL fail: {e}")
+            await update.message.reply_text(text=MSG_DEEPL_FAIL, reply_to_message_id=update.message.id)
+            return
     
     return {
         "translation": translation.text,
@@ -309,74 +662,200 @@ async def text_to_text(update: Update, text: str, src_lang, target_lang) -> dict
         "is_swapped": should_swap_langs
     }
 
+def _split_message(text: str) -> list:
+    """text in chunks Telegram accepts as messages, cut between words when possible."""
+    chunks = []
+    while len(text) > TELEGRAM_MESSAGE_MAX_CHARS:
+        cut = text.rfind(" ", 0, TELEGRAM_MESSAGE_MAX_CHARS)
+        if cut <= 0:
+            cut = TELEGRAM_MESSAGE_MAX_CHARS
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip()
+    chunks.append(text)
+    return chunks
+
+async def reply_progressively(update: Update, replies: list, text: str) -> None:
+    """
+    Shows text, which keeps growing, in replies: [message, shown text] pairs, edited in place
+    while text fits in them and followed by new replies once it does not anymore.
+    """
+    for i, chunk in enumerate(_split_message(text)):
+        if i == len(replies):
+            replies.append([await update.message.reply_text(chunk, reply_to_message_id=update.message.message_id), chunk])
+        elif replies[i][1] != chunk:
+            await replies[i][0].edit_text(chunk)
+            replies[i][1] = chunk
+
 async def audio_to_text(update: Update, audio, src_lang, target_lang) -> dict:
+    """
+    Translates audio a transcribed slice at a time, showing the translation so far in the reply
+    the status message turns into: long voice notes start being readable after one slice's
+    transcription, not the whole voice note's.
+    """
     target_lang = LANGUAGE_DICT[target_lang]
     src_lang = LANGUAGE_DICT[src_lang]
 
-    try:
-        print(f"[audio_to_text @ {_get_current_timestamp()}] Starting transcribing")
-        await update.message.reply_text(
-            f"Transcribing audio... {TRANSCRIBING_EMOJI}", reply_to_message_id=update.message.message_id
-        )
-        transcribe_info = whisper_model.transcribe(audio)
-        print(f"[audio_to_text @ {_get_current_timestamp()}] Done transcribing")
-    except Exception as e:
-        print(f"[audio_to_text @ {_get_current_timestamp()}] Whisper fail: {e}")
-        await update.message.reply_text(text=MSG_WHISPER_FAIL, reply_to_message_id=update.message.id)
-        return
+    print(f"[audio_to_text @ {_get_current_timestamp()}] Starting transcribing")
+    show_status(update, f"Transcribing audio... {TRANSCRIBING_EMOJI}")
+    replies = []
 
-    if transcribe_info["text"] == "":
+    detected_src = None
+    should_swap_langs = False
+    translations = []
+    segments = transcription_pool.transcribe_segments(audio)
+    try:
+        while True:
+            try:
+                segment = await anext(segments)
+            except StopAsyncIteration:
+                break
+            except TranscriptionQueueFull:
+                print(f"[audio_to_text @ {_get_current_timestamp()}] Transcription queue full")
+                await update.message.reply_text(text=MSG_WHISPER_QUEUE_FULL, reply_to_message_id=update.message.id)
+                return
+            except Exception as e:
+                print(f"[audio_to_text @ {_get_current_timestamp()}] Whisper fail: {e}")
+                await update.message.reply_text(text=MSG_WHISPER_FAIL, reply_to_message_id=update.message.id)
+                return
+
+            if detected_src is None:
+                # Every slice is transcribed in the language heard in the first one
+                detected_src = segment["language"].lower()
+                print(f"\[audio_to_text @ {_get_current_timestamp()}] detected src     : {detected_src}")
+
+                if detected_src not in SUPPORTED_LANGUAGES_DEEPL_ISO_CODES:
+                    await update.message.reply_text(
+                        f"Please excuse us, {_get_lang_name(detected_src)} language is not supported yet in spoken language translations... {SAD_EMOJI_2}\n" \
+                            f"Please register an audio speaking one of the following languages: {SUPPORTED_LANGUAGES_STR}", 
+                        reply_to_message_id=update.message.message_id
+                    )
+                    return
+
+                should_swap_langs = detected_src == target_lang
+                if should_swap_langs:
+                    target_lang = src_lang
+
+            if segment["text"].strip() == "":
+                continue
+            print(f"\[audio_to_text @ {_get_current_timestamp()}] transcribed segment: {segment['text']}")
+
+            try:
+                translation = await translator.translate_text(segment["text"], source_lang=detected_src, target_lang="en-us" if target_lang == "en" else target_lang)
+            except Exception as e:
+                print(f"DeepL fail: {e}")
+                await update.message.reply_text(text=MSG_DEEPL_FAIL, reply_to_message_id=update.message.id)
+                return
+            translations.append(translation.text)
+            if not replies:
+                status, status_text = await _job_status.get().take()
+                if status is not None:
+                    replies.append([status, status_text])
+            await reply_progressively(update, replies, " ".join(translations))
+    finally:
+        await segments.aclose()
+    print(f"[audio_to_text @ {_get_current_timestamp()}] Done transcribing")
+
+    if not translations:
         await update.message.reply_text(text=MSG_WHISPER_UNABLE_TO_TRANSCRIBE, reply_to_message_id=update.message.id)
         return
-        
-    detected_src = transcribe_info["language"].lower()
 
-    print(f"\[audio_to_text @ {_get_current_timestamp()}] transcribed audio: {transcribe_info['text']}")
-    print(f"\[audio_to_text @ {_get_current_timestamp()}] detected src     : {detected_src}")
-
-    if detected_src not in SUPPORTED_LANGUAGES_DEEPL_ISO_CODES:
-        await update.message.reply_text(
-            f"Please excuse us, {_get_lang_name(detected_src)} language is not supported yet in spoken language translations... {SAD_EMOJI_2}\n" \
-                f"Please register an audio speaking one of the following languages: {SUPPORTED_LANGUAGES_STR}", 
-            reply_to_message_id=update.message.message_id
-        )
-        return
-
-    should_swap_langs = detected_src == target_lang
-    if should_swap_langs:
-        target_lang = src_lang
-    
-    try:
-        translation = translator.translate_text(transcribe_info["text"], source_lang=detected_src, target_lang="en-us" if target_lang == "en" else target_lang)
-    except Exception as e:
-        print(f"DeepL fail: {e}")
-        await update.message.reply_text(text=MSG_DEEPL_FAIL, reply_to_message_id=update.message.id)
-        return
-    
     return {
-        "translation": translation.text,
+        "translation": " ".join(translations),
         "detected_src": detected_src,
         "is_swapped": should_swap_langs
     }
 
-def sign_to_text(video_path, src_lang, target_lang) -> str:
+async def sign_to_text(update: Update, video, src_lang, target_lang) -> str:
     target_lang = LANGUAGE_DICT[target_lang]
     src_lang = LANGUAGE_DICT[src_lang]
 
-    text = random.choice(SENTENCES)
-    translation = translator.translate_text(text, source_lang="en", target_lang="en-us" if target_lang == "en" else target_lang)
+    try:
+        print(f"[sign_to_text @ {_get_current_timestamp()}] Starting recognizing")
+        show_status(update, f"Recognizing sign language... {SL_TRANSLATION_EMOJI}")
+        # Video notes are a few MB at most, the workers decode them from memory
+        recognized = await recognition_pool.recognize(await asyncio.to_thread(video.read), src_lang)
+    except RecognitionQueueFull:
+        print(f"[sign_to_text @ {_get_current_timestamp()}] Recognition queue full")
+        await update.message.reply_text(text=MSG_RECOGNITION_QUEUE_FULL, reply_to_message_id=update.message.id)
+        return
+    except Exception as e:
+        print(f"[sign_to_text @ {_get_current_timestamp()}] Recognition fail: {e}")
+        await update.message.reply_text(text=MSG_SIGN_RECOGNITION_FAIL, reply_to_message_id=update.message.id)
+        return
+
+    if recognized is None:
+        await update.message.reply_text(text=MSG_SIGN_UNRECOGNIZED, reply_to_message_id=update.message.id)
+        return
+
+    print(f"[sign_to_text @ {_get_current_timestamp()}] recognized: {recognized}")
+    if recognized["spoken"] == target_lang:
+        return recognized["text"]
+
+    try:
+        translation = await translator.translate_text(
+            recognized["text"], source_lang=recognized["spoken"], target_lang="en-us" if target_lang == "en" else target_lang
+        )
+    except Exception as e:
+        print(f"[sign_to_text @ {_get_current_timestamp()}] DeepL fail: {e}")
+        await update.message.reply_text(text=MSG_DEEPL_FAIL, reply_to_message_id=update.message.id)
+        return
     return translation.text
 
-async def sign_to_sign(update: Update, video_path, src_lang, target_lang) -> BufferedReader:
-    text = sign_to_text(video_path, src_lang, list(LANGUAGE_DICT.keys())[0])
+async def sign_to_sign(update: Update, video, src_lang, target_lang) -> dict:
+    text = await sign_to_text(update, video, src_lang, list(LANGUAGE_DICT.keys())[0])
+    if text is None:
+        return
     video = await text_to_sign(update, text, list(LANGUAGE_DICT.keys())[0], target_lang)
     return video
 
 
+async def _estimate_job_cost(update: Update, context: ContextTypes.DEFAULT_TYPE) -> float:
+    """Rough processing time of a translation in seconds, from what is known before running it."""
+    message = update.message
+    src, dst = await get_user_langs(update)
+    involves_signed = is_signed(src) or is_signed(dst)
+
+    cost = JOB_COST_BASE
+    if message.voice is not None:
+        cost += message.voice.duration * JOB_COST_PER_AUDIO_SECOND
+        if involves_signed:
+            cost += message.voice.duration * SPEECH_CHARS_PER_SECOND * JOB_COST_PER_SIGNED_CHAR
+    elif message.video_note is not None or message.video is not None:
+        video = message.video_note or message.video
+        cost += video.duration * JOB_COST_PER_VIDEO_SECOND
+    elif message.text is not None and involves_signed:
+        cost += len(message.text) * JOB_COST_PER_SIGNED_CHAR
+    return cost
+
+def _job_owner(update: Update) -> int:
+    # The same key as webhook.update_user_id: a user's jobs are all queued in the worker they are routed to
+    return update.effective_user.id if update.effective_user is not None else update.effective_chat.id
+
+def scheduled(entry_point):
+    """Runs a translation entry point only when the scheduler gives its user a turn."""
+    @functools.wraps(entry_point)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        try:
+            with metrics.trace(update.update_id, entry_point.__name__):
+                queued_at = time.perf_counter()
+                async with scheduler.slot(_job_owner(update), cost=await _estimate_job_cost(update, context)):
+                    metrics.observe_stage("queue", time.perf_counter() - queued_at)
+                    return await entry_point(update, context)
+        except SchedulerFull as e:
+            print(f"[{entry_point.__name__} @ {_get_current_timestamp()}] Rejected: {e}")
+            await update.message.reply_text(
+                MSG_CHAT_QUEUE_FULL if e.owner_queue_full else MSG_BOT_BUSY,
+                reply_to_message_id=update.message.message_id
+            )
+        finally:
+            # Whatever the outcome, its replies or error message are sent by now: no stale status is left
+            await close_status()
+    return wrapper
+
+@scheduled
 async def text_translation_entry_point(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     msg_id = update.message.message_id
-    src = context.user_data[SRC_LANG]
-    dst = context.user_data[DST_LANG]
+    src, dst = await get_user_langs(update)
 
     # Error handling
     if is_signed(src) and is_signed(dst):
@@ -400,18 +879,18 @@ async def text_translation_entry_point(update: Update, context: ContextTypes.DEF
         video = await text_to_sign(update, update.message.text, src,  dst)
         if video == None:
             return
-        await update.message.reply_video(video=video, supports_streaming=True, reply_to_message_id=msg_id)
+        await reply_sign_video(update, video)
     elif not is_signed(dst):
         # Swapping
         video = await text_to_sign(update, update.message.text, dst, src)
         if video == None:
             return
-        await update.message.reply_video(video, reply_to_message_id=msg_id)
+        await reply_sign_video(update, video)
 
+@scheduled
 async def video_translation_entry_point(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     msg_id = update.message.message_id
-    src = context.user_data[SRC_LANG]
-    dst = context.user_data[DST_LANG]
+    src, dst = await get_user_langs(update)
 
     # Error handling
     if (not is_signed(src)) and (not is_signed(dst)):
@@ -422,28 +901,33 @@ async def video_translation_entry_point(update: Update, context: ContextTypes.DE
         src = SPOKEN_TO_SIGNED[src]
 
     # No errors detected
-    file_info = await update.message.video_note.get_file()
-    file_path = f"./video/{file_info.file_unique_id}.mp4"
-    await file_info.download_to_drive(file_path)
-
-    # No errors detected
-    if is_signed(src) and is_signed(dst):
-        video = await sign_to_sign(update, file_path, src, dst)
-        await update.message.reply_video(video=video, supports_streaming=True, reply_to_message_id=msg_id)
-    elif is_signed(src):
-        # Without swapping
-        text = sign_to_text(file_path, src, dst)
-        await update.message.reply_text(text, reply_to_message_id=msg_id)
-    elif is_signed(dst):
-        # Swapping
-        text = sign_to_text(file_path, dst, src)
-        await update.message.reply_text(text, reply_to_message_id=msg_id)
+    file_info = await (update.message.video_note or update.message.video).get_file()
+    with await download(file_info, MEDIA_SPILL_BYTES, MEDIA_SPILL_DIR) as input_video:
+
+        # No errors detected
+        if is_signed(src) and is_signed(dst):
+            video = await sign_to_sign(update, input_video, src, dst)
+            if video == None:
+                return
+            await reply_sign_video(update, video)
+        elif is_signed(src):
+            # Without swapping
+            text = await sign_to_text(update, input_video, src, dst)
+            if text == None:
+                return
+            await update.message.reply_text(text, reply_to_message_id=msg_id)
+        elif is_signed(dst):
+            # Swapping
+            text = await sign_to_text(update, input_video, dst, src)
+            if text == None:
+                return
+            await update.message.reply_text(text, reply_to_message_id=msg_id)
     
 
+@scheduled
 async def audio_translation_entry_point(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     msg_id = update.message.message_id
-    src = context.user_data[SRC_LANG]
-    dst = context.user_data[DST_LANG]
+    src, dst = await get_user_langs(update)
 
     # Error handling
     if is_signed(src) and is_signed(dst):
@@ -456,44 +940,111 @@ async def audio_translation_entry_point(update: Update, context: ContextTypes.DE
     
     # No errors detected
     file_info = await update.message.voice.get_file()
-    file_path = f"./voice/{file_info.file_unique_id}.ogg"
-    await file_info.download_to_drive(file_path)
-    audio_data = whisper.load_audio(file_path)
+    with await download(file_info, MEDIA_SPILL_BYTES, MEDIA_SPILL_DIR) as voice:
+        try:
+            audio_data = await decode_audio(voice)
+        except AudioDecodeError as e:
+            print(f"[audio_translation_entry_point @ {_get_current_timestamp()}] Can't decode voice note: {e}")
+            await update.message.reply_text(text=MSG_WHISPER_UNABLE_TO_TRANSCRIBE, reply_to_message_id=msg_id)
+            return
 
     if not is_signed(src) and not is_signed(dst):
+        # The translation is shown while it is being made, nothing left to reply
         result = await audio_to_text(update, audio_data, src, dst)
         print(result)
-        if result == None:
-            return
-        await update.message.reply_text(result["translation"], reply_to_message_id=msg_id)
     elif not is_signed(src):
         # Without swapping
         video = await audio_to_sign(update, audio_data, src, dst)
         if video == None:
             return
-        await update.message.reply_video(video=video, supports_streaming=True, reply_to_message_id=msg_id)
+        await reply_sign_video(update, video)
     elif not is_signed(dst):
         # Swapping
         video = await audio_to_sign(update, audio_data, dst, src)
         if video == None:
             return
-        await update.message.reply_video(video, reply_to_message_id=msg_id)
+        await reply_sign_video(update, video)
 
 ### --- translation --- ###
 
+### --- warmup --- ###
+
+async def warmup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text(MSG_ADMIN_ONLY, reply_to_message_id=update.message.message_id)
+        return
+
+    requests_to_warm = [
+        {"text": phrase, "spoken": LANGUAGE_DICT[spoken], "signed": LANGUAGE_DICT[signed]}
+        for spoken, signed in SPOKEN_TO_SIGNED.items()
+        for phrase in WARMUP_PHRASES.get(LANGUAGE_DICT[spoken], [])
+    ]
+    await update.message.reply_text(MSG_WARMUP_STARTED.format(len(requests_to_warm)))
+
+    fetched = cached = failed = 0
+    templates = []
+    for params in requests_to_warm:
+        pose_bytes = await pose_cache.get(**params)
+        if pose_bytes is not None:
+            cached += 1
+        else:
+            try:
+                pose_bytes = await signmt_client.fetch_pose(**params)
+            except SignMTError as e:
+                print(f"[warmup_command @ {_get_current_timestamp()}] Can't warm up {params}: {e}")
+                failed += 1
+                continue
+            await pose_cache.put(**params, pose_bytes=pose_bytes)
+            fetched += 1
+        templates.append((f"{pose_cache.key(**params)}.pose", pose_bytes, params["text"], params["spoken"], params["signed"]))
+
+    if SIGN_RECOGNIZER == "templates" and templates:
+        # The common phrases are what the reference recognizer can recognize
+        await asyncio.to_thread(save_templates, SIGN_TEMPLATES_DIR, templates)
+        recognition_pool.reload()
+
+    await update.message.reply_text(MSG_WARMUP_DONE.format(fetched, cached, failed, pose_cache.stats()))
+
+### --- warmup --- ###
+
+### --- stats --- ###
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text(MSG_ADMIN_ONLY, reply_to_message_id=update.message.message_id)
+        return
+
+    stats = {
+        "scheduler": scheduler.stats(),
+        "transcription": {"pending": transcription_pool.pending, "capacity": transcription_pool.capacity},
+        "sign_recognition": {"pending": recognition_pool.pending, "capacity": recognition_pool.capacity},
+        "render": {"pending": render_farm.pending, "workers": render_farm.workers},
+        "outbox": outbox.stats(),
+        "pose_cache": pose_cache.stats(),
+        "render_cache": render_cache.stats(),
+        "translation_cache": translation_cache.stats(),
+        "user_prefs": user_prefs.stats(),
+    }
+    await update.message.reply_text(MSG_STATS.format(json.dumps(stats, indent=2)))
+
+### --- stats --- ###
+
 async def not_supported_type_entry_point(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text("not_supported_type_entry_point")
 
 async def query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
+    # None for selected languages, and for keyboards sent by older versions of the bot
+    decoded = lang_keyboard.decode_callback_data(query.data)
+    action = decoded[0] if decoded is not None else None
 
-    if "_src" in query.data or "_dst" in query.data:
+    if action == lang_keyboard.SELECT_ACTION:
         return await lang_selection_handler(update, context)
     
-    if query.data == "Swap":
+    if action == lang_keyboard.SWAP_ACTION:
         return await swap_handler(update, context)
 
-    if query.data == "Done":
+    if action == lang_keyboard.DONE_ACTION:
         return await done_handler(update, context)
 
     return await query.answer()
@@ -504,23 +1055,29 @@ async def detect_wrong_command(update: Update, context: ContextTypes.DEFAULT_TYP
         reply_to_message_id=update.message.message_id
         )
 
-def _create_required_dirs():
-    
-    for dir in REQUIRED_DIRS:
-        os.makedirs(dir, exist_ok=True)
-
-def main() -> None:
+def build_application() -> Application:
+    builder = (
+        Application.builder().token(BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+        # Translations wait for their turn in the scheduler instead of blocking every other update
+        .concurrent_updates(CONCURRENT_UPDATES)
+        # Every Bot API call goes through the outbox, within Telegram's flood limits
+        .rate_limiter(outbox)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    if BOT_MODE != "polling":
+        # Updates come from the webhook router instead
+        builder = builder.updater(None)
+    application = builder.build()
 
-    _create_required_dirs()
-
-    """Start the bot."""
-    # Create the Application and pass it your bot's token.
-    application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
     # on different commands - answer in Telegram
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("swap", swap_command))
     application.add_handler(CommandHandler("lang", lang_command))
+    application.add_handler(CommandHandler("quality", quality_command))
+    application.add_handler(CommandHandler("warmup", warmup_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CallbackQueryHandler(query_handler))
 
     # on non command i.e message - echo the message on Telegram
@@ -536,10 +1093,99 @@ def main() -> None:
 
     application.add_handler(MessageHandler(not_supported_filter, not_supported_type_entry_point))
 
+    return application
+
+### --- webhook --- ###
+
+def _stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+    return stop
+
+async def _serve_webhook_worker(host: str, port: int):
+    application = build_application()
+    stop = _stop_event()
+    async with application:
+        # run_polling and run_webhook call these themselves, a custom webhook must do it
+        await post_init(application)
+        await application.start()
+        server = await serve_http(UpdateReceiver(application, WEBHOOK_SECRET).handle, host, port)
+        logger.info(f"Webhook worker listening on {host}:{port}")
+        await stop.wait()
+        server.close()
+        await server.wait_closed()
+        await application.stop()
+    await post_shutdown(application)
+
+def run_webhook_worker(host: str, port: int):
+    if METRICS_PORT:
+        # Every worker of the machine serves its own metrics
+        global metrics_port
+        metrics_port = METRICS_PORT + port - WEBHOOK_WORKER_BASE_PORT
+    asyncio.run(_serve_webhook_worker(host, port))
+
+async def _serve_webhook_router(worker_urls: list):
+    router = UpdateRouter(worker_urls, WEBHOOK_SECRET, timeout=WEBHOOK_FORWARD_TIMEOUT)
+    stop = _stop_event()
+    server = await serve_http(router.handle, WEBHOOK_LISTEN, WEBHOOK_PORT)
+    logger.info(f"Webhook router listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}, routing to {worker_urls}")
+
+    if WEBHOOK_URL:
+        bot_options = {"base_url": f"{TELEGRAM_API_URL}/bot"} if TELEGRAM_API_URL else {}
+        async with telegram.Bot(BOT_TOKEN, **bot_options) as bot:
+            await bot.set_webhook(WEBHOOK_URL, allowed_updates=Update.ALL_TYPES, secret_token=WEBHOOK_SECRET)
+    else:
+        logger.warning("WEBHOOK_URL is not set, Telegram's webhook is left as it is")
+
+    await stop.wait()
+    server.close()
+    await server.wait_closed()
+    await router.aclose()
+    logger.info(f"Updates forwarded to each worker: {router.forwarded}")
+
+def run_webhook(worker_count: int):
+    """Runs the router in this process and worker_count local worker processes behind it."""
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=run_webhook_worker, args=(WEBHOOK_WORKER_HOST, WEBHOOK_WORKER_BASE_PORT + i),
+            name=f"webhook-worker-{i}"
+        )
+        for i in range(worker_count)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        asyncio.run(_serve_webhook_router([
+            f"http://{WEBHOOK_WORKER_HOST}:{WEBHOOK_WORKER_BASE_PORT + i}{WEBHOOK_PATH}" for i in range(worker_count)
+        ]))
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
 
-    # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+### --- webhook --- ###
+
+def main() -> None:
+
+    if MEDIA_SPILL_DIR is not None:
+        os.makedirs(MEDIA_SPILL_DIR, exist_ok=True)
+
+    """Start the bot."""
+    if BOT_MODE == "polling":
+        # Run the bot until the user presses Ctrl-C
+        build_application().run_polling(allowed_updates=Update.ALL_TYPES)
+    elif BOT_MODE == "webhook":
+        run_webhook(WEBHOOK_WORKERS)
+    elif BOT_MODE == "webhook-router":
+        asyncio.run(_serve_webhook_router(WEBHOOK_WORKER_URLS))
+    elif BOT_MODE == "webhook-worker":
+        run_webhook_worker(WEBHOOK_WORKER_HOST, WEBHOOK_WORKER_BASE_PORT)
+    else:
+        raise ValueError(f"Unknown BOT_MODE: {BOT_MODE}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
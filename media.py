@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import tempfile
+from typing import BinaryIO
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Same sample rate whisper.load_audio resamples to
+SAMPLE_RATE = 16000
+_PIPE_CHUNK_BYTES = 64 * 1024
+
+
+class AudioDecodeError(Exception):
+    """Raised when a voice note can't be decoded, in process nor by ffmpeg."""
+
+
+def media_buffer(spill_bytes: int = 0, spill_dir: str = None) -> BinaryIO:
+    """
+    Buffer for downloaded or rendered media. It lives in memory until it grows past
+    `spill_bytes` (never when 0), then moves to an anonymous temporary file in `spill_dir`
+    (the system default when None). Either way nothing is left behind once it is closed.
+    """
+    return tempfile.SpooledTemporaryFile(max_size=spill_bytes, dir=spill_dir)
+
+
+async def download(telegram_file, spill_bytes: int = 0, spill_dir: str = None) -> BinaryIO:
+    """Downloads a telegram.File into a media_buffer, returned positioned at its start."""
+    buffer = media_buffer(spill_bytes, spill_dir)
+    try:
+        with metrics.stage("download"):
+            await telegram_file.download_to_memory(buffer)
+    except BaseException:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer
+
+
+def _decode_audio_in_process(media: BinaryIO, sample_rate: int) -> np.ndarray:
+    """Demuxes, decodes and resamples media with PyAV's bundled libav, no subprocess involved."""
+    import av
+
+    chunks = []
+    with av.open(media, mode="r") as container:
+        stream = container.streams.audio[0]
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=sample_rate)
+        for frame in container.decode(stream):
+            chunks.extend(resampled.to_ndarray() for resampled in resampler.resample(frame))
+        chunks.extend(resampled.to_ndarray() for resampled in resampler.resample(None))
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    # Packed mono frames come out as (1, samples) arrays
+    return np.concatenate(chunks, axis=1).ravel()
+
+
+async def decode_audio(media: BinaryIO, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    In-memory equivalent of whisper.load_audio: mono float32 PCM at sample_rate.
+
+    Voice notes (OGG/Opus) and the other usual formats are decoded in process by PyAV, in a
+    worker thread. Anything PyAV can't handle goes through the ffmpeg binary instead.
+    """
+    import av
+
+    with metrics.stage("decode_audio"):
+        start = media.tell()
+        try:
+            return await asyncio.to_thread(_decode_audio_in_process, media, sample_rate)
+        except (av.FFmpegError, IndexError) as e:
+            # IndexError: the container has no audio stream PyAV recognizes
+            logger.info(f"In-process audio decoding failed ({e!r}), falling back to ffmpeg")
+        media.seek(start)
+        return await _decode_audio_with_ffmpeg(media, sample_rate)
+
+
+async def _decode_audio_with_ffmpeg(media: BinaryIO, sample_rate: int) -> np.ndarray:
+    """Pipes media through an ffmpeg subprocess, without touching the disk nor blocking the event loop."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-threads", "0", "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise AudioDecodeError("ffmpeg is not installed")
+
+    async def feed():
+        try:
+            while chunk := media.read(_PIPE_CHUNK_BYTES):
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg gave up on the input, its exit status tells why
+            pass
+        finally:
+            process.stdin.close()
+
+    _, pcm, errors = await asyncio.gather(feed(), process.stdout.read(), process.stderr.read())
+    if await process.wait() != 0:
+        error_lines = errors.decode(errors="replace").strip().splitlines()
+        raise AudioDecodeError(error_lines[-1] if error_lines else "ffmpeg failed")
+
+    return np.frombuffer(pcm, np.int16).flatten().astype(np.float32) / 32768.0
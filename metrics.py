@@ -0,0 +1,287 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cache hit to a long voice note
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> list:
+        """(name, labels, value) of every sample of the metric."""
+        with self._lock:
+            return [
+                (self.name, dict(zip(self.label_names, key)), value) for key, value in self._values.items()
+            ]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then the sum
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def samples(self) -> list:
+        samples = []
+        for name, labels, counts in super().samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f"{name}_bucket", {**labels, "le": _format_value(float(bound))}, cumulative))
+            samples.append((f"{name}_sum", labels, counts[-1]))
+            samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    """
+    Metrics of the process in Prometheus' text format. Besides the metrics it owns, collectors
+    are functions returning [(name, type, help, [(labels, value), ...]), ...] computed at scrape
+    time, for state other objects already keep track of.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, label_names=()) -> Counter:
+        return self._register(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names=()) -> Gauge:
+        return self._register(Gauge(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, label_names, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in metric.samples())
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector {collector!r} failed: {e!r}")
+                continue
+            for name, metric_type, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "polysignai_stage_seconds", "Duration of the pipeline stages, failed ones included", ["stage"]
+)
+STAGE_IN_FLIGHT = REGISTRY.gauge("polysignai_stage_in_flight", "Pipeline stages running right now", ["stage"])
+# deepl, signmt and transcribe failures are those of DeepL, sign.mt and Whisper
+STAGE_FAILURES = REGISTRY.counter("polysignai_stage_failures_total", "Pipeline stages that raised", ["stage"])
+UPDATE_SECONDS = REGISTRY.histogram(
+    "polysignai_update_seconds", "Time from receiving a translation request to its last reply", ["handler"]
+)
+
+
+class Trace:
+    """Stages of the handling of one Telegram update, logged as a single line once done."""
+
+    def __init__(self, update_id: int, handler: str):
+        self.update_id = update_id
+        self.handler = handler
+        self.started = time.perf_counter()
+        self.stages = []  # (stage, seconds, failed)
+
+    def format(self) -> str:
+        stages = ", ".join(
+            f"{stage} {seconds:.3f}s{' failed' if failed else ''}" for stage, seconds, failed in self.stages
+        )
+        return f"update {self.update_id} {self.handler} {time.perf_counter() - self.started:.3f}s: {stages or '-'}"
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+# Same traces, for code outside the task's context such as the loop watchdog thread
+_traces_by_task = weakref.WeakKeyDictionary()
+
+
+def current_update_id():
+    current = _current_trace.get()
+    return None if current is None else current.update_id
+
+
+def trace_of(task: asyncio.Task):
+    return _traces_by_task.get(task)
+
+
+@contextmanager
+def trace(update_id: int, handler: str):
+    """Ties the stages run inside, in this task and the tasks it starts, to update_id."""
+    current = Trace(update_id, handler)
+    token = _current_trace.set(current)
+    task = asyncio.current_task()
+    if task is not None:
+        _traces_by_task[task] = current
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        if task is not None:
+            _traces_by_task.pop(task, None)
+        UPDATE_SECONDS.observe(time.perf_counter() - current.started, handler=handler)
+        logger.info(current.format())
+
+
+def observe_stage(name: str, seconds: float, failed: bool = False):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    if failed:
+        STAGE_FAILURES.inc(stage=name)
+    current = _current_trace.get()
+    if current is not None:
+        current.stages.append((name, seconds, failed))
+
+
+@contextmanager
+def stage(name: str):
+    """Times the code inside as pipeline stage `name`, counting it as failed if it raises."""
+    STAGE_IN_FLIGHT.inc(stage=name)
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        STAGE_IN_FLIGHT.dec(stage=name)
+        observe_stage(name, time.perf_counter() - start, failed)
+
+
+def _cache_tiers(path: str, stats: dict):
+    # Any dict with hits and misses is the CacheStats of a tier, e.g. the memory or disk of a cache
+    if "hits" in stats and "misses" in stats:
+        yield path, stats
+    for name, value in stats.items():
+        if isinstance(value, dict):
+            yield from _cache_tiers(f"{path}_{name}", value)
+
+
+def cache_collector(caches: dict):
+    """Collector of the stats() of caches, given as name -> stats function."""
+
+    def collect():
+        lookups, evictions, entries, size = [], [], [], []
+        for cache_name, stats in caches.items():
+            for tier, tier_stats in _cache_tiers(cache_name, stats()):
+                lookups.append(({"cache": tier, "result": "hit"}, tier_stats["hits"]))
+                lookups.append(({"cache": tier, "result": "miss"}, tier_stats["misses"]))
+                if "evictions" in tier_stats:
+                    evictions.append(({"cache": tier}, tier_stats["evictions"]))
+                if "entries" in tier_stats:
+                    entries.append(({"cache": tier}, tier_stats["entries"]))
+                if "bytes" in tier_stats:
+                    size.append(({"cache": tier}, tier_stats["bytes"]))
+        return [
+            ("polysignai_cache_lookups_total", "counter", "Cache lookups by result", lookups),
+            ("polysignai_cache_evictions_total", "counter", "Entries evicted to stay within bounds", evictions),
+            ("polysignai_cache_entries", "gauge", "Entries in the cache", entries),
+            ("polysignai_cache_bytes", "gauge", "Size of the cache", size),
+        ]
+
+    return collect
+
+
+async def serve_metrics(host: str, port: int, registry: Registry = REGISTRY):
+    """Serves registry on http://host:port/metrics, for Prometheus to scrape."""
+    # Not at the top: Whisper worker processes import this module too, and don't serve anything
+    from webhook import serve_http
+
+    async def handle(method: str, path: str, headers: dict, body: bytes):
+        if path.split("?")[0] != "/metrics":
+            return 404, b""
+        return 200, registry.render().encode()
+
+    return await serve_http(handle, host, port, content_type=CONTENT_TYPE)
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class _Budget:
+    """Token bucket: `rate` calls per second on average, `burst` of them at once."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "blocked_until", "turns")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        # Set by Telegram's flood control, whatever the tokens left
+        self.blocked_until = 0.0
+        # Calls wait for their turn in order, messages to a chat are sent in the order they are made
+        self.turns = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a call fits in the budget, 0 if one does now."""
+        self._refill(now)
+        return max(self.blocked_until - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0)
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.blocked_until and not self.turns.locked()
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class Outbox(BaseRateLimiter):
+    """
+    Every Bot API call of the application goes through here: calls to a chat (sending, editing,
+    deleting messages...) wait for room in a global budget and in the chat's own one, private
+    chats and groups having different ones as Telegram limits them differently. Calls without a
+    chat, such as getFile or answerCallbackQuery, go straight through.
+
+    An edit of a message whose previous edit is still waiting for its turn replaces it, both
+    callers getting the result of a single call showing the latest text. Calls hitting Telegram's
+    flood control anyway pause their chat, or everything, for as long as Telegram asks and are
+    retried up to `max_retries` times.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int, group_rate: float, group_burst: int,
+                 max_retries: int = 2, max_chats: int = 10_000):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._global = _Budget(global_rate, global_rate, time.monotonic())
+        self._chats = {}  # chat_id -> _Budget
+        self._edits = {}  # (chat_id, message_id, inline_message_id) -> edit waiting for its turn
+        self.sent = 0
+        self.delayed = 0
+        self.merged = 0
+        self.retried = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent, "delayed": self.delayed, "merged": self.merged, "retried": self.retried,
+            "waiting_edits": len(self._edits), "chats": len(self._chats),
+        }
+
+    def _chat_budget(self, chat_id, now: float) -> _Budget:
+        budget = self._chats.get(chat_id)
+        if budget is None:
+            if len(self._chats) >= self.max_chats:
+                # Chats with their whole budget back are no different from new ones
+                self._chats = {chat: budget for chat, budget in self._chats.items() if not budget.idle(now)}
+            # Groups and channels have negative ids, or @usernames
+            if isinstance(chat_id, int) and chat_id > 0:
+                budget = _Budget(self.chat_rate, self.chat_burst, now)
+            else:
+                budget = _Budget(self.group_rate, self.group_burst, now)
+            self._chats[chat_id] = budget
+        return budget
+
+    async def _wait_turn(self, chat_id):
+        delayed = False
+        chat_budget = self._chat_budget(chat_id, time.monotonic())
+        async with chat_budget.turns:
+            while True:
+                now = time.monotonic()
+                delay = max(self._global.delay(now), chat_budget.delay(now))
+                if delay <= 0:
+                    self._global.take()
+                    chat_budget.take()
+                    break
+                delayed = True
+                await asyncio.sleep(delay)
+        if delayed:
+            self.delayed += 1
+
+    async def _call(self, callback, args, kwargs, chat_id, has_turn: bool = False):
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None and not (has_turn and attempt == 0):
+                await self._wait_turn(chat_id)
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                seconds = _retry_after_seconds(e)
+                logger.warning(f"Flood control of {'every chat' if chat_id is None else f'chat {chat_id}'}: "
+                               f"retrying in {seconds}s")
+                budget = self._global if chat_id is None else self._chat_budget(chat_id, time.monotonic())
+                budget.blocked_until = max(budget.blocked_until, time.monotonic() + seconds)
+                self.retried += 1
+                if chat_id is None:
+                    await asyncio.sleep(seconds)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if endpoint != "editMessageText":
+            return await self._call(callback, args, kwargs, chat_id)
+
+        key = (chat_id, data.get("message_id"), data.get("inline_message_id"))
+        waiting = self._edits.get(key)
+        if waiting is not None:
+            waiting["args"], waiting["kwargs"] = args, kwargs
+            self.merged += 1
+            return await asyncio.shield(waiting["result"])
+
+        result = asyncio.get_running_loop().create_future()
+        # Nobody else may be waiting for it
+        result.add_done_callback(lambda future: future.cancelled() or future.exception())
+        waiting = self._edits[key] = {"args": args, "kwargs": kwargs, "result": result}
+        try:
+            if chat_id is not None:
+                await self._wait_turn(chat_id)
+        except BaseException:
+            result.cancel()
+            raise
+        finally:
+            # From now on, new edits are for after this one
+            del self._edits[key]
+        try:
+            response = await self._call(callback, waiting["args"], waiting["kwargs"], chat_id, has_turn=True)
+        except Exception as e:
+            result.set_exception(e)
+            raise
+        except BaseException:
+            result.cancel()
+            raise
+        result.set_result(response)
+        return response
+
+
+class StatusMessage:
+    """
+    The one message telling a user which stage their translation is at. Nothing is sent for jobs
+    done within `delay`, and the message is then edited in place at most every `interval`: stages
+    over by then are skipped, only the latest one is shown.
+
+    A job either takes the message over as one of its replies, or closes it once its replies,
+    or its error message, are sent: the status is then deleted rather than left stale.
+    """
+
+    def __init__(self, message, delay: float, interval: float):
+        self.message = message  # the user's message, the status replies to it
+        self.delay = delay
+        self.interval = interval
+        self.text = None
+        self._started = time.monotonic()
+        self._reply = None
+        self._shown = None
+        self._shown_at = 0.0
+        self._sending = False
+        self._closed = False
+        self._task = None
+
+    def set(self, text: str):
+        """Shows text as soon as the delay and interval allow, in the background."""
+        if self._closed or text == self.text:
+            return
+        self.text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._show())
+
+    async def _show(self):
+        while not self._closed and self._shown != self.text:
+            if self._reply is None:
+                wait = self._started + self.delay - time.monotonic()
+            else:
+                wait = self._shown_at + self.interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            text = self.text
+            self._sending = True
+            try:
+                if self._reply is None:
+                    self._reply = await self.message.reply_text(text, reply_to_message_id=self.message.message_id)
+                else:
+                    await self._reply.edit_text(text)
+            except TelegramError as e:
+                # Only a status, the job goes on without it
+                logger.warning(f"Can't show status {text!r}: {e!r}")
+                return
+            finally:
+                self._sending = False
+            self._shown, self._shown_at = text, time.monotonic()
+
+    async def _stop(self):
+        self._closed = True
+        if self._task is not None:
+            if self._sending:
+                # Cancelling could lose a message already sent
+                await self._task
+            else:
+                self._task.cancel()
+
+    async def take(self):
+        """
+        Stops updating the status and hands over its message, for it to become a reply of
+        the job: (message, text shown), or (None, None) when it was never sent.
+        """
+        await self._stop()
+        reply, shown = self._reply, self._shown
+        self._reply = self._shown = None
+        return reply, shown
+
+    async def close(self):
+        """
+        Stops updating the status, the job is done. A status that was sent and not taken is
+        deleted, one that was never sent never will be.
+        """
+        await self._stop()
+        reply, self._reply = self._reply, None
+        if reply is None:
+            return
+        try:
+            await reply.delete()
+        except TelegramError as e:
+            logger.warning(f"Can't delete status {self._shown!r}: {e!r}")
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+
+from cache import CacheStats, LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+# Settings of a user, in the order of their prefs tuples
+COLUMNS = ("src_lang", "dst_lang", "render_profile")
+
+
+class UserPrefsStore:
+    """
+    Users' settings as (src_lang, dst_lang, render_profile) tuples of small integer ids, in an
+    SQLite database that any number of bot processes can share.
+
+    Reads go through a bounded in-memory LRU of recently active users, the database is only
+    queried on a miss. Users without a row get `defaults`: nothing is stored for them until
+    they change a setting. Database reads and writes run in a worker thread. Changes are buffered
+    and written in one transaction every `flush_interval` seconds, or as soon as `batch_size` of
+    them are pending, and at close. Failed writes stay pending and are retried with a backoff of
+    up to `max_retry_interval` seconds; a failed read gives the defaults for that message.
+
+    Updates of a given user must keep going to the same process (see webhook.UpdateRouter),
+    otherwise a process could keep serving a stale cached setting.
+    """
+
+    def __init__(self, db_path: str, defaults: tuple, cache_size: int = 100_000, flush_interval: float = 5,
+                 batch_size: int = 500, max_retry_interval: float = 60):
+        self.defaults = tuple(defaults)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retry_interval = max_retry_interval
+        # Bounded by number of users: each entry is a tuple of a few small ints
+        self.memory = LRUCache(cache_size, sizeof=lambda prefs: 1)
+        self.counters = CacheStats()
+        self.writes = 0
+        self._pending = {}  # user_id -> prefs not written yet
+        self._flush_handle = None
+        self._flush_task = None
+        self._retry_interval = None  # seconds until the next try while writes fail
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL stays consistent without an fsync per commit, a crash loses at most the last batches
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS user_prefs ("
+            "user_id INTEGER PRIMARY KEY, src_lang INTEGER NOT NULL, dst_lang INTEGER NOT NULL, "
+            "render_profile INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.commit()
+
+    def _select(self, user_id: int):
+        with self._lock:
+            return self._db.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM user_prefs WHERE user_id = ?", (user_id,)
+            ).fetchone()
+
+    async def get(self, user_id: int) -> tuple:
+        prefs = self.memory.get(user_id)
+        if prefs is not None:
+            self.counters.hits += 1
+            return prefs
+
+        self.counters.misses += 1
+        prefs = self._pending.get(user_id)
+        if prefs is None:
+            try:
+                row = await asyncio.to_thread(self._select, user_id)
+            except sqlite3.Error as e:
+                # Not cached, the next message of the user tries again
+                logger.warning(f"Can't read settings of user {user_id}: {e!r}")
+                return self.defaults
+            # Set meanwhile by another update of the user
+            prefs = self.memory.get(user_id) or self._pending.get(user_id)
+            if prefs is not None:
+                return prefs
+            prefs = self.defaults if row is None else tuple(row)
+        self.memory.put(user_id, prefs)
+        return prefs
+
+    async def set(self, user_id: int, src_lang: int = None, dst_lang: int = None, render_profile: int = None):
+        """Changes the settings of user_id that are given, the others are left as they are."""
+        current = await self.get(user_id)
+        prefs = tuple(old if new is None else new for old, new in zip(current, (src_lang, dst_lang, render_profile)))
+        if current == prefs:
+            return
+        self.memory.put(user_id, prefs)
+        self._pending[user_id] = prefs
+        if len(self._pending) >= self.batch_size and self._retry_interval is None:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+            self._start_flush()
+        elif self._flush_handle is None and (self._flush_task is None or self._flush_task.done()):
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        # A running flush schedules the next one once done
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if not self._pending:
+            return
+        written = dict(self._pending)
+        try:
+            await asyncio.to_thread(self._insert, written)
+        except sqlite3.Error as e:
+            # Kept pending and tried again later, backing off while the database stays unavailable
+            self._retry_interval = min(2 * (self._retry_interval or self.flush_interval / 2), self.max_retry_interval)
+            logger.warning(f"Can't write {len(written)} user settings, retrying in {self._retry_interval}s: {e!r}")
+        else:
+            self._retry_interval = None
+            self.writes += len(written)
+            # Settings changed again during the write are still to be written
+            for user_id, prefs in written.items():
+                if self._pending.get(user_id) == prefs:
+                    del self._pending[user_id]
+        if self._pending and self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self._retry_interval or self.flush_interval, self._start_flush
+            )
+
+    def _insert(self, pending: dict):
+        with self._lock:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO user_prefs (user_id, {', '.join(COLUMNS)}) "
+                f"VALUES (?, {', '.join('?' for _ in COLUMNS)})",
+                [(user_id, *prefs) for user_id, prefs in pending.items()]
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.counters.hits,
+            "misses": self.counters.misses,
+            "evictions": self.memory.stats.evictions,
+            "cached_users": len(self.memory),
+            "pending_writes": len(self._pending),
+            "writes": self.writes,
+        }
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        try:
+            if self._pending:
+                self._insert(self._pending)
+                self.writes += len(self._pending)
+                self._pending.clear()
+        except sqlite3.Error as e:
+            logger.warning(f"Can't write {len(self._pending)} user settings, they are lost: {e!r}")
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,76 @@
+from io import BytesIO
+
+import numpy as np
+
+import metrics
+
+
+def _same_skeleton(a, b) -> bool:
+    return [(c.name, len(c.points), c.format) for c in a.components] == [
+        (c.name, len(c.points), c.format) for c in b.components
+    ]
+
+
+def _resample(data: np.ndarray, confidence: np.ndarray, fps: float, target_fps: float):
+    """
+    data and confidence of frames at fps, linearly interpolated to frames at target_fps.
+    Points hidden in either neighbouring frame stay hidden, as during transitions.
+    """
+    if fps == target_fps or len(data) < 2:
+        return data, confidence
+    times = np.arange(round((len(data) - 1) * target_fps / fps) + 1) * (fps / target_fps)
+    before = np.minimum(np.floor(times).astype(int), len(data) - 1)
+    after = np.minimum(before + 1, len(data) - 1)
+    weights = (times - before).astype(np.float32)[:, None, None, None]
+    data = data[before] * (1 - weights) + data[after] * weights
+    confidence = np.minimum(confidence[before], confidence[after])
+    return data, confidence
+
+
+def concatenate_poses(poses: list, transition_seconds: float) -> bytes:
+    """
+    One pose made of the given pose bytes played one after the other, at the frame rate of the
+    first one (the others are resampled to it), with `transition_seconds` of interpolation from
+    the last frame of each pose to the first frame of the next. Points missing on either side
+    stay hidden during a transition.
+    All poses must share the same skeleton, as sign.mt poses of a given language do.
+    """
+    import numpy.ma as ma
+    from pose_format import Pose
+    from pose_format.numpy import NumPyPoseBody
+
+    with metrics.stage("concatenate"):
+        poses = [Pose.read(pose_bytes) for pose_bytes in poses]
+        header = poses[0].header
+        for pose in poses[1:]:
+            if not _same_skeleton(header, pose.header):
+                raise ValueError("Can't concatenate poses of different skeletons")
+
+        fps = poses[0].body.fps
+        transition_frames = round(fps * transition_seconds)
+        # Weights of the next pose in each transition frame, both ends excluded
+        weights = np.linspace(0, 1, transition_frames + 2, dtype=np.float32)[1:-1, None, None, None]
+
+        data, confidence = [], []
+        for pose in poses:
+            # A single signer: only the first person of each pose
+            pose_data = np.asarray(pose.body.data.filled(0), dtype=np.float32)[:, :1]
+            pose_confidence = np.asarray(pose.body.confidence, dtype=np.float32)[:, :1]
+            if not len(pose_data):
+                continue
+            pose_data, pose_confidence = _resample(pose_data, pose_confidence, pose.body.fps, fps)
+            if data and transition_frames:
+                data.append(data[-1][-1:] * (1 - weights) + pose_data[:1] * weights)
+                transition_confidence = np.minimum(confidence[-1][-1:], pose_confidence[:1])
+                confidence.append(np.repeat(transition_confidence, transition_frames, axis=0))
+            data.append(pose_data)
+            confidence.append(pose_confidence)
+
+        data = np.concatenate(data)
+        confidence = np.concatenate(confidence)
+        mask = np.repeat((confidence == 0)[..., None], data.shape[-1], axis=-1)
+        body = NumPyPoseBody(fps=fps, data=ma.masked_array(data, mask=mask), confidence=confidence)
+
+        buffer = BytesIO()
+        Pose(header, body).write(buffer)
+        return buffer.getvalue()
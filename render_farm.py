@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Encoder threads of the current worker process, set once by _init_worker
+_worker_threads = 0
+
+
+def _init_worker(threads: int):
+    global _worker_threads
+    # Loaded once per worker rather than on its first render
+    import pose_format
+    import renderer
+
+    _worker_threads = threads
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _render(pose_bytes: bytes, settings: dict, start: int = 0, end: int = None) -> bytes:
+    from pose_format import Pose
+    from renderer import render_video
+
+    output = BytesIO()
+    render_video(Pose.read(pose_bytes), output, start=start, end=end, threads=_worker_threads, **settings)
+    return output.getvalue()
+
+
+def _frame_count(pose_bytes: bytes, max_fps: float = None) -> int:
+    from pose_format import Pose
+    from renderer import frame_step
+
+    pose = Pose.read(pose_bytes)
+    return math.ceil(len(pose.body.data) / frame_step(pose.body.fps, max_fps))
+
+
+class RenderFarm:
+    """
+    Renders sign language videos in a pool of worker processes, so that drawing and encoding
+    use every core and never block the bot's event loop. Videos of at least 2 *
+    `segment_frames` frames are split into up to `workers` frame ranges drawn and encoded in
+    parallel, then joined into one MP4 without re-encoding. Each worker's encoder gets an
+    equal share of the cores, for parallel renders not to fight over them.
+    """
+
+    def __init__(self, workers: int, segment_frames: int):
+        self.workers = workers
+        self.segment_frames = segment_frames
+        self._executor = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        if self._executor is not None:
+            return
+        logger.info(f"Starting {self.workers} render worker(s)")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            # Forking the bot's process with its threads running is not safe
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(max(1, (os.cpu_count() or 1) // self.workers),),
+        )
+
+    async def warm_up(self):
+        """Spawns the workers and lets them import the renderer now rather than on the first videos."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)))
+        except BrokenProcessPool:
+            self.shutdown()
+            raise
+
+    def segments(self, frame_count: int) -> list:
+        """[start, end) frame ranges a video of frame_count frames is rendered in, at least segment_frames each."""
+        count = max(1, min(self.workers, frame_count // self.segment_frames))
+        bounds = np.linspace(0, frame_count, count + 1).round().astype(int).tolist()
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    async def render(self, pose_bytes: bytes, output, settings: dict):
+        """Renders the pose as an MP4 to output, a writable file object, with settings of renderer.render_video."""
+        from renderer import concatenate_videos
+
+        self.start()
+        self._pending += 1
+        loop = asyncio.get_running_loop()
+        try:
+            frame_count = await asyncio.to_thread(_frame_count, pose_bytes, settings.get("max_fps"))
+            ranges = self.segments(frame_count)
+            if len(ranges) == 1:
+                video = await loop.run_in_executor(self._executor, _render, pose_bytes, settings)
+                await asyncio.to_thread(output.write, video)
+                return
+
+            # Only the joined video gets its index moved first
+            segment_settings = {**settings, "faststart": False}
+            segments = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, _render, pose_bytes, segment_settings, start, end)
+                for start, end in ranges
+            ))
+            await asyncio.to_thread(concatenate_videos, segments, output, settings.get("faststart", False))
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a huge pose): start a fresh pool next time
+            self.shutdown()
+            raise
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
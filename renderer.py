@@ -0,0 +1,339 @@
+import math
+import struct
+from fractions import Fraction
+from io import BytesIO
+
+import av
+import numpy as np
+
+
+def _brush(radius: int, row_stride: int) -> np.ndarray:
+    """Offsets, in a flattened frame with rows of row_stride pixels, of the pixels of a filled disc."""
+    span = np.arange(-radius, radius + 1)
+    dy, dx = np.meshgrid(span, span, indexing="ij")
+    inside = dy ** 2 + dx ** 2 <= radius ** 2 + radius  # slightly rounder than a strict circle
+    return dy[inside] * row_stride + dx[inside]
+
+
+class SkeletonLayout:
+    """
+    Everything about how a pose is drawn that only depends on its header: limb endpoints
+    as indexes in the flattened point list, per point colors and brush shapes.
+    """
+
+    def __init__(self, header, thickness: int = None, scale: float = 1.0):
+        self.width = round(header.dimensions.width * scale)
+        self.height = round(header.dimensions.height * scale)
+        # H.264 with 4:2:0 chroma needs even dimensions, the extra row/column stays background
+        self.frame_width = self.width + self.width % 2
+        self.frame_height = self.height + self.height % 2
+
+        if thickness is None:
+            # Same heuristic as pose_format's PoseVisualizer
+            thickness = round(math.sqrt(self.width * self.height) / 150)
+        self.thickness = max(1, thickness)
+        self.line_radius = self.thickness // 2
+        self.point_radius = math.ceil(self.thickness / 2)
+        self.line_brush = _brush(self.line_radius, self.frame_width)
+        self.point_brush = _brush(self.point_radius, self.frame_width)
+
+        limbs, colors, offset = [], [], 0
+        for component in header.components:
+            palette = np.array(component.colors, dtype=np.float32).reshape(-1, 3)
+            colors.append(palette[np.arange(len(component.points)) % len(palette)])
+            if len(component.limbs):
+                limbs.append(np.array(component.limbs, dtype=np.int64).reshape(-1, 2) + offset)
+            offset += len(component.points)
+
+        self.num_points = offset
+        self.limbs = np.concatenate(limbs) if limbs else np.zeros((0, 2), dtype=np.int64)
+        self.colors = np.concatenate(colors) if colors else np.zeros((0, 3), dtype=np.float32)
+
+
+def _layout_signature(header, thickness, scale):
+    return (
+        header.dimensions.width, header.dimensions.height, thickness, scale,
+        tuple((c.name, len(c.points), len(c.limbs), len(c.colors)) for c in header.components),
+    )
+
+
+_layouts = {}
+
+
+def get_layout(header, thickness: int = None, scale: float = 1.0) -> SkeletonLayout:
+    # sign.mt always answers with the same few headers, don't recompute their layout for every pose
+    signature = _layout_signature(header, thickness, scale)
+    layout = _layouts.get(signature)
+    if layout is None:
+        layout = _layouts[signature] = SkeletonLayout(header, thickness, scale)
+    return layout
+
+
+def _pack_rgba(colors: np.ndarray) -> np.ndarray:
+    rgba = np.full((len(colors), 4), 255, dtype=np.uint8)
+    rgba[:, :3] = colors
+    return rgba.view(np.uint32).ravel()
+
+
+class PoseRenderer:
+    """
+    Faster replacement for pose_format's PoseVisualizer.draw. Instead of one OpenCV call per
+    point and per limb, each frame is drawn with a few whole-array NumPy operations: every
+    limb is sampled about once per brush radius, and a disc shaped brush is stamped at all
+    samples at once, straight into a flat frame buffer reused for the whole video.
+
+    Limbs are painted far to near (painter's algorithm), joints are painted on top of limbs.
+    Unlike PoseVisualizer's, lines and joints are not anti-aliased: their edges are jagged,
+    which shows most at the small sizes of the lower render profiles.
+
+    Drawing is about x2 faster than PoseVisualizer's, but encoding takes most of a video's
+    time: in benchmarks/bench_render.py (100 frames at 1000x1000, one core), a whole video is
+    only x1.07 faster with the same encoder settings. It is x1.47 faster than before overall
+    because libx264's "veryfast" preset encodes twice as fast as the "fast" one that
+    PoseVisualizer.save_video used, with about the same file size at the same crf.
+
+    The canvas can be scaled down from the pose's dimensions by `scale`, and frames dropped to
+    stay within `max_fps`: only every frame_step-th frame is drawn, and played at fps.
+    """
+
+    def __init__(self, pose, background_color=(0, 0, 0), thickness: int = None, scale: float = 1.0,
+                 max_fps: float = None):
+        self.pose = pose
+        self.scale = scale
+        self.layout = get_layout(pose.header, thickness, scale)
+        self.background_color = np.array(background_color, dtype=np.float32)
+        self.background = _pack_rgba(self.background_color[None])[0]
+        self.frame_step = frame_step(pose.body.fps, max_fps)
+        self.fps = float(pose.body.fps) / self.frame_step
+        self.frame_count = math.ceil(len(pose.body.data) / self.frame_step)
+        self.width = self.layout.frame_width
+        self.height = self.layout.frame_height
+        # One packed RGBA uint32 per pixel: painting a pixel is a single 4 bytes store
+        self._pixels = np.empty(self.height * self.width, dtype=np.uint32)
+        self._frame = self._pixels.view(np.uint8).reshape(self.height, self.width, 4)
+
+    def _shapes(self, frame_data: np.ndarray, frame_confidence: np.ndarray):
+        """Limb segments and points of every person in the frame, with their color and depth."""
+        layout = self.layout
+        segments, segment_colors, segment_z = [], [], []
+        points, point_colors, point_z = [], [], []
+
+        for person, confidence in zip(frame_data, frame_confidence):
+            person = np.nan_to_num(person)
+            # Low confidence points fade into the background, as PoseVisualizer does
+            opacity = np.clip(confidence, 0, 1)[:, None]
+            colors = layout.colors * opacity + self.background_color * (1 - opacity)
+            visible = confidence > 0
+            xy = person[:, :2] * self.scale if self.scale != 1 else person[:, :2]
+            z = person[:, 2] if person.shape[1] > 2 else np.zeros(len(person), dtype=person.dtype)
+
+            limbs = layout.limbs[visible[layout.limbs[:, 0]] & visible[layout.limbs[:, 1]]]
+            segments.append(np.stack([xy[limbs[:, 0]], xy[limbs[:, 1]]], axis=1))
+            segment_colors.append((colors[limbs[:, 0]] + colors[limbs[:, 1]]) / 2)
+            segment_z.append((z[limbs[:, 0]] + z[limbs[:, 1]]) / 2)
+
+            points.append(xy[visible])
+            point_colors.append(colors[visible])
+            point_z.append(z[visible])
+
+        return (np.concatenate(segments), np.concatenate(segment_colors), np.concatenate(segment_z),
+                np.concatenate(points), np.concatenate(point_colors), np.concatenate(point_z))
+
+    def _stamp(self, centers: np.ndarray, colors: np.ndarray, brush: np.ndarray, radius: int):
+        """Paints brush, centered at each (x, y) of centers, in order: later stamps cover earlier ones."""
+        centers = np.rint(centers).astype(np.int64)
+        on_canvas = ((centers[:, 0] >= -radius) & (centers[:, 0] < self.width + radius)
+                     & (centers[:, 1] >= -radius) & (centers[:, 1] < self.height + radius))
+        # Nudging centers off the borders keeps every brush pixel inside the frame without masking
+        xs = np.clip(centers[on_canvas, 0], radius, self.width - radius - 1)
+        ys = np.clip(centers[on_canvas, 1], radius, self.height - radius - 1)
+        pixels = (ys * self.width + xs)[:, None] + brush[None]
+        self._pixels[pixels.ravel()] = np.repeat(colors[on_canvas], len(brush))
+
+    def _draw_frame(self, frame_data: np.ndarray, frame_confidence: np.ndarray):
+        layout = self.layout
+        segments, segment_colors, segment_z, points, point_colors, point_z = self._shapes(frame_data, frame_confidence)
+        self._pixels.fill(self.background)
+
+        # Painter's algorithm: far shapes (larger z) first
+        order = np.argsort(-segment_z, kind="stable")
+        start, end = segments[order, 0], segments[order, 1]
+        step = max(layout.line_radius, 1)
+        samples = np.ceil(np.abs(end - start).max(axis=1, initial=0) / step).astype(np.int64) + 1
+        segment_of_sample = np.repeat(np.arange(len(order)), samples)
+        first_sample = np.repeat(np.cumsum(samples) - samples, samples)
+        t = (np.arange(len(segment_of_sample)) - first_sample) / np.maximum(samples[segment_of_sample] - 1, 1)
+        centers = start[segment_of_sample] + t[:, None] * (end - start)[segment_of_sample]
+        self._stamp(centers, _pack_rgba(segment_colors[order])[segment_of_sample], layout.line_brush, layout.line_radius)
+
+        order = np.argsort(-point_z, kind="stable")
+        self._stamp(points[order], _pack_rgba(point_colors[order]), layout.point_brush, layout.point_radius)
+
+    def frames(self, start: int = 0, end: int = None):
+        """
+        Yields the RGBA frames of the video one at a time. The same buffer is reused for every
+        frame, consumers must be done with a frame before asking for the next one. start and
+        end are positions among the frames of the video, i.e. after dropping frames for max_fps.
+        """
+        data = self.pose.body.data
+        confidence = self.pose.body.confidence
+        end = self.frame_count if end is None else min(end, self.frame_count)
+        for frame_index in range(start * self.frame_step, end * self.frame_step, self.frame_step):
+            # Masked values are never drawn anyway, filling them avoids slow masked array math
+            self._draw_frame(np.ma.getdata(data[frame_index]), np.ma.filled(confidence[frame_index], 0))
+            yield self._frame
+
+    def save_video(self, output, crf: int = 23, preset: str = "veryfast", faststart: bool = False,
+                   start: int = 0, end: int = None, threads: int = 0):
+        """Encodes the video, or its frames [start, end), as H.264 MP4 to output, a file path or a writable file object."""
+        encode_frames(
+            self.frames(start, end), output, self.fps, self.width, self.height, crf=crf, preset=preset,
+            faststart=faststart, threads=threads
+        )
+
+
+def render_video(pose, output, background_color=(0, 0, 0), max_side: int = None, max_fps: float = None,
+                 thickness: int = None, crf: int = 23, preset: str = "veryfast", faststart: bool = False,
+                 start: int = 0, end: int = None, threads: int = 0):
+    """
+    Renders pose as an MP4 to output with the settings of a render profile: the canvas is
+    scaled down for its longest side to be at most max_side, and frames are dropped for
+    their rate to be at most max_fps. None keeps the pose's own.
+
+    Only frames [start, end) of the video are rendered when given, see PoseRenderer.frames,
+    for segments rendered apart to be joined with concatenate_videos.
+    """
+    longest_side = max(pose.header.dimensions.width, pose.header.dimensions.height)
+    scale = min(1.0, max_side / longest_side) if max_side else 1.0
+    renderer = PoseRenderer(pose, background_color=background_color, thickness=thickness, scale=scale, max_fps=max_fps)
+    renderer.save_video(output, crf=crf, preset=preset, faststart=faststart, start=start, end=end, threads=threads)
+
+
+def frame_step(native_fps: float, max_fps: float = None) -> int:
+    """Every how many frames of a pose one is drawn, for the video to stay within max_fps."""
+    return max(1, math.ceil(float(native_fps) / max_fps - 1e-6)) if max_fps else 1
+
+
+def encode_frames(frames, output, fps: float, width: int, height: int, crf: int = 23, preset: str = "veryfast",
+                  pixel_format: str = "rgba", faststart: bool = False, threads: int = 0):
+    """
+    Streams frames into an H.264 encoder as they are produced, memory use does not
+    depend on the number of frames. With faststart, the index of the MP4 is moved to its
+    start once done, for players to start playing before the whole video is downloaded.
+    threads caps the encoder's threads, 0 lets it use every core.
+    """
+    start = None if isinstance(output, str) else output.tell()
+    with av.open(output, mode="w", format="mp4") as container:
+        stream = container.add_stream("libx264", rate=Fraction(fps).limit_denominator(1001))
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = "yuv420p"
+        stream.options = {"crf": str(crf), "preset": preset}
+        if threads:
+            stream.options["threads"] = str(threads)
+
+        for frame in frames:
+            for packet in stream.encode(av.VideoFrame.from_ndarray(frame, format=pixel_format)):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+    if faststart:
+        _faststart(output, start)
+
+
+def concatenate_videos(segments: list, output, faststart: bool = False):
+    """
+    Joins MP4 segments rendered with the same settings, e.g. consecutive frame ranges of a
+    pose, into one MP4 at output. Packets are copied as they are, nothing is re-encoded: every
+    segment starts with a keyframe of its own and is shifted to play right after the previous one.
+    """
+    start = None if isinstance(output, str) else output.tell()
+    with av.open(output, mode="w", format="mp4") as container:
+        stream = None
+        offset = 0
+        for segment in segments:
+            with av.open(BytesIO(segment) if isinstance(segment, bytes) else segment) as source:
+                source_stream = source.streams.video[0]
+                if stream is None:
+                    stream = container.add_stream_from_template(source_stream)
+                for packet in source.demux(source_stream):
+                    # The demuxer ends with an empty packet flushing the stream
+                    if packet.dts is None:
+                        continue
+                    packet.pts += offset
+                    packet.dts += offset
+                    packet.stream = stream
+                    container.mux(packet)
+                offset += source_stream.duration
+
+    if faststart:
+        _faststart(output, start)
+
+
+def _faststart(output, start):
+    if start is None:
+        with open(output, "r+b") as f:
+            move_index_to_front(f, 0)
+    else:
+        move_index_to_front(output, start)
+
+
+# Atoms holding other atoms on the way from moov to the chunk offset tables
+_CONTAINER_ATOMS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+def _atoms(data, start: int, end: int):
+    """(type, offset, header size, size) of the atoms found one after the other in data[start:end]."""
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            size, = struct.unpack_from(">Q", data, offset + 8)
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise ValueError(f"Malformed MP4 atom {kind!r} at {offset}")
+        yield kind, offset, header, size
+        offset += size
+
+
+def _shift_chunk_offsets(moov: bytearray, start: int, end: int, shift: int):
+    for kind, offset, header, size in _atoms(moov, start, end):
+        if kind in _CONTAINER_ATOMS:
+            _shift_chunk_offsets(moov, offset + header, offset + size, shift)
+        elif kind in (b"stco", b"co64"):
+            # Version and flags, then the number of entries, then the entries
+            count, = struct.unpack_from(">I", moov, offset + header + 4)
+            dtype = ">u4" if kind == b"stco" else ">u8"
+            table = offset + header + 8
+            offsets = np.frombuffer(moov, dtype=dtype, count=count, offset=table).astype(np.uint64) + shift
+            if kind == b"stco" and count and offsets.max() > 0xFFFFFFFF:
+                raise ValueError("Chunk offsets outgrow 32 bits once the index is moved")
+            moov[table:table + offsets.nbytes // (2 if kind == b"stco" else 1)] = offsets.astype(dtype).tobytes()
+
+
+def move_index_to_front(media, start: int = 0):
+    """
+    Rewrites the MP4 in media, a seekable file object, from start, with its moov atom before its
+    media data, like ffmpeg's -movflags +faststart. Same bytes count, only their order changes.
+    """
+    media.seek(start)
+    data = media.read()
+    atoms = list(_atoms(data, 0, len(data)))
+    kinds = [kind for kind, *_ in atoms]
+    if b"moov" not in kinds or b"mdat" not in kinds or kinds.index(b"moov") < kinds.index(b"mdat"):
+        return
+
+    _, moov_offset, _, moov_size = atoms[kinds.index(b"moov")]
+    mdat_offset = atoms[kinds.index(b"mdat")][1]
+    moov = bytearray(data[moov_offset:moov_offset + moov_size])
+    # Everything from mdat on ends up moov_size bytes further
+    _shift_chunk_offsets(moov, 8, len(moov), moov_size)
+    media.seek(start)
+    media.write(data[:mdat_offset])
+    media.write(moov)
+    media.write(data[mdat_offset:moov_offset])
+    media.write(data[moov_offset + moov_size:])
@@ -0,0 +1,189 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(sorted_values: list, percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile))]
+
+
+class SchedulerFull(Exception):
+    """Raised when a job can't even wait for a slot: its owner's queue or the global one is full."""
+
+    def __init__(self, owner_queue_full: bool):
+        super().__init__("owner queue full" if owner_queue_full else "queue full")
+        self.owner_queue_full = owner_queue_full
+
+
+class _Job:
+    __slots__ = ("owner", "start_tag", "finish_tag", "seq", "enqueued_at", "future")
+
+    def __init__(self, owner, start_tag: float, finish_tag: float, seq: int, future: asyncio.Future):
+        self.owner = owner
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.future = future
+
+
+class FairScheduler:
+    """
+    Admission control for expensive jobs (translations, transcriptions, renders).
+
+    At most `max_running` jobs run at once, and at most `max_running_per_owner` of them for the
+    same owner (a user). Jobs beyond that wait, and the next one to run is picked with weighted
+    fair queuing: each owner gets a share of the slots proportional to its weight, however many
+    jobs it has queued, so one user sending a burst can't starve the others.
+
+    Jobs come with an estimate of their cost, and a job's virtual finish tag grows with it: among
+    the owners waiting, the one with the shortest next job usually goes first. Waiting lowers a
+    job's tag by `aging` per second, so long jobs are delayed by short ones but never starved.
+
+    At most `max_queued` jobs wait overall and `max_queued_per_owner` per owner, further jobs
+    are rejected right away with SchedulerFull rather than piling up.
+    """
+
+    def __init__(self, max_running: int, max_running_per_owner: int, max_queued: int, max_queued_per_owner: int,
+                 aging: float = 0.0, wait_samples: int = 1000):
+        self.max_running = max_running
+        self.max_running_per_owner = max_running_per_owner
+        self.max_queued = max_queued
+        self.max_queued_per_owner = max_queued_per_owner
+        self.aging = aging
+
+        self._queues = {}  # owner -> deque of waiting _Job, in finish tag order
+        self._running = {}  # owner -> number of running jobs
+        self._last_finish_tag = {}  # owner -> finish tag of its last job
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._queued = 0
+        self._running_total = 0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_times = deque(maxlen=wait_samples)
+        self.max_wait = 0.0
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        return self._running_total
+
+    @asynccontextmanager
+    async def slot(self, owner, weight: float = 1.0, cost: float = 1.0):
+        """Waits for owner's turn to run a job costing `cost`, the slot is held until the block exits."""
+        await self._acquire(owner, weight, cost)
+        try:
+            yield
+        finally:
+            self._release(owner)
+
+    async def _acquire(self, owner, weight: float, cost: float):
+        queue = self._queues.get(owner)
+        if queue is not None and len(queue) >= self.max_queued_per_owner:
+            self.rejected += 1
+            raise SchedulerFull(owner_queue_full=True)
+        if self._queued >= self.max_queued and not self._can_run_now(owner):
+            self.rejected += 1
+            raise SchedulerFull(owner_queue_full=False)
+
+        start_tag = max(self._virtual_time, self._last_finish_tag.get(owner, 0.0))
+        finish_tag = start_tag + cost / weight
+        self._last_finish_tag[owner] = finish_tag
+        job = _Job(owner, start_tag, finish_tag, next(self._seq), asyncio.get_running_loop().create_future())
+        self._queues.setdefault(owner, deque()).append(job)
+        self._queued += 1
+        self.admitted += 1
+        self._dispatch()
+
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job.future.done() and not job.future.cancelled():
+                # Got the slot right as the wait was cancelled, give it back
+                self._release(owner)
+            else:
+                self._remove(job)
+            raise
+
+    def _can_run_now(self, owner) -> bool:
+        return (self._running_total < self.max_running
+                and self._running.get(owner, 0) < self.max_running_per_owner
+                and not self._queues.get(owner))
+
+    def _remove(self, job: _Job):
+        queue = self._queues.get(job.owner)
+        if queue is not None and job in queue:
+            queue.remove(job)
+            self._queued -= 1
+            if not queue:
+                del self._queues[job.owner]
+        self._forget_idle(job.owner)
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._running_total < self.max_running:
+            job, job_priority = None, None
+            for owner, queue in self._queues.items():
+                if self._running.get(owner, 0) >= self.max_running_per_owner:
+                    continue
+                head = queue[0]
+                priority = (head.finish_tag - self.aging * (now - head.enqueued_at), head.seq)
+                if job is None or priority < job_priority:
+                    job, job_priority = head, priority
+            if job is None:
+                return
+
+            queue = self._queues[job.owner]
+            queue.popleft()
+            if not queue:
+                del self._queues[job.owner]
+            self._queued -= 1
+            self._running[job.owner] = self._running.get(job.owner, 0) + 1
+            self._running_total += 1
+            self._virtual_time = max(self._virtual_time, job.start_tag)
+
+            wait = now - job.enqueued_at
+            self.wait_times.append(wait)
+            self.max_wait = max(self.max_wait, wait)
+            job.future.set_result(None)
+
+    def _release(self, owner):
+        self._running_total -= 1
+        self._running[owner] -= 1
+        if not self._running[owner]:
+            del self._running[owner]
+        self._forget_idle(owner)
+        self._dispatch()
+
+    def _forget_idle(self, owner):
+        # An owner with nothing queued nor running starts over at the current virtual time,
+        # as in WFQ for flows going idle; this also keeps the table as small as the active owners
+        if owner not in self._queues and owner not in self._running:
+            self._last_finish_tag.pop(owner, None)
+
+    def stats(self) -> dict:
+        wait_times = sorted(self.wait_times)
+        return {
+            "running": self._running_total,
+            "queued": self._queued,
+            "owners_queued": len(self._queues),
+            "owners_running": len(self._running),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_p50": round(_percentile(wait_times, 0.5), 3),
+            "wait_p95": round(_percentile(wait_times, 0.95), 3),
+            "wait_max": round(self.max_wait, 3),
+        }
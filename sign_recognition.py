@@ -0,0 +1,430 @@
+import abc
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Motion between frames is measured on grayscale thumbnails of this size
+THUMBNAIL_SIDE = 32
+# Videos and templates are compared once resampled to this many frames
+TEMPLATE_FRAMES = 32
+TEMPLATES_INDEX = "templates.json"
+# Positions of the shoulders, elbows and wrists among MediaPipe's pose landmarks, left first
+ARM_POINTS = (11, 12, 13, 14, 15, 16)
+HAND_POINTS = 21
+
+# Pose extractor and recognizer owned by the current worker process, created once by _init_worker
+_worker_extractor = None
+_worker_recognizer = None
+_worker_sampling = None
+
+
+class RecognitionQueueFull(Exception):
+    """Raised when every worker is busy and the waiting queue is at capacity."""
+
+
+class PoseExtractor(abc.ABC):
+    """Turns video frames into the points of a skeleton. Implementations must be picklable by name."""
+
+    @abc.abstractmethod
+    def header(self, width: int, height: int):
+        """pose_format.PoseHeader of the poses extracted from width x height frames."""
+
+    @abc.abstractmethod
+    def extract(self, frame: np.ndarray) -> (np.ndarray, np.ndarray):
+        """(points, 3) coordinates in pixels and (points,) confidences of an RGB frame."""
+
+    def reset(self):
+        """Called before the first frame of every video."""
+
+
+class HolisticPoseExtractor(PoseExtractor):
+    """MediaPipe Holistic, the same skeleton sign.mt poses are made of."""
+
+    def __init__(self, model_complexity: int = 1):
+        import mediapipe as mp
+
+        # Tracking across frames rather than detecting on every one, reset between videos
+        self._holistic = mp.solutions.holistic.Holistic(static_image_mode=False, model_complexity=model_complexity)
+
+    def header(self, width: int, height: int):
+        from pose_format.pose_header import PoseHeader, PoseHeaderDimensions
+        from pose_format.utils.holistic import holistic_components
+
+        return PoseHeader(
+            version=0.2, dimensions=PoseHeaderDimensions(width=width, height=height, depth=1000),
+            components=holistic_components("XYZC"),
+        )
+
+    def extract(self, frame: np.ndarray) -> (np.ndarray, np.ndarray):
+        from pose_format.utils.holistic import FACE_POINTS_NUM, body_points, component_points
+
+        height, width = frame.shape[:2]
+        results = self._holistic.process(frame)
+        parts = [
+            body_points(results.pose_landmarks, width, height, 33),
+            component_points(results.face_landmarks, width, height, FACE_POINTS_NUM(0)),
+            component_points(results.left_hand_landmarks, width, height, 21),
+            component_points(results.right_hand_landmarks, width, height, 21),
+            body_points(results.pose_world_landmarks, width, height, 33),
+        ]
+        return np.concatenate([data for data, _ in parts]), np.concatenate([conf for _, conf in parts])
+
+    def reset(self):
+        self._holistic.reset()
+
+
+class SignRecognizer(abc.ABC):
+    """Turns the pose of a signed video into spoken language text."""
+
+    @abc.abstractmethod
+    def recognize(self, pose, signed: str):
+        """{"text", "spoken", "distance"} of what is signed in pose, in sign language `signed`; None if unknown."""
+
+
+def _point_indexes(header) -> np.ndarray:
+    """Indexes of the shoulders, elbows and wrists followed by both hands, in the flattened points."""
+    offsets, offset = {}, 0
+    for component in header.components:
+        offsets[component.name] = offset
+        offset += len(component.points)
+    indexes = [offsets["POSE_LANDMARKS"] + i for i in ARM_POINTS]
+    for hand in ("LEFT_HAND_LANDMARKS", "RIGHT_HAND_LANDMARKS"):
+        indexes.extend(range(offsets[hand], offsets[hand] + HAND_POINTS))
+    return np.array(indexes)
+
+
+def pose_features(pose) -> np.ndarray:
+    """
+    (TEMPLATE_FRAMES, features) description of the arms and hands of pose, in shoulder
+    widths from the middle of the shoulders, None when no frame has both shoulders in it.
+    """
+    indexes = _point_indexes(pose.header)
+    data = np.asarray(pose.body.data.filled(0))[:, 0, indexes, :2]
+    confidence = np.asarray(pose.body.confidence)[:, 0, indexes]
+
+    # Frames where the body was lost can't be normalized
+    visible = (confidence[:, 0] > 0) & (confidence[:, 1] > 0)
+    if not visible.any():
+        return None
+    data, confidence = data[visible], confidence[visible]
+
+    center = (data[:, 0] + data[:, 1]) / 2
+    width = np.linalg.norm(data[:, 0] - data[:, 1], axis=1)
+    width[width == 0] = 1
+    normalized = (data - center[:, None]) / width[:, None, None]
+    # Hands that went missing count as resting at the shoulders' middle
+    normalized[confidence == 0] = 0
+
+    resampled = np.linspace(0, len(normalized) - 1, TEMPLATE_FRAMES).round().astype(int)
+    return normalized[resampled].reshape(TEMPLATE_FRAMES, -1).astype(np.float32)
+
+
+def dtw_distance(a: np.ndarray, b: np.ndarray) -> float:
+    """Dynamic time warping distance between two feature sequences, per step of the warping path."""
+    cost = np.linalg.norm(a[:, None] - b[None], axis=2)
+    total = np.full((len(a) + 1, len(b) + 1), np.inf)
+    total[0, 0] = 0
+    steps = np.zeros_like(total)
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            previous = min((total[i - 1, j - 1], i - 1, j - 1), (total[i - 1, j], i - 1, j), (total[i, j - 1], i, j - 1))
+            total[i, j] = cost[i - 1, j - 1] + previous[0]
+            steps[i, j] = steps[previous[1], previous[2]] + 1
+    return float(total[-1, -1] / steps[-1, -1])
+
+
+class TemplateRecognizer(SignRecognizer):
+    """
+    Reference recognizer: the closest, by dynamic time warping of the arms and hands, of a
+    set of labelled template poses, such as the sign.mt poses of common phrases saved by
+    /warmup. It knows nothing but its templates, good enough to exercise the pipeline.
+    """
+
+    def __init__(self, templates_dir: str, max_distance: float = 0.5):
+        from pose_format import Pose
+
+        self.max_distance = max_distance
+        self.templates = {}  # signed language -> [(features, text, spoken)]
+        for entry in load_template_index(templates_dir):
+            with open(os.path.join(templates_dir, entry["file"]), "rb") as f:
+                features = pose_features(Pose.read(f.read()))
+            if features is not None:
+                self.templates.setdefault(entry["signed"], []).append((features, entry["text"], entry["spoken"]))
+
+    def recognize(self, pose, signed: str):
+        features = pose_features(pose)
+        if features is None or not self.templates.get(signed):
+            return None
+        distance, text, spoken = min(
+            ((dtw_distance(features, template), text, spoken) for template, text, spoken in self.templates[signed]),
+            key=lambda match: match[0],
+        )
+        # Root mean square over the points rather than summed over them
+        distance /= np.sqrt(features.shape[1] / 2)
+        if distance > self.max_distance:
+            return None
+        return {"text": text, "spoken": spoken, "distance": distance}
+
+
+def load_template_index(templates_dir: str) -> list:
+    try:
+        with open(os.path.join(templates_dir, TEMPLATES_INDEX)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def save_templates(templates_dir: str, templates: list):
+    """Adds (file name, pose bytes, text, spoken, signed) templates to templates_dir for TemplateRecognizer."""
+    os.makedirs(templates_dir, exist_ok=True)
+    index = {entry["file"]: entry for entry in load_template_index(templates_dir)}
+    for file_name, pose_bytes, text, spoken, signed in templates:
+        with open(os.path.join(templates_dir, file_name), "wb") as f:
+            f.write(pose_bytes)
+        index[file_name] = {"file": file_name, "text": text, "spoken": spoken, "signed": signed}
+    # Replaced at once, workers starting meanwhile read either index whole
+    index_path = os.path.join(templates_dir, TEMPLATES_INDEX)
+    with open(f"{index_path}.tmp", "w") as f:
+        json.dump(list(index.values()), f, ensure_ascii=False, indent=1)
+    os.replace(f"{index_path}.tmp", index_path)
+
+
+POSE_EXTRACTORS = {"holistic": HolisticPoseExtractor}
+SIGN_RECOGNIZERS = {"templates": TemplateRecognizer}
+
+
+def _load_plugin(name: str, known: dict):
+    """One of `known` by name, or any other class given as "module:Class"."""
+    if name in known:
+        return known[name]
+    module_name, _, class_name = name.partition(":")
+    if not class_name:
+        raise ValueError(f"Unknown plugin {name!r}, expected one of {list(known)} or module:Class")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class FrameSampler:
+    """
+    Adaptive subsampling of a video's frames: at most `max_fps` of them are kept, and as few as
+    `min_fps` while the signer holds still, i.e. while a frame's grayscale thumbnail differs from
+    the last kept one's by less than `motion_threshold` (mean absolute difference, 0 to 255).
+    """
+
+    def __init__(self, min_fps: float, max_fps: float, motion_threshold: float):
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.motion_threshold = motion_threshold
+        self._last_time = None
+        self._last_thumbnail = None
+
+    def keep(self, frame) -> bool:
+        """Whether to keep an av.VideoFrame, frames being given in order."""
+        time = frame.time or 0.0
+        if self._last_time is not None and time - self._last_time < 1 / self.max_fps:
+            return False
+
+        thumbnail = frame.reformat(width=THUMBNAIL_SIDE, height=THUMBNAIL_SIDE, format="gray").to_ndarray()
+        thumbnail = thumbnail.astype(np.int16)
+        if (
+            self._last_time is not None and time - self._last_time < 1 / self.min_fps
+            and np.abs(thumbnail - self._last_thumbnail).mean() < self.motion_threshold
+        ):
+            return False
+        self._last_time, self._last_thumbnail = time, thumbnail
+        return True
+
+    def slow_down(self):
+        self.min_fps /= 2
+        self.max_fps /= 2
+
+
+class PoseBuffer:
+    """
+    Poses of at most `max_frames` frames, in arrays allocated once. Once full, every other frame
+    is dropped and the sampler slowed down by as much: long videos keep being covered from
+    start to end, at a lower frame rate, within the same memory.
+    """
+
+    def __init__(self, max_frames: int, num_points: int, sampler: FrameSampler):
+        self.sampler = sampler
+        self.data = np.zeros((max_frames, 1, num_points, 3), dtype=np.float32)
+        self.confidence = np.zeros((max_frames, 1, num_points), dtype=np.float32)
+        self.times = np.zeros(max_frames, dtype=np.float64)
+        self.length = 0
+
+    def append(self, time: float, data: np.ndarray, confidence: np.ndarray):
+        if self.length == len(self.times):
+            kept = self.length // 2 + self.length % 2
+            for array in (self.data, self.confidence, self.times):
+                array[:kept] = array[:self.length:2]
+            self.length = kept
+            self.sampler.slow_down()
+        self.data[self.length, 0] = data
+        self.confidence[self.length, 0] = confidence
+        self.times[self.length] = time
+        self.length += 1
+
+    def to_pose(self, header):
+        import numpy.ma as ma
+        from pose_format import Pose
+        from pose_format.numpy import NumPyPoseBody
+
+        if self.length > 1 and self.times[self.length - 1] > self.times[0]:
+            fps = (self.length - 1) / (self.times[self.length - 1] - self.times[0])
+        else:
+            fps = self.sampler.max_fps
+        body = NumPyPoseBody(
+            fps=fps, data=ma.masked_array(self.data[:self.length].copy()),
+            confidence=self.confidence[:self.length].copy(),
+        )
+        return Pose(header, body)
+
+
+def extract_pose(video: bytes, extractor: PoseExtractor, sampler: FrameSampler, max_frames: int,
+                 max_side: int):
+    """
+    (pose, decoded frames) of a video, decoded one frame at a time: only the sampled frames
+    are converted to RGB, scaled down so that their longest side is at most max_side.
+    """
+    import av
+
+    extractor.reset()
+    buffer, header, decoded = None, None, 0
+    with av.open(BytesIO(video), mode="r") as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        for frame in container.decode(stream):
+            decoded += 1
+            if not sampler.keep(frame):
+                continue
+            if header is None:
+                scale = min(1.0, max_side / max(frame.width, frame.height))
+                # Even dimensions, like every encoder wants them
+                width, height = round(frame.width * scale / 2) * 2, round(frame.height * scale / 2) * 2
+                header = extractor.header(width, height)
+                buffer = PoseBuffer(max_frames, header.total_points(), sampler)
+            rgb = frame.reformat(width=width, height=height, format="rgb24").to_ndarray()
+            buffer.append(frame.time or 0.0, *extractor.extract(rgb))
+
+    if buffer is None:
+        return None, decoded
+    return buffer.to_pose(header), decoded
+
+
+def _init_worker(extractor_name: str, recognizer_name: str, recognizer_options: dict, sampling: dict):
+    global _worker_extractor, _worker_recognizer, _worker_sampling
+    _worker_extractor = _load_plugin(extractor_name, POSE_EXTRACTORS)()
+    _worker_recognizer = _load_plugin(recognizer_name, SIGN_RECOGNIZERS)(**recognizer_options)
+    _worker_sampling = sampling
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _recognize(video: bytes, signed: str) -> dict:
+    sampler = FrameSampler(_worker_sampling["min_fps"], _worker_sampling["max_fps"], _worker_sampling["motion_threshold"])
+    pose, decoded = extract_pose(
+        video, _worker_extractor, sampler, _worker_sampling["max_frames"], _worker_sampling["max_side"]
+    )
+    match = None if pose is None else _worker_recognizer.recognize(pose, signed)
+    return {"match": match, "decoded_frames": decoded, "pose_frames": 0 if pose is None else len(pose.body.data)}
+
+
+class SignRecognitionPool:
+    """
+    Recognizes signed videos in a pool of worker processes, each holding its own pose
+    extractor and recognizer, so that decoding and pose extraction never block the bot's
+    event loop. Extractor and recognizer are picked by name among POSE_EXTRACTORS and
+    SIGN_RECOGNIZERS, or given as "module:Class".
+
+    At most `workers` videos are processed at once and at most `max_queue` more wait for
+    a free worker; anything beyond that is rejected with RecognitionQueueFull.
+    """
+
+    def __init__(self, workers: int, max_queue: int, extractor: str, recognizer: str, recognizer_options: dict,
+                 sampling: dict):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.extractor = extractor
+        self.recognizer = recognizer
+        self.recognizer_options = recognizer_options
+        self.sampling = sampling
+        self._executor = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    def start(self):
+        if self._executor is not None:
+            return
+        logger.info(f"Starting {self.workers} sign recognition worker(s) with {self.extractor} and {self.recognizer}")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            # MediaPipe's graphs don't survive fork(), like torch
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.extractor, self.recognizer, self.recognizer_options, self.sampling),
+        )
+
+    async def warm_up(self):
+        """Spawns the workers and lets them load their models now rather than on the first videos."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)))
+        except BrokenProcessPool:
+            self.shutdown()
+            raise
+
+    async def recognize(self, video: bytes, signed: str):
+        """{"text", "spoken", "distance"} of what is signed in video, None when nothing is recognized."""
+        if self._pending >= self.capacity:
+            raise RecognitionQueueFull()
+
+        self.start()
+        self._pending += 1
+        try:
+            with metrics.stage("sign_recognition"):
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, _recognize, video, signed)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a huge video): start a fresh pool next time
+            self.shutdown()
+            raise
+        finally:
+            self._pending -= 1
+        logger.info(
+            f"Recognized {result['match']} from {result['pose_frames']} poses of {result['decoded_frames']} frames"
+        )
+        return result["match"]
+
+    def reload(self):
+        """Lets the videos already submitted finish, the next ones go to new workers loading new templates."""
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def shutdown(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
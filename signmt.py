@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import random
+import re
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Worth another try: rate limiting and transient server side failures
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:\u3002\uff01\uff1f])\s+")
+_CLAUSE_END = re.compile(r"(?<=,)\s+")
+
+
+class SignMTError(Exception):
+    """Raised when sign.mt can't provide a pose, after retries when they make sense."""
+
+
+def _pack(pieces: list, max_chars: int) -> list:
+    """Joins consecutive pieces back together as long as they fit in max_chars."""
+    packed = []
+    for piece in pieces:
+        if packed and len(packed[-1]) + 1 + len(piece) <= max_chars:
+            packed[-1] = f"{packed[-1]} {piece}"
+        else:
+            packed.append(piece)
+    return packed
+
+
+def split_phrases(text: str, max_chars: int) -> list:
+    """
+    Cuts text into its sentences, to be signed one after the other. Sentences longer than
+    max_chars are cut at their commas, and clauses still longer than that between words.
+    """
+    phrases = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        if len(sentence) <= max_chars:
+            phrases.append(sentence)
+            continue
+        for clause in _pack(_CLAUSE_END.split(sentence), max_chars):
+            phrases.extend([clause] if len(clause) <= max_chars else _pack(clause.split(), max_chars))
+    return [phrase for phrase in phrases if phrase]
+
+
+class SignMTClient:
+    """
+    Async client for the sign.mt spoken-text-to-signed-pose endpoint.
+
+    A single keep-alive connection pool is shared by every request, so consecutive
+    translations reuse the same TLS connection. Each attempt is bounded by `timeout`
+    and the whole call (retries and backoff included) by `deadline` seconds.
+    Transport errors and retryable status codes are retried up to `max_retries` times
+    with exponential backoff and full jitter. Every failure is raised as a SignMTError.
+
+    `base_url` can point to any stand-in server exposing the same query interface.
+    """
+
+    def __init__(self, base_url: str, timeout: float, deadline: float, max_retries: int,
+                 backoff: float, max_connections: int):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self._client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def fetch_pose(self, text: str, spoken: str, signed: str) -> bytes:
+        params = {"text": text, "spoken": spoken, "signed": signed}
+        with metrics.stage("signmt"):
+            try:
+                return await asyncio.wait_for(self._get_with_retries(params), self.deadline)
+            except asyncio.TimeoutError:
+                raise SignMTError(f"no pose within {self.deadline}s")
+
+    async def _get_with_retries(self, params: dict) -> bytes:
+        client = self._get_client()
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            try:
+                # httpx takes care of URL encoding the parameters
+                response = await client.get(self.base_url, params=params)
+                if response.status_code in RETRY_STATUS_CODES and not is_last_attempt:
+                    logger.warning(f"sign.mt answered {response.status_code}, retrying (attempt {attempt + 1})")
+                else:
+                    response.raise_for_status()
+                    return response.content
+            except httpx.HTTPStatusError as e:
+                raise SignMTError(str(e)) from e
+            except httpx.TransportError as e:
+                if is_last_attempt:
+                    raise SignMTError(str(e)) from e
+                logger.warning(f"sign.mt request failed ({e!r}), retrying (attempt {attempt + 1})")
+            except httpx.HTTPError as e:
+                # Not worth another try, e.g. a body that can't be decoded or a redirect loop
+                raise SignMTError(f"{e!r}") from e
+
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
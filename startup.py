@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """Wall clock time spent on each import, model load and warm-up step since the process started."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.timings.append((name, time.perf_counter() - start))
+
+    def format(self, title: str) -> str:
+        with self._lock:
+            timings = list(self.timings)
+        width = max((len(name) for name, _ in timings), default=0)
+        lines = [f"{title} after {time.perf_counter() - self.started:.2f}s"]
+        lines += [f"  {name:<{width}} {seconds * 1000:8.1f} ms" for name, seconds in timings]
+        return "\n".join(lines)
+
+
+class Lazy:
+    """
+    Heavy component built by `factory` on first use, from any thread, and timed in `report`.
+    Attribute access is forwarded to the component, so it can stand in for it directly.
+    """
+
+    def __init__(self, name: str, factory, report: StartupReport = None):
+        self.name = name
+        self._factory = factory
+        self._report = report
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    with self._report.measure(self.name) if self._report is not None else nullcontext():
+                        self._value = self._factory()
+                    self._loaded = True
+        return self._value
+
+    def __getattr__(self, attribute):
+        # Private names are Lazy's own, don't load anything for them (e.g. while unpickling)
+        if attribute.startswith("_"):
+            raise AttributeError(attribute)
+        return getattr(self.get(), attribute)
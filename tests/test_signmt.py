@@ -0,0 +1,121 @@
+"""SignMTClient against a local stand-in of the sign.mt endpoint."""
+import asyncio
+import os
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from signmt import SignMTClient, SignMTError
+
+
+class StandIn:
+    """
+    Answers each GET with the next of `responses`, the last one repeating: (status, headers,
+    body), or a number of seconds to wait before answering 200. Keeps the queries it got.
+    """
+
+    def __init__(self, responses: list):
+        self.responses = responses
+        self.queries = []
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/pose"
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                target = head.split(b" ", 2)[1].decode()
+                self.queries.append(parse_qs(urlsplit(target).query))
+                response = self.responses[min(len(self.queries), len(self.responses)) - 1]
+                if isinstance(response, (int, float)):
+                    await asyncio.sleep(response)
+                    response = (200, {}, b"late pose")
+                status, headers, body = response
+                lines = [f"HTTP/1.1 {status} Stand-in", f"Content-Length: {len(body)}"]
+                lines += [f"{name}: {value}" for name, value in headers.items()]
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._server.close()
+
+
+def _fetch(responses: list, deadline: float = 5, max_retries: int = 2, timeout: float = 5):
+    """Runs one fetch_pose against a stand-in: (pose bytes or the exception raised, stand-in)."""
+
+    async def run():
+        async with StandIn(responses) as stand_in:
+            client = SignMTClient(stand_in.url, timeout=timeout, deadline=deadline, max_retries=max_retries,
+                                  backoff=0.001, max_connections=2)
+            try:
+                return await client.fetch_pose("Hello & welcome", "en", "ase"), stand_in
+            except Exception as e:
+                return e, stand_in
+            finally:
+                await client.aclose()
+
+    return asyncio.run(run())
+
+
+def test_returns_the_pose_with_the_query_encoded():
+    pose, stand_in = _fetch([(200, {}, b"pose")])
+    assert pose == b"pose"
+    assert stand_in.queries == [{"text": ["Hello & welcome"], "spoken": ["en"], "signed": ["ase"]}]
+
+
+def test_retries_retryable_statuses():
+    pose, stand_in = _fetch([(503, {}, b""), (429, {}, b""), (200, {}, b"pose")])
+    assert pose == b"pose"
+    assert len(stand_in.queries) == 3
+
+
+def test_gives_up_after_max_retries():
+    error, stand_in = _fetch([(502, {}, b"")], max_retries=2)
+    assert isinstance(error, SignMTError)
+    assert len(stand_in.queries) == 3
+
+
+def test_does_not_retry_client_errors():
+    error, stand_in = _fetch([(404, {}, b"")])
+    assert isinstance(error, SignMTError)
+    assert len(stand_in.queries) == 1
+
+
+def test_retries_timed_out_attempts():
+    pose, stand_in = _fetch([2, (200, {}, b"pose")], timeout=0.2)
+    assert pose == b"pose"
+    assert len(stand_in.queries) == 2
+
+
+def test_deadline_bounds_the_whole_call():
+    started = time.perf_counter()
+    error, _ = _fetch([2], deadline=0.3, timeout=5)
+    assert isinstance(error, SignMTError)
+    assert time.perf_counter() - started < 1.5
+
+
+@pytest.mark.parametrize("response", [
+    # Not gzip at all: httpx.DecodingError
+    (200, {"Content-Encoding": "gzip"}, b"not gzip"),
+    # Redirecting to itself: httpx.TooManyRedirects
+    (302, {"Location": "/pose"}, b""),
+], ids=["undecodable body", "redirect loop"])
+def test_other_http_errors_are_signmt_errors(response):
+    error, _ = _fetch([response])
+    assert isinstance(error, SignMTError)
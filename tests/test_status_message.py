@@ -0,0 +1,94 @@
+"""StatusMessage against stand-ins of the user's message and of the status reply."""
+import asyncio
+import os
+import sys
+
+from telegram.error import TelegramError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from outbox import StatusMessage
+
+
+class Reply:
+
+    def __init__(self, text: str, fail_delete: bool = False):
+        self.texts = [text]
+        self.deleted = False
+        self.fail_delete = fail_delete
+
+    async def edit_text(self, text: str):
+        self.texts.append(text)
+
+    async def delete(self):
+        if self.fail_delete:
+            raise TelegramError("message can't be deleted")
+        self.deleted = True
+
+
+class UserMessage:
+
+    message_id = 1
+
+    def __init__(self, fail_delete: bool = False):
+        self.replies = []
+        self.fail_delete = fail_delete
+
+    async def reply_text(self, text: str, reply_to_message_id: int = None):
+        await asyncio.sleep(0.05)
+        self.replies.append(Reply(text, self.fail_delete))
+        return self.replies[-1]
+
+
+def _job(message: UserMessage, seconds: float, end):
+    async def job():
+        status = StatusMessage(message, delay=0.05, interval=0.05)
+        status.set("Working...")
+        await asyncio.sleep(seconds)
+        return await end(status)
+    return asyncio.run(job())
+
+
+def test_close_deletes_a_status_sent():
+    message = UserMessage()
+    _job(message, 0.2, lambda status: status.close())
+    assert len(message.replies) == 1
+    assert message.replies[0].deleted
+
+
+def test_close_while_sending_deletes_the_status_once_sent():
+    message = UserMessage()
+    _job(message, 0.07, lambda status: status.close())
+    assert len(message.replies) == 1
+    assert message.replies[0].deleted
+
+
+def test_close_before_the_delay_sends_nothing():
+    message = UserMessage()
+
+    async def end(status):
+        await status.close()
+        await asyncio.sleep(0.1)
+
+    _job(message, 0.01, end)
+    assert message.replies == []
+
+
+def test_a_status_taken_is_not_deleted_on_close():
+    message = UserMessage()
+
+    async def end(status):
+        reply, text = await status.take()
+        await status.close()
+        return reply, text
+
+    reply, text = _job(message, 0.2, end)
+    assert text == "Working..."
+    assert reply is message.replies[0]
+    assert not reply.deleted
+
+
+def test_a_status_that_cant_be_deleted_is_left_alone():
+    message = UserMessage(fail_delete=True)
+    _job(message, 0.2, lambda status: status.close())
+    assert not message.replies[0].deleted
@@ -0,0 +1,114 @@
+"""Cutting long voice notes, and the batched Whisper pass falling back to regular transcriptions."""
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import transcriber
+from transcriber import SAMPLE_RATE, SPLIT_FRAME_SAMPLES, WINDOW_SAMPLES, split_audio
+
+
+def _noise(seconds: float, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).uniform(-0.5, 0.5, int(seconds * SAMPLE_RATE)).astype(np.float32)
+
+
+def test_short_audio_is_a_single_slice():
+    audio = _noise(WINDOW_SAMPLES / SAMPLE_RATE)
+    slices = split_audio(audio)
+    assert len(slices) == 1
+    assert np.array_equal(slices[0], audio)
+
+
+def test_long_audio_is_cut_in_the_quietest_frame_of_each_window_end():
+    audio = _noise(70)
+    # Silent frames in the last 5 seconds of the first window and of the window starting at the first cut
+    first_silence = 27 * SAMPLE_RATE
+    audio[first_silence:first_silence + SPLIT_FRAME_SAMPLES] = 0
+    first_cut = first_silence + SPLIT_FRAME_SAMPLES // 2
+    second_silence = first_cut + 27 * SAMPLE_RATE
+    audio[second_silence:second_silence + SPLIT_FRAME_SAMPLES] = 0
+    second_cut = second_silence + SPLIT_FRAME_SAMPLES // 2
+
+    slices = split_audio(audio)
+
+    assert [len(s) for s in slices] == [first_cut, second_cut - first_cut, len(audio) - second_cut]
+    assert all(len(s) <= WINDOW_SAMPLES for s in slices)
+    assert np.array_equal(np.concatenate(slices), audio)
+
+
+def test_slices_never_exceed_the_window_without_silence():
+    audio = _noise(95, seed=1)
+    slices = split_audio(audio)
+    assert all(len(s) <= WINDOW_SAMPLES for s in slices)
+    assert np.array_equal(np.concatenate(slices), audio)
+
+
+def _decoded(text: str, language: str = "en", no_speech_prob: float = 0.01, avg_logprob: float = -0.2,
+             compression_ratio: float = 1.5):
+    return SimpleNamespace(text=text, language=language, no_speech_prob=no_speech_prob, avg_logprob=avg_logprob,
+                           compression_ratio=compression_ratio)
+
+
+@pytest.fixture
+def fake_whisper(monkeypatch):
+    """
+    A worker model whose batched decode answers, for each language, the `decodings` of the keys
+    listed in `pending`, and whose regular transcribe always answers "fallback".
+    """
+    torch = pytest.importorskip("torch")
+    decoding = pytest.importorskip("whisper.decoding")
+
+    calls = SimpleNamespace(decode=[], transcribe=[], decodings={}, pending={})
+
+    def decode(model, mel, options):
+        calls.decode.append((len(mel), options.language))
+        return [calls.decodings[key] for key in calls.pending.pop(options.language)]
+
+    def transcribe(audio, language=None):
+        calls.transcribe.append((len(audio), language))
+        return {"text": "fallback", "language": language or "en"}
+
+    monkeypatch.setattr(decoding, "decode", decode)
+    monkeypatch.setattr(transcriber, "_worker_model", SimpleNamespace(
+        dims=SimpleNamespace(n_mels=80), device=torch.device("cpu"), transcribe=transcribe
+    ))
+    return calls
+
+
+def test_batch_keeps_good_decodings_and_falls_back_on_the_others(fake_whisper):
+    fake_whisper.decodings = {
+        "good": _decoded("good"),
+        "repetitive": _decoded("la la la", compression_ratio=3.0),
+        "unsure": _decoded("??", avg_logprob=-1.5),
+        "silence": _decoded("", no_speech_prob=0.9, avg_logprob=-1.5),
+    }
+    fake_whisper.pending = {None: ["good", "repetitive", "unsure", "silence"]}
+    items = [(_noise(3, seed=i), None) for i in range(4)] + [(_noise(40), None)]
+
+    results = transcriber._transcribe_batch(items)
+
+    # A single batched pass for the short ones, the long one never goes through it
+    assert fake_whisper.decode == [(4, None)]
+    assert results == [
+        {"text": "good", "language": "en"},
+        {"text": "fallback", "language": "en"},
+        {"text": "fallback", "language": "en"},
+        {"text": "", "language": "en"},
+        {"text": "fallback", "language": "en"},
+    ]
+    assert fake_whisper.transcribe == [(3 * SAMPLE_RATE, None), (3 * SAMPLE_RATE, None), (40 * SAMPLE_RATE, None)]
+
+
+def test_batch_decodes_each_language_separately(fake_whisper):
+    fake_whisper.decodings = {"ciao": _decoded("ciao", "it"), "hello": _decoded("hello", "en")}
+    fake_whisper.pending = {"it": ["ciao"], "en": ["hello"]}
+
+    results = transcriber._transcribe_batch([(_noise(2), "it"), (_noise(2, seed=1), "en")])
+
+    assert sorted(fake_whisper.decode) == [(1, "en"), (1, "it")]
+    assert [result["text"] for result in results] == ["ciao", "hello"]
+    assert fake_whisper.transcribe == []
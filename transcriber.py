@@ -0,0 +1,262 @@
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Mirrors whisper.audio.SAMPLE_RATE / N_SAMPLES, kept here so the bot process never imports torch
+SAMPLE_RATE = 16000
+WINDOW_SAMPLES = 30 * SAMPLE_RATE
+# Long audio is cut at the quietest 100 ms frame among the last seconds of each window
+SPLIT_SEARCH_SAMPLES = 5 * SAMPLE_RATE
+SPLIT_FRAME_SAMPLES = SAMPLE_RATE // 10
+
+# Same defaults whisper.transcribe uses to decide a decoding went wrong or heard only silence
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+# Whisper model owned by the current worker process, loaded once by _init_worker
+_worker_model = None
+
+
+class TranscriptionQueueFull(Exception):
+    """Raised when every worker is busy and the waiting queue is at capacity."""
+
+
+def _init_worker(model_name: str):
+    global _worker_model
+    import whisper
+
+    _worker_model = whisper.load_model(model_name)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _transcribe(audio, language: str = None) -> dict:
+    result = _worker_model.transcribe(audio, language=language)
+    # Only ship back what the handlers use, segments can be large to pickle
+    return {"text": result["text"], "language": result["language"]}
+
+
+def _transcribe_batch(items: list) -> list:
+    """
+    Transcribes every (audio, language) item fitting in a single 30 seconds Whisper window with
+    one batched encoder/decoder pass per language (None: detect it); longer ones, and the rare
+    decodings that fail the usual quality checks, go through the regular (temperature fallback)
+    transcribe path.
+    """
+    import torch
+    from whisper.audio import log_mel_spectrogram, pad_or_trim
+    from whisper.decoding import DecodingOptions, decode
+
+    results = [None] * len(items)
+    short_by_language = {}
+    for i, (audio, language) in enumerate(items):
+        if len(audio) <= WINDOW_SAMPLES:
+            short_by_language.setdefault(language, []).append(i)
+
+    for language, short in short_by_language.items():
+        mel = torch.stack([
+            log_mel_spectrogram(pad_or_trim(items[i][0]), _worker_model.dims.n_mels) for i in short
+        ]).to(_worker_model.device)
+        options = DecodingOptions(
+            language=language, fp16=_worker_model.device.type == "cuda", without_timestamps=True
+        )
+
+        for i, decoded in zip(short, decode(_worker_model, mel, options)):
+            if decoded.no_speech_prob > NO_SPEECH_THRESHOLD and decoded.avg_logprob < LOGPROB_THRESHOLD:
+                results[i] = {"text": "", "language": decoded.language}
+            elif decoded.compression_ratio <= COMPRESSION_RATIO_THRESHOLD and decoded.avg_logprob >= LOGPROB_THRESHOLD:
+                results[i] = {"text": decoded.text, "language": decoded.language}
+
+    for i, (audio, language) in enumerate(items):
+        if results[i] is None:
+            results[i] = _transcribe(audio, language)
+
+    return results
+
+
+def split_audio(audio: np.ndarray, max_samples: int = WINDOW_SAMPLES) -> list:
+    """
+    Cuts audio into slices of at most max_samples, each one ending at the quietest
+    SPLIT_FRAME_SAMPLES frame of its last SPLIT_SEARCH_SAMPLES, to avoid cutting words.
+    """
+    slices, start = [], 0
+    while len(audio) - start > max_samples:
+        search_start = start + max_samples - SPLIT_SEARCH_SAMPLES
+        frames = SPLIT_SEARCH_SAMPLES // SPLIT_FRAME_SAMPLES
+        energy = np.square(
+            audio[search_start:search_start + frames * SPLIT_FRAME_SAMPLES].reshape(frames, SPLIT_FRAME_SAMPLES)
+        ).sum(axis=1)
+        cut = search_start + int(np.argmin(energy)) * SPLIT_FRAME_SAMPLES + SPLIT_FRAME_SAMPLES // 2
+        slices.append(audio[start:cut])
+        start = cut
+    slices.append(audio[start:])
+    return slices
+
+
+class TranscriptionPool:
+    """
+    Runs Whisper transcriptions in a pool of worker processes, each holding its own
+    copy of the model, so that a long voice note never blocks the bot's event loop.
+
+    Voice notes up to 30 seconds arriving within `max_wait` seconds of each other are
+    grouped into batches of up to `batch_size` and transcribed with a single model pass.
+    Longer ones are cut into 30 seconds slices transcribed one after the other, in the same
+    language as the first one: other voice notes get transcribed in between instead of
+    waiting for a long one to be done, and transcribe_segments hands out each slice's text
+    as soon as it is there.
+
+    At most `workers` batches run at once and at most `max_queue` more voice notes wait
+    for a free worker; anything beyond that is rejected with TranscriptionQueueFull.
+    """
+
+    def __init__(self, model_name: str, workers: int, max_queue: int, batch_size: int = 1, max_wait: float = 0):
+        self.model_name = model_name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self._executor = None
+        self._pending = 0
+        self._batch = []
+        self._flush_handle = None
+        self._batch_tasks = set()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def capacity(self) -> int:
+        return self.workers * self.batch_size + self.max_queue
+
+    def start(self):
+        if self._executor is not None:
+            return
+        logger.info(f"Starting {self.workers} transcription worker(s) with Whisper '{self.model_name}'")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            # torch does not survive fork() reliably, always start clean interpreters
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model_name,),
+        )
+
+    async def warm_up(self):
+        """Spawns the workers and lets them load the model now rather than on the first voice notes."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)))
+        except BrokenProcessPool:
+            self.shutdown()
+            raise
+
+    async def transcribe(self, audio) -> dict:
+        texts, language = [], None
+        async with contextlib.aclosing(self.transcribe_segments(audio)) as segments:
+            async for segment in segments:
+                texts.append(segment["text"])
+                language = segment["language"]
+        return {"text": "".join(texts), "language": language}
+
+    async def transcribe_segments(self, audio):
+        """
+        Yields the transcription of audio one 30 seconds slice at a time, as {"text", "language"}
+        dicts, as soon as each one is done. The next slice is already being transcribed while the
+        caller handles the current one.
+        """
+        if self._pending >= self.capacity:
+            raise TranscriptionQueueFull()
+
+        self.start()
+        self._pending += 1
+        next_slice = None
+        try:
+            slices = split_audio(audio)
+            if len(slices) > 1:
+                logger.info(f"Transcribing a long voice note in {len(slices)} slices")
+            with metrics.stage("transcribe"):
+                segment = await self._transcribe_window(slices[0])
+            # Following slices are in the language heard in the first one
+            language = segment["language"]
+            for audio_slice in slices[1:]:
+                next_slice = asyncio.ensure_future(self._transcribe_window(audio_slice, language))
+                yield segment
+                with metrics.stage("transcribe"):
+                    segment = await next_slice
+                next_slice = None
+            yield segment
+        finally:
+            if next_slice is not None:
+                # The caller gave up on the rest of the voice note
+                next_slice.cancel()
+            self._pending -= 1
+
+    async def _transcribe_window(self, audio, language: str = None) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue((audio, language), future)
+        return await future
+
+    def _enqueue(self, item, future):
+        self._batch.append((item, future))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._batch = self._batch, []
+        if batch:
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: list):
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: list):
+        loop = asyncio.get_running_loop()
+        items = [item for item, _ in batch]
+        self.start()
+        try:
+            if len(items) > 1:
+                logger.info(f"Transcribing a batch of {len(items)} voice notes")
+            results = await loop.run_in_executor(self._executor, _transcribe_batch, items)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker died (e.g. OOM while loading the model): start a fresh pool next time
+                self.shutdown()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def shutdown(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
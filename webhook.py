@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+
+import h11
+import httpx
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Telegram updates are a few KB, anything much larger is not one
+MAX_BODY_BYTES = 1024 * 1024
+_READ_CHUNK_BYTES = 64 * 1024
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+async def _read_request(connection: h11.Connection, reader: asyncio.StreamReader):
+    """Next (request, body) received on connection, None once the client is done with it."""
+    request, body = None, bytearray()
+    while True:
+        event = connection.next_event()
+        if event is h11.NEED_DATA:
+            connection.receive_data(await reader.read(_READ_CHUNK_BYTES))
+        elif isinstance(event, h11.Request):
+            request = event
+        elif isinstance(event, h11.Data):
+            body += event.data
+            if len(body) > MAX_BODY_BYTES:
+                raise _BodyTooLarge()
+        elif isinstance(event, h11.EndOfMessage):
+            return request, bytes(body)
+        elif isinstance(event, h11.ConnectionClosed):
+            return None
+
+
+async def serve_http(handler, host: str, port: int, content_type: str = "application/json") -> asyncio.AbstractServer:
+    """
+    Minimal keep-alive HTTP/1.1 server: `await handler(method, path, headers, body)` answers
+    every request with a (status, body) pair, body being of content_type. Header names are lowercase.
+    """
+
+    async def send_response(connection, writer, status: int, body: bytes):
+        headers = [("content-type", content_type), ("content-length", str(len(body)))]
+        writer.write(connection.send(h11.Response(status_code=status, headers=headers)))
+        writer.write(connection.send(h11.Data(data=body)))
+        writer.write(connection.send(h11.EndOfMessage()))
+        await writer.drain()
+
+    async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = h11.Connection(h11.SERVER)
+        try:
+            while True:
+                try:
+                    received = await _read_request(connection, reader)
+                except _BodyTooLarge:
+                    await send_response(connection, writer, 413, b"")
+                    break
+                if received is None:
+                    break
+
+                request, body = received
+                headers = {name.decode().lower(): value.decode() for name, value in request.headers}
+                try:
+                    status, response_body = await handler(request.method.decode(), request.target.decode(), headers, body)
+                except Exception:
+                    logger.exception(f"Error while handling {request.method.decode()} {request.target.decode()}")
+                    status, response_body = 500, b""
+                await send_response(connection, writer, status, response_body)
+
+                if connection.our_state is h11.MUST_CLOSE:
+                    break
+                connection.start_next_cycle()
+        except (h11.ProtocolError, ConnectionError, asyncio.CancelledError):
+            # Cancelled: the server is shutting down with this keep-alive connection still open
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connection, host, port)
+
+
+def update_user_id(update: dict):
+    """User an update JSON comes from, else its chat; None for the rare updates with neither."""
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        for user_key in ("from", "user"):
+            if isinstance(value.get(user_key), dict):
+                return value[user_key]["id"]
+        # Channel posts have no user. Callback queries carry the chat in the message their button belongs to
+        for container in (value, value.get("message")):
+            if isinstance(container, dict) and isinstance(container.get("chat"), dict):
+                return container["chat"]["id"]
+    return None
+
+
+class UpdateRouter:
+    """
+    Receives the updates Telegram posts to the webhook and forwards each one to one of
+    `worker_urls`, always the same one for a given user, so that a user's settings cached by a
+    worker (see persistence.UserPrefsStore), jobs and ordering live in a single worker process.
+    Updates without a user go by their chat. Workers can run on this machine or on others.
+
+    The answer to Telegram is the worker's: an unreachable worker gets the update retried
+    later by Telegram rather than lost.
+    """
+
+    def __init__(self, worker_urls: list, secret_token: str = None, timeout: float = 10):
+        self.worker_urls = worker_urls
+        self.secret_token = secret_token
+        self.timeout = timeout
+        self.forwarded = [0] * len(worker_urls)
+        self._client = None
+
+    def worker_for(self, update: dict) -> int:
+        user_id = update_user_id(update)
+        key = user_id if user_id is not None else update.get("update_id", 0)
+        return key % len(self.worker_urls)
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes):
+        if method != "POST":
+            return 405, b""
+        if self.secret_token and headers.get(SECRET_TOKEN_HEADER) != self.secret_token:
+            return 403, b""
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return 400, b""
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout))
+        worker = self.worker_for(update)
+        forward_headers = {"content-type": "application/json"}
+        if self.secret_token:
+            forward_headers[SECRET_TOKEN_HEADER] = self.secret_token
+        try:
+            response = await self._client.post(self.worker_urls[worker], content=body, headers=forward_headers)
+        except httpx.HTTPError as e:
+            logger.warning(f"Can't forward update to worker {worker} ({self.worker_urls[worker]}): {e!r}")
+            return 502, b""
+        self.forwarded[worker] += 1
+        return response.status_code, b""
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class UpdateReceiver:
+    """Worker side of the webhook: queues the updates forwarded by the router into a PTB Application."""
+
+    def __init__(self, application, secret_token: str = None):
+        self.application = application
+        self.secret_token = secret_token
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes):
+        if method != "POST":
+            return 405, b""
+        if self.secret_token and headers.get(SECRET_TOKEN_HEADER) != self.secret_token:
+            return 403, b""
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, KeyError, TypeError):
+            return 400, b""
+        await self.application.update_queue.put(update)
+        return 200, b""